@@ -7,10 +7,10 @@ import re
 # Server configuration
 FLASK_SERVER_URL = "http://<flask-server-ip>:5000"  # Replace <flask-server-ip> with your server's IP address
 
-# Sanitize property names
+# Sanitize property names (the same rule as schema.column_key, which names the refined files)
 def sanitize_name(name):
-    """Replace all non-alphanumeric characters with underscores."""
-    return re.sub(r"[^a-zA-Z0-9]", "_", name)
+    """Replace each run of characters other than letters, digits, "#", "$" and "&" with one underscore."""
+    return re.sub(r"[^0-9A-Za-z#$&]+", "_", name).strip("_")
 
 # Fetch available properties from the Flask server
 def get_available_properties():
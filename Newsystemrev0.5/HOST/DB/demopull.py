@@ -3,6 +3,11 @@ import pandas as pd
 from faker import Faker
 from datetime import timedelta
 import os
+import sys
+
+# atomic_file lives in HOST/, one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from atomic_file import atomic_path, file_lock
 
 # Initialize Faker to generate random names and addresses
 fake = Faker()
@@ -191,7 +196,9 @@ def generate_excel_data(num_rows):
     # Save the DataFrame to an Excel file, replacing the existing file "aggregated_data2.xlsx"
     current_directory = os.path.dirname(os.path.realpath(__file__))
     file_path = os.path.join(current_directory, "aggregated_data2.xlsx")
-    df.to_excel(file_path, index=False)
+    # Swapped in whole, so a running host never reads a half-written workbook
+    with file_lock(file_path), atomic_path(file_path) as temp_path:
+        df.to_excel(temp_path, index=False)
 
 # Prompt the user for the number of rows to generate
 num_rows = int(input("Enter the number of rows to generate: "))
@@ -1,9 +1,34 @@
 # standalone_server.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
 import pandas as pd
 import os
+import argparse
+import atexit
+import json
 import logging
+import time
+from collections import Counter
 from colorama import Fore, Style, init
+import table_cache
+import aggregates
+import date_index
+import value_index
+import text_index
+import query
+import change_feed
+import refined_store
+import importer
+import journal
+import replica
+import response_cache
+import scheduler
+import jobs
+import atomic_file
+import wire_format
+import memory
+import profiling
+import telemetry
+from schema import COMPLETED_STATUSES, DEFAULT_HEADERS, parse_date_arg, status_column
 
 # Initialize colorama for colored output
 init(autoreset=True)
@@ -12,16 +37,51 @@ init(autoreset=True)
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))  # Base directory of the script
 DB_DIR = os.path.join(BASE_DIR, "DB")  # Directory for DB
 EXCEL_FILE_PATH = os.path.join(DB_DIR, "aggregated_data2.xlsx")  # Path for the Excel file
-REFINED_DIR = os.path.join(DB_DIR, "refined")  # Directory for refined files
+REFINED_DIR = os.path.join(DB_DIR, "refined")  # Legacy refined .txt files (imported into the vocabulary store once)
+VOCABULARY_PATH = os.path.join(DB_DIR, "vocabulary.sqlite3")  # Refined vocabularies with usage counts
+JOURNAL_DIR = os.path.join(DB_DIR, "journal")  # Write journal and table snapshots
+JOURNAL_RETENTION_DAYS = 14  # How far back /history and journal.py restore can go
+SNAPSHOT_INTERVAL = 300  # Seconds between table snapshots
+WORKBOOK_FLUSH_DELAY = 30  # Save the workbook once writes pause this long (seconds)...
+WORKBOOK_FLUSH_MAX_DELAY = 300  # ...or at the latest this long after a change
+IMPORTS_DIR = os.path.join(DB_DIR, "imports")  # Uploaded import files and their rejects reports
+# Memory budgets in bytes, None for no limit (see memory.py); --memory NAME=SIZE overrides one
+MEMORY_BUDGETS = {
+    "table": None,  # Over this the free-text columns (NOTES, Description) are kept on disk in COLD_COLUMNS_PATH
+    "response_cache": 64 * 1024 * 1024,  # Pre-serialized /get_data, /list_refined... responses
+    "suggestions": 32 * 1024 * 1024,  # Sorted lists behind the S.O.# picker, /distinct and word search
+}
+COLD_COLUMNS_PATH = os.path.join(DB_DIR, "cold_columns.sqlite3")  # Rebuilt on every start
+JOBS_PATH = os.path.join(DB_DIR, "jobs.sqlite3")  # Background job records
+JOB_RESULTS_DIR = os.path.join(DB_DIR, "jobs")  # Export files and other job results
+JOB_WORKERS = 2  # Background jobs running at once
+JOB_RETENTION_DAYS = 7  # Job records and result files are deleted after this long
+# Per-client limits by request class (see scheduler.py): (requests per second, burst)
+RATE_LIMITS = {"interactive": (20.0, 40), "bulk": (10.0, 20)}
+BULK_CONCURRENCY = 2  # Bulk requests (exports, queries, imports) running at once across all clients
+BULK_QUEUE_TIMEOUT = 30  # Seconds a bulk request waits for a free slot before the client is told to retry
+TELEMETRY_PATH = os.path.join(DB_DIR, "telemetry.sqlite3")  # Timings reported by the USER tools
+TELEMETRY_RETENTION_DAYS = 30  # Reported timings are deleted after this long
+PROFILE_DIR = os.path.join(DB_DIR, "profiles")  # Slow-request stacks and X-Profile stats (see profiling.py)
+PROFILE_SLOW_REQUEST_MS = None  # Save the stacks of requests slower than this; None is off (--profile-slow-ms sets it)
 
-# Predefined headers for the Excel file
-DEFAULT_HEADERS = [
-    "S.O.#", "Dwg.", "REP", "Customer", "Contact", "P.O.#", "Quantity", 
-    "Description", "Cost Each", "Start Date", "Due Date", "Completion Date", 
-    "Total $'s", "NOTES", "Received in Engineering", "Engineer Start Date", 
-    "Released Date", "Customer Number", "Engineer Status", "machine type", 
-    "Tooling type", "Tube O.D.", "Tube C.L.R.", "Tube W.T.", "Unit"
-]
+# Command line: python HOST.py [--port 5000] [--replica-of http://primary:5000] [--memory table=1GB]
+#               [--profile-slow-ms 2000]
+parser = argparse.ArgumentParser(description="Job table host.")
+parser.add_argument("--port", type=int, default=5000, help="port to listen on")
+parser.add_argument("--replica-of", metavar="URL",
+                    help="run as a read replica of the host at URL (reads served here, writes forwarded)")
+parser.add_argument("--memory", metavar="NAME=SIZE", action="append", default=[],
+                    help=f"memory budget ({', '.join(MEMORY_BUDGETS)}) as e.g. 512MB, 2GB or none; repeatable")
+parser.add_argument("--profile-slow-ms", type=int, metavar="MS", default=PROFILE_SLOW_REQUEST_MS,
+                    help="save the stacks of requests slower than MS milliseconds to DB/profiles")
+ARGS, _ = parser.parse_known_args()
+REPLICA_OF = ARGS.replica_of
+for setting in ARGS.memory:
+    name, _, size = setting.partition("=")
+    if name.strip() not in MEMORY_BUDGETS:
+        parser.error(f"unknown memory budget {name!r}; use one of {', '.join(MEMORY_BUDGETS)}")
+    MEMORY_BUDGETS[name.strip()] = memory.parse_size(size)
 
 # Ensure necessary directories exist
 os.makedirs(DB_DIR, exist_ok=True)
@@ -54,47 +114,222 @@ def ensure_excel_file():
     if not os.path.exists(EXCEL_FILE_PATH):
         log_and_print("Excel file not found. Creating a new file with default headers...", color=Fore.YELLOW)
         df = pd.DataFrame(columns=DEFAULT_HEADERS)  # Create an empty DataFrame with default headers
-        df.to_excel(EXCEL_FILE_PATH, index=False, engine="openpyxl")
+        with atomic_file.atomic_path(EXCEL_FILE_PATH) as temp_path:
+            df.to_excel(temp_path, index=False, engine="openpyxl")
         log_and_print(f"Excel file created at: {EXCEL_FILE_PATH}", color=Fore.GREEN)
     else:
         log_and_print("Excel file already exists.", color=Fore.CYAN)
 
-def ensure_txt_files_and_sync(headers, df):
-    """Ensure a .txt file exists for each header and synchronize its contents."""
-    for header in headers:
-        sanitized_header = header.replace(" ", "_").replace("/", "_").replace(".", "_")
-        file_path = os.path.join(REFINED_DIR, f"{sanitized_header}.txt")
+def run_sync_refined_job(job_id, params, progress):
+    """Job: recount the refined vocabularies from the table."""
+    progress("Counting refined values in the table")
+    counted = refined_store.sync(table_cache.get_table())
+    change_feed.publish("refined_sync", {})
+    log_and_print(f"Refined files synchronized successfully ({counted} values recounted).", color=Fore.GREEN)
+    return {"recounted": counted}, None
 
-        # Extract unique values for this column
-        column_values = df[header].dropna().unique().astype(str).tolist()
+def run_rebuild_refined_job(job_id, params, progress):
+    """Job: recount every refined vocabulary from the table into a fresh store (values no row holds are dropped)."""
+    progress("Recounting every refined vocabulary")
+    started = time.time()
+    timings = refined_store.rebuild(table_cache.get_table(), legacy_dir=REFINED_DIR)
+    change_feed.publish("refined_sync", {})
+    for header, timing in sorted(timings.items(), key=lambda item: -item[1]["seconds"]):
+        log_and_print(f"  {header}: {timing['values']} values in {timing['seconds'] * 1000:.1f} ms", color=Fore.CYAN)
+    log_and_print(f"Rebuilt {len(timings)} refined vocabularies in {time.time() - started:.2f}s.", color=Fore.GREEN)
+    return {"columns": timings, "seconds": round(time.time() - started, 3)}, None
 
-        if not os.path.exists(file_path):
-            log_and_print(f"Creating new file: {file_path}", color=Fore.YELLOW)
-            with open(file_path, "w") as file:
-                file.write("\n".join(column_values))
+def run_export_job(job_id, params, progress):
+    """Job: write the rows matching params["filters"] (as for /query) to an xlsx or csv file."""
+    extension = ".csv" if params.get("format") == "csv" else ".xlsx"
+    progress("Selecting rows")
+    with table_cache.locked():  # A private copy, so writes during the export do not change it under us
+        df = table_cache.get_table().copy()
+    rows, _ = query.select(df, filters=params.get("filters"), sort=params.get("sort"))
+    rows = table_cache.with_cold(rows)
+    progress(f"Writing {len(rows)} rows", 0.1)
+    path = jobs.result_path(job_id, extension)
+    with atomic_file.atomic_path(path) as temp_path:
+        if extension == ".csv":
+            rows.to_csv(temp_path, index=False)
         else:
-            log_and_print(f"File exists: {file_path}. Updating...", color=Fore.CYAN)
-            with open(file_path, "r") as file:
-                existing_values = {line.strip() for line in file if line.strip()}
-            
-            updated_values = sorted(existing_values.union(column_values))
-            
-            with open(file_path, "w") as file:
-                file.write("\n".join(updated_values))
+            rows.to_excel(temp_path, index=False, engine="openpyxl")
+    log_and_print(f"Exported {len(rows)} rows to {path}.", color=Fore.GREEN)
+    return {"rows": len(rows), "format": extension[1:]}, path
 
-            log_and_print(f"Updated file: {file_path} with {len(updated_values)} values", color=Fore.GREEN)
+def run_import_job(job_id, params, progress):
+    """Job: import an uploaded file kept by save_import_upload."""
+    name = os.path.basename(params["path"])
+    try:
+        result = importer.import_file(params["path"], mapping=params.get("mapping"), dry_run=params.get("dry_run", False),
+                                      rejects_dir=IMPORTS_DIR, log=progress)
+    finally:
+        remove_import_upload(params["path"])
+    log_and_print(f"Imported {name}: {result['accepted']} rows accepted, {result['rejected']} rejected.",
+                  color=Fore.GREEN)
+    return result, result["rejects_file"]
+
+def run_reindex_job(job_id, params, progress):
+    """Job: rebuild the rollups and indexes from the table."""
+    rebuilt = [("aggregates", aggregates), ("date index", date_index),
+               ("value index", value_index), ("text index", text_index)]
+    started = time.time()
+    for done, (name, module) in enumerate(rebuilt):
+        progress(f"Rebuilding the {name}", done / len(rebuilt))
+        table_cache.replay_reload(module.on_table_change)
+    log_and_print(f"Rebuilt {len(rebuilt)} indexes in {time.time() - started:.1f}s.", color=Fore.GREEN)
+    return {"rebuilt": [name for name, _ in rebuilt], "seconds": round(time.time() - started, 2)}, None
+
+def register_jobs():
+    """Open the job table and register the background job kinds."""
+    jobs.open_jobs(JOBS_PATH, JOB_RESULTS_DIR, workers=JOB_WORKERS, retention_days=JOB_RETENTION_DAYS,
+                   expire_dirs=[IMPORTS_DIR])
+    jobs.register("sync_refined", run_sync_refined_job)
+    jobs.register("rebuild_refined", run_rebuild_refined_job)
+    jobs.register("export", run_export_job)
+    jobs.register("import", run_import_job)
+    jobs.register("reindex", run_reindex_job)
+
+def log_spilled_columns():
+    spilled = table_cache.spilled_columns()
+    if spilled:
+        log_and_print(f"The table is over its memory budget; {', '.join(spilled)} kept on disk.", color=Fore.YELLOW)
+
+def initialize_replica():
+    """Replica mode: copy the primary's table and follow its journal (see replica.py)."""
+    log_and_print(f"Starting as a replica of {REPLICA_OF}...", color=Fore.BLUE)
+    table_cache.add_listener(aggregates.on_table_change)
+    table_cache.add_listener(date_index.on_table_change)
+    table_cache.add_listener(value_index.on_table_change)
+    table_cache.add_listener(text_index.on_table_change)
+    table_cache.add_listener(change_feed.on_table_change)
+    table_cache.add_listener(refined_store.on_table_change)
+    seq = replica.start(REPLICA_OF)
+    df = table_cache.get_table()
+    # Its own vocabulary store, so a replica can run next to the primary on one machine
+    refined_store.load(os.path.join(DB_DIR, f"vocabulary_replica_{ARGS.port}.sqlite3"), list(df.columns),
+                       legacy_dir=REFINED_DIR)
+    refined_store.sync(df)
+    log_and_print(f"Replica has {len(df)} rows, current to journal entry {seq}.", color=Fore.GREEN)
+    log_spilled_columns()
 
 def initialize_files():
-    """Check the Excel file, create .txt files for each header, and sanitize them."""
+    """Check the Excel file, load the table and the refined vocabularies."""
     log_and_print("Initializing files...", color=Fore.BLUE)
+    # One host per DB folder: a second one would write the same workbook and journal
+    if not atomic_file.hold_lock(os.path.join(DB_DIR, "host")):
+        log_and_print(f"Another host is already running on {DB_DIR}; exiting.", color=Fore.RED, level="error")
+        raise SystemExit(1)
     ensure_excel_file()  # Ensure the Excel file exists
-    df = pd.read_excel(EXCEL_FILE_PATH)
-    headers = list(df.columns)
-    ensure_txt_files_and_sync(headers, df)
+    table_cache.add_listener(journal.on_table_change)  # First: a write is durable before anyone sees it
+    table_cache.add_listener(aggregates.on_table_change)
+    table_cache.add_listener(date_index.on_table_change)
+    table_cache.add_listener(value_index.on_table_change)
+    table_cache.add_listener(text_index.on_table_change)
+    table_cache.add_listener(change_feed.on_table_change)
+    table_cache.add_listener(refined_store.on_table_change)
+    journal.open_journal(JOURNAL_DIR, EXCEL_FILE_PATH, retention_days=JOURNAL_RETENTION_DAYS)
+    table_cache.load(EXCEL_FILE_PATH)  # Read the workbook once; routes use the cached copy
+    log_spilled_columns()
+    df = table_cache.get_table()
+    refined_store.load(VOCABULARY_PATH, list(df.columns), legacy_dir=REFINED_DIR)
+    log_and_print(f"Counted {refined_store.sync(df)} refined values from the table.", color=Fore.CYAN)
+
+    # Writes are journaled, so the workbook is saved in the background instead of on every write
+    table_cache.start_flusher(WORKBOOK_FLUSH_DELAY, WORKBOOK_FLUSH_MAX_DELAY)
+    atexit.register(table_cache.flush)
+    replayed = journal.recover()
+    if replayed:
+        log_and_print(f"Replayed {replayed} journaled writes the workbook was missing.", color=Fore.YELLOW, level="warning")
+    journal.start_snapshots(SNAPSHOT_INTERVAL)
+    register_jobs()
+    telemetry.open_store(TELEMETRY_PATH, retention_days=TELEMETRY_RETENTION_DAYS)
     log_and_print("File initialization complete.", color=Fore.GREEN)
 
 # Initialize files before the server starts
-initialize_files()
+memory.configure(MEMORY_BUDGETS)
+response_cache.configure(MEMORY_BUDGETS["response_cache"])
+table_cache.configure_memory(MEMORY_BUDGETS["table"], COLD_COLUMNS_PATH if not REPLICA_OF else
+                             os.path.join(DB_DIR, f"cold_columns_replica_{ARGS.port}.sqlite3"))
+scheduler.configure(RATE_LIMITS, {"bulk": BULK_CONCURRENCY}, BULK_QUEUE_TIMEOUT)
+profiling.configure(PROFILE_DIR, ARGS.profile_slow_ms)
+if REPLICA_OF:
+    initialize_replica()
+else:
+    initialize_files()
+
+# Paths a replica forwards to the primary besides writes (the journal lives there)
+REPLICA_FORWARDED_PATHS = ("/history/", "/jobs", "/telemetry")
+# POST routes that only read; a replica answers them itself
+READ_ONLY_POSTS = {"/query"}
+# Requests never profiled: long-polls and change streams spend their time waiting (and streams
+# stay open for hours), and a capture would sample itself
+UNPROFILED_PATHS = {"/changes", "/changes/stream", "/journal", "/debug/profile"}
+
+@app.before_request
+def start_profiling():
+    """Time every request (sampling its stacks when slow-request capture is on); cProfile it for X-Profile: 1."""
+    if request.path in UNPROFILED_PATHS:
+        return None
+    g.profiler = profiling.start_request(request.method, request.path, profile=request.headers.get("X-Profile") == "1")
+    return None
+
+@app.after_request
+def save_request_profile(response):
+    """Save an X-Profile request's cProfile stats and name the file in the response."""
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        response.headers["X-Profile"] = profiling.stop_profile(profiler, request.method, request.path)
+    return response
+
+@app.teardown_request
+def finish_profiling(error=None):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()  # The response was never made; nothing worth saving
+    elapsed, saved = profiling.finish_request()
+    if saved:
+        log_and_print(f"Slow request {request.method} {request.path} took {elapsed:.2f} s; stacks saved to "
+                      f"{os.path.join(PROFILE_DIR, saved)}.", color=Fore.YELLOW, level="warning")
+
+@app.before_request
+def schedule_request():
+    """Rate-limit each client and hold bulk requests to a few at a time (429 + Retry-After when over)."""
+    slot, retry_after = scheduler.admit(request.method, request.path, request.headers, request.remote_addr)
+    if retry_after:
+        log_and_print(f"Rate limited {request.method} {request.path} from "
+                      f"{scheduler.client_id(request.headers, request.remote_addr)} ({request.remote_addr}).",
+                      color=Fore.YELLOW, level="warning")
+        return (jsonify({"message": "Too many requests; retry later", "retry_after": retry_after}), 429,
+                {"Retry-After": str(retry_after)})
+    g.scheduler_slot = slot
+    return None
+
+@app.teardown_request
+def release_schedule_slot(error=None):
+    scheduler.release(g.pop("scheduler_slot", None))
+
+@app.before_request
+def forward_writes_to_primary():
+    """On a replica, send writes (and journal reads) to the primary."""
+    if not REPLICA_OF:
+        return None
+    if request.path.startswith("/replica/"):
+        return None
+    if (request.method != "GET" and request.path not in READ_ONLY_POSTS) or request.path.startswith(REPLICA_FORWARDED_PATHS):
+        try:
+            return replica.forward(request)
+        except Exception as e:
+            log_and_print(f"Could not forward {request.method} {request.path} to the primary: {str(e)}", color=Fore.RED, level="error")
+            return jsonify({"message": f"The primary host is unreachable: {str(e)}"}), 503
+    return None
+
+@app.after_request
+def add_journal_seq(response):
+    """On the primary, tell clients (and replicas forwarding a write) which journal entry they have seen."""
+    if not REPLICA_OF:
+        response.headers["X-Journal-Seq"] = str(journal.current_seq())
+    return response
 
 @app.route('/search_by_po', methods=['GET'])
 def search_by_po():
@@ -104,32 +339,31 @@ def search_by_po():
         log_and_print("Search by P.O.# failed: Missing 'po' parameter.", color=Fore.RED)
         return jsonify({"message": "P.O.# parameter is required"}), 400
 
-    if not os.path.exists(EXCEL_FILE_PATH):
+    if not REPLICA_OF and not os.path.exists(EXCEL_FILE_PATH):
         log_and_print("Search by P.O.# failed: Excel file not found.", color=Fore.RED)
         return jsonify({"message": "Excel file not found"}), 404
 
     try:
         log_and_print(f"Searching for P.O.#: {po_number}", color=Fore.BLUE)
-        # Load the Excel file
-        df = pd.read_excel(EXCEL_FILE_PATH)
+        # Use the cached table
+        df = table_cache.get_table()
 
         # Ensure the P.O.# column exists
         if "P.O.#" not in df.columns:
             log_and_print("P.O.# column not found in Excel file.", color=Fore.RED)
             return jsonify({"message": "P.O.# column not found in the Excel file"}), 400
 
-        # Convert P.O.# column to string and search input as string
-        df["P.O.#"] = df["P.O.#"].astype(str)
+        # Compare P.O.# as strings (without modifying the shared table)
         po_number = str(po_number)
 
         # Perform the search
-        matching_rows = df[df["P.O.#"] == po_number]
+        matching_rows = df[df["P.O.#"].astype(str) == po_number]
         if matching_rows.empty:
             log_and_print(f"No rows found for P.O.# {po_number}.", color=Fore.YELLOW)
             return jsonify({"message": f"No rows found for P.O.# {po_number}"}), 404
 
         log_and_print(f"Found rows for P.O.# {po_number}. Returning results.", color=Fore.GREEN)
-        return jsonify(matching_rows.to_dict(orient="records")), 200
+        return jsonify(table_cache.with_cold(matching_rows).to_dict(orient="records")), 200
     except Exception as e:
         log_and_print(f"An error occurred while searching for P.O.# {po_number}: {str(e)}", color=Fore.RED, level="error")
         return jsonify({"message": f"An error occurred: {str(e)}"}), 500
@@ -137,31 +371,726 @@ def search_by_po():
 @app.route('/list_headers', methods=['GET'])
 def list_headers():
     """List all headers in the Excel file."""
-    if not os.path.exists(EXCEL_FILE_PATH):
+    if not REPLICA_OF and not os.path.exists(EXCEL_FILE_PATH):
         log_and_print("Header listing failed: Excel file not found.", color=Fore.RED)
         return jsonify({"message": "No Excel file found"}), 404
 
-    df = pd.read_excel(EXCEL_FILE_PATH)
-    headers = list(df.columns)
-    log_and_print("Headers listed successfully.", color=Fore.GREEN)
-    return jsonify({"headers": headers}), 200
+    def build():
+        headers = list(table_cache.get_table().columns)
+        log_and_print("Headers listed successfully.", color=Fore.GREEN)
+        return jsonify({"headers": headers})
+    return response_cache.cached("/list_headers", {}, build)
+
+@app.route('/get_data', methods=['GET'])
+def get_data():
+    """Return every row; X-Change-Seq says where to start following /changes.
+
+    JSON records by default; a client can ask for a compact table format in
+    its Accept header (see wire_format.py). The serialized rows are cached
+    until the next write (response_cache), so a room full of clients
+    loading at once costs one serialization per format.
+    """
+    media_type = wire_format.negotiate(request.headers.get("Accept"))
+
+    def build():
+        seq = change_feed.current_seq()  # Taken first so no change after it can be missed
+        df = table_cache.with_cold(table_cache.get_table())
+        if media_type == wire_format.RECORDS_JSON:
+            response = jsonify(df.to_dict(orient="records"))
+        else:
+            response = Response(wire_format.encode(df, media_type), mimetype=media_type)
+        log_and_print(f"Serialized all {len(df)} rows as {media_type}.", color=Fore.GREEN)
+        response.headers["X-Change-Seq"] = str(seq)
+        response.headers["X-Total-Rows"] = str(len(df))
+        response.headers["Vary"] = "Accept"
+        return response
+    return response_cache.cached("/get_data", {"format": media_type}, build)
+
+@app.route('/list_refined', methods=['GET'])
+def list_refined():
+    """Return the refined values of every column, most used first; X-Change-Seq as for /get_data.
+
+    ?limit=N returns only the top N values of each column; ?all=1 adds the
+    vocabularies of columns the table no longer has.
+    """
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({"message": "limit must be a number"}), 400
+    all_columns = request.args.get('all') == "1"
+
+    def build():
+        seq = change_feed.current_seq()
+        files = refined_store.list_files(all_columns=all_columns, limit=limit)
+        log_and_print(f"Listed {len(files)} refined files.", color=Fore.GREEN)
+        response = jsonify({"files": files})
+        response.headers["X-Change-Seq"] = str(seq)
+        return response
+    return response_cache.cached("/list_refined", {"all": all_columns, "limit": limit}, build)
+
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    """Return the most used values of ?column= matching ?prefix= (up to ?limit=, default 10)."""
+    column = request.args.get('column')
+    if not column:
+        return jsonify({"message": "column parameter is required"}), 400
+    try:
+        limit = min(int(request.args.get('limit', 10)), 1000)
+    except ValueError:
+        return jsonify({"message": "limit must be a number"}), 400
+    values = refined_store.suggest(column, request.args.get('prefix', ''), limit)
+    return jsonify({"column": column, "values": values}), 200
+
+@app.route('/keys/so', methods=['GET'])
+def list_so_keys():
+    """S.O.# values starting with ?prefix= (case ignored), sorted, up to ?limit= (default 50).
+
+    Served from the S.O.# value index, for pickers that search as the user
+    types; "more" says whether further keys match.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 1000)
+    except ValueError:
+        return jsonify({"message": "limit must be a number"}), 400
+    if not value_index.is_indexed("S.O.#"):
+        return jsonify({"message": "The table has no S.O.# column"}), 404
+    keys, more = value_index.prefix("S.O.#", request.args.get('prefix', ''), limit)
+    return jsonify({"keys": keys, "more": more}), 200
+
+@app.route('/rows/<path:so_number>', methods=['GET'])
+def get_row(so_number):
+    """One row by S.O.#; X-Change-Seq says where to start following /changes for it.
+
+    Clients URL-quote the S.O.#; the path converter routes one containing "/".
+    """
+    seq = change_feed.current_seq()  # Taken first so no change after it can be missed
+    if not value_index.is_indexed("S.O.#"):
+        return jsonify({"message": "The table has no S.O.# column"}), 404
+    with table_cache.locked():
+        table_cache.get_table()  # Picks up a workbook replaced on disk before the lookup
+        row_ids = value_index.lookup("S.O.#", [so_number])
+        if not row_ids:
+            log_and_print(f"Row lookup failed: S.O.# {so_number} not found.", color=Fore.RED)
+            return jsonify({"message": f"S.O.# {so_number} not found"}), 404
+        row = table_cache.get_row(min(row_ids))
+    return jsonify(change_feed.json_row(row)), 200, {"X-Change-Seq": str(seq), "ETag": f'"{change_feed.row_version(row)}"'}
+
+@app.route('/rows/<path:so_number>', methods=['PATCH'])
+def patch_row(so_number):
+    """Change only the given fields of one row; returns the new row and its version.
+
+    Fields equal to the stored value are ignored, so only what really changed
+    is written, journaled and passed to the indexes and refined vocabularies.
+    With an If-Match header (the ETag from GET /rows/<so>) the patch is
+    refused with 412 if the row changed since it was read.
+    """
+    fields = request.get_json(silent=True)
+    if not isinstance(fields, dict):
+        log_and_print("Patch failed: request body is not a JSON object.", color=Fore.RED)
+        return jsonify({"message": "Request body must be a JSON object"}), 400
+    fields.pop("S.O.#", None)  # The key itself is not editable
+    expected = request.headers.get("If-Match", "").strip().strip('"')
+
+    try:
+        with table_cache.locked():
+            df = table_cache.get_table()
+            unknown = [column for column in fields if column not in df.columns]
+            if unknown:
+                return jsonify({"message": f"Unknown columns: {', '.join(unknown)}"}), 400
+            row_ids = value_index.lookup("S.O.#", [so_number]) if value_index.is_indexed("S.O.#") else set()
+            if not row_ids:
+                log_and_print(f"Patch failed: S.O.# {so_number} not found.", color=Fore.YELLOW)
+                return jsonify({"message": f"No row found for S.O.# {so_number}"}), 404
+            invalid = table_cache.invalid_numbers(fields)
+            if invalid:
+                log_and_print(f"Patch of S.O.# {so_number} failed: {'; '.join(invalid)}.", color=Fore.RED)
+                return jsonify({"message": "; ".join(invalid)}), 400
+            row_id = min(row_ids)
+            before = table_cache.get_row(row_id)
+            if expected and expected != "*" and expected != change_feed.row_version(before):
+                log_and_print(f"Patch of S.O.# {so_number} refused: the row changed since it was read.", color=Fore.YELLOW)
+                return (jsonify({"message": f"S.O.# {so_number} was changed by someone else; reload it and try again",
+                                 "row": change_feed.json_row(before), "version": change_feed.row_version(before)}),
+                        412, {"ETag": f'"{change_feed.row_version(before)}"'})
+            after = table_cache.update_row(row_id, fields)
+        version = change_feed.row_version(after)
+        changed = [column for column in fields if value_index.cell_text(after[column]) != value_index.cell_text(before[column])]
+        log_and_print(f"Patched S.O.# {so_number}: {', '.join(changed) or 'no changes'}.", color=Fore.GREEN)
+        return jsonify({"row": change_feed.json_row(after), "changed": changed, "version": version}), 200, {"ETag": f'"{version}"'}
+    except Exception as e:
+        log_and_print(f"An error occurred while patching S.O.# {so_number}: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+@app.route('/changes', methods=['GET'])
+def changes():
+    """Long-poll for changes after ?since=<seq>, waiting up to ?timeout= seconds (max 30)."""
+    try:
+        since = int(request.args.get('since', 0))
+        timeout = min(float(request.args.get('timeout', 0)), 30)
+    except ValueError:
+        return jsonify({"message": "since and timeout must be numbers"}), 400
+
+    try:
+        events = change_feed.events_since(since, timeout=timeout)
+    except change_feed.ResyncRequired:
+        return jsonify({"message": "Changes no longer available; reload and resume", "seq": change_feed.current_seq()}), 410
+    return jsonify({"seq": events[-1]["seq"] if events else since, "events": events}), 200
+
+@app.route('/changes/stream', methods=['GET'])
+def changes_stream():
+    """Server-Sent Events stream of changes after ?since= (or the Last-Event-ID header)."""
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"message": "since must be a number"}), 400
+
+    log_and_print(f"Change stream opened by {request.remote_addr} from seq {since}.", color=Fore.CYAN)
+    return Response(change_feed.sse_stream(since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/sync_refined', methods=['POST'])
 def sync_refined():
-    """Synchronize refined files and their contents."""
-    try:
-        log_and_print("Synchronizing refined files...", color=Fore.BLUE)
-        df = pd.read_excel(EXCEL_FILE_PATH)
-        headers = list(df.columns)
-        ensure_txt_files_and_sync(headers, df)
-        log_and_print("Refined files synchronized successfully.", color=Fore.GREEN)
-        return jsonify({"message": "Refined files synchronized successfully."}), 200
+    """Start synchronizing the refined vocabularies in the background; same as POST /jobs/sync_refined."""
+    return start_job("sync_refined")
+
+@app.route('/submit_data', methods=['POST'])
+def submit_data():
+    """Add a new row to the table."""
+    entry = request.get_json(silent=True)
+    if not isinstance(entry, dict):
+        log_and_print("Submit failed: request body is not a JSON object.", color=Fore.RED)
+        return jsonify({"message": "Request body must be a JSON object"}), 400
+
+    so_number = str(entry.get("S.O.#") or "").strip()
+    if not so_number:
+        log_and_print("Submit failed: missing S.O.#.", color=Fore.RED)
+        return jsonify({"message": "S.O.# is required"}), 400
+    invalid = table_cache.invalid_numbers(entry)
+    if invalid:
+        log_and_print(f"Submit of S.O.# {so_number} failed: {'; '.join(invalid)}.", color=Fore.RED)
+        return jsonify({"message": "; ".join(invalid)}), 400
+
+    try:
+        if table_cache.find_row_id(so_number) is not None:
+            log_and_print(f"Submit failed: S.O.# {so_number} already exists.", color=Fore.YELLOW)
+            return jsonify({"message": f"S.O.# {so_number} already exists"}), 409
+
+        table_cache.insert_rows([entry])
+        log_and_print(f"Added S.O.# {so_number}.", color=Fore.GREEN)
+        return jsonify({"message": f"S.O.# {so_number} added successfully."}), 200
+    except Exception as e:
+        log_and_print(f"An error occurred while adding S.O.# {so_number}: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+@app.route('/submit_data/batch', methods=['POST'])
+def submit_data_batch():
+    """Add many rows at once: {"rows": [{...}, ...]}. Either every row is added or none is."""
+    body = request.get_json(silent=True)
+    rows = body.get("rows") if isinstance(body, dict) else None
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        log_and_print("Batch submit failed: request body has no list of row objects.", color=Fore.RED)
+        return jsonify({"message": 'Request body must be {"rows": [objects]}'}), 400
+
+    so_numbers = [str(row.get("S.O.#") or "").strip() for row in rows]
+    missing = [index for index, so_number in enumerate(so_numbers) if not so_number]
+    if missing:
+        log_and_print(f"Batch submit failed: {len(missing)} rows without S.O.#.", color=Fore.RED)
+        return jsonify({"message": "S.O.# is required on every row", "rows": missing}), 400
+    counts = Counter(so_numbers)
+    repeated = sorted(so_number for so_number, count in counts.items() if count > 1)
+    if repeated:
+        log_and_print(f"Batch submit failed: S.O.# repeated in batch: {', '.join(repeated)}.", color=Fore.RED)
+        return jsonify({"message": "S.O.# repeated in the batch", "so_numbers": repeated}), 400
+    # Rejected like the importer's rows, with the reasons per row (by position in the batch)
+    errors = [{"row": index, "S.O.#": so_numbers[index], "errors": invalid}
+              for index, invalid in enumerate(map(table_cache.invalid_numbers, rows)) if invalid]
+    if errors:
+        log_and_print(f"Batch submit failed: {len(errors)} rows with invalid values.", color=Fore.RED)
+        return jsonify({"message": "Some rows have invalid values", "errors": errors}), 400
+
+    try:
+        existing = sorted(table_cache.existing_keys(so_numbers))
+        if existing:
+            log_and_print(f"Batch submit failed: S.O.# already exist: {', '.join(existing)}.", color=Fore.YELLOW)
+            return jsonify({"message": "Some S.O.# already exist", "so_numbers": existing}), 409
+
+        # One insert: one workbook write, one refined update and one change-feed burst
+        table_cache.insert_rows(rows)
+        log_and_print(f"Added {len(rows)} rows (S.O.# {so_numbers[0]} to {so_numbers[-1]}).", color=Fore.GREEN)
+        return jsonify({"message": f"{len(rows)} rows added successfully.", "count": len(rows)}), 200
+    except Exception as e:
+        log_and_print(f"An error occurred while adding a batch of {len(rows)} rows: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+def save_import_upload():
+    """Check an import upload and keep it on disk (it is read from there in chunks).
+
+    Returns ({"path", "mapping", "dry_run"}, None), or (None, error response).
+    """
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        log_and_print("Import failed: no file uploaded.", color=Fore.RED)
+        return None, (jsonify({"message": "Upload the file to import in the 'file' form field"}), 400)
+    name = os.path.basename(upload.filename.replace("\\", "/"))
+    if not name.lower().endswith(importer.SUPPORTED_EXTENSIONS):
+        log_and_print(f"Import failed: unsupported file {name}.", color=Fore.RED)
+        return None, (jsonify({"message": f"Only {', '.join(importer.SUPPORTED_EXTENSIONS)} files can be imported"}), 400)
+    try:
+        mapping = json.loads(request.form.get("mapping") or "{}")
+        if not isinstance(mapping, dict):
+            raise ValueError("mapping must be a JSON object")
+    except ValueError as e:
+        log_and_print(f"Import failed: invalid mapping: {e}", color=Fore.RED)
+        return None, (jsonify({"message": f"Invalid mapping: {e}"}), 400)
+    dry_run = request.form.get("dry_run") in ("1", "true", "yes")
+
+    os.makedirs(IMPORTS_DIR, exist_ok=True)
+    path = os.path.join(IMPORTS_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{name}")
+    upload.save(path)
+    return {"path": path, "mapping": mapping, "dry_run": dry_run}, None
+
+def remove_import_upload(path):
+    """Delete an uploaded import file once it has been imported (its rejects report is kept)."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        log_and_print(f"Could not delete the import upload {path}: {e}", color=Fore.YELLOW, level="warning")
+
+@app.route('/import', methods=['POST'])
+def import_rows():
+    """Import an uploaded CSV/XLSX (form field "file") in chunks.
+
+    Optional form fields: "mapping", a JSON object {file column: header}, and
+    "dry_run" ("1" to only validate). Returns the import summary.
+    """
+    params, error = save_import_upload()
+    if error:
+        return error
+    path, mapping, dry_run = params["path"], params["mapping"], params["dry_run"]
+    name = os.path.basename(path)
+
+    try:
+        log_and_print(f"Importing {name}{' (dry run)' if dry_run else ''}...", color=Fore.BLUE)
+        result = importer.import_file(path, mapping=mapping, dry_run=dry_run, rejects_dir=IMPORTS_DIR,
+                                      log=lambda message: log_and_print(message, color=Fore.CYAN))
+        log_and_print(f"Imported {name}: {result['accepted']} rows accepted, {result['rejected']} rejected.",
+                      color=Fore.GREEN)
+        return jsonify(result), 200
+    except ValueError as e:
+        log_and_print(f"Import of {name} failed: {e}", color=Fore.RED)
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        log_and_print(f"An error occurred while importing {name}: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+    finally:
+        remove_import_upload(path)
+
+@app.route('/update_data/<so_number>', methods=['POST'])
+def update_data(so_number):
+    """Update fields of the row with the given S.O.#."""
+    fields = request.get_json(silent=True)
+    if not isinstance(fields, dict):
+        log_and_print("Update failed: request body is not a JSON object.", color=Fore.RED)
+        return jsonify({"message": "Request body must be a JSON object"}), 400
+
+    try:
+        row_id = table_cache.find_row_id(so_number)
+        if row_id is None:
+            log_and_print(f"Update failed: S.O.# {so_number} not found.", color=Fore.YELLOW)
+            return jsonify({"message": f"No row found for S.O.# {so_number}"}), 404
+
+        fields.pop("S.O.#", None)  # The key itself is not editable
+        invalid = table_cache.invalid_numbers(fields)
+        if invalid:
+            log_and_print(f"Update of S.O.# {so_number} failed: {'; '.join(invalid)}.", color=Fore.RED)
+            return jsonify({"message": "; ".join(invalid)}), 400
+        table_cache.update_row(row_id, fields)
+        log_and_print(f"Updated S.O.# {so_number}: {', '.join(fields) or 'no fields'}.", color=Fore.GREEN)
+        return jsonify({"message": f"S.O.# {so_number} updated successfully."}), 200
+    except Exception as e:
+        log_and_print(f"An error occurred while updating S.O.# {so_number}: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+@app.route('/aggregate', methods=['GET'])
+def aggregate():
+    """Totals for dashboards, e.g. /aggregate?group_by=Customer&metric=sum:Total $'s,count&bucket=month"""
+    group_by = [column.strip() for column in request.args.get('group_by', '').split(",") if column.strip()]
+    try:
+        metrics = aggregates.parse_metrics(request.args.get('metric'))
+        rows, source = aggregates.aggregate(
+            table_cache.get_table(), group_by, metrics,
+            date_field=request.args.get('date_field', "Start Date"),
+            date_from=request.args.get('from'),
+            date_to=request.args.get('to'),
+            bucket=request.args.get('bucket'),
+        )
+    except (KeyError, ValueError) as e:
+        message = e.args[0] if e.args else str(e)
+        log_and_print(f"Aggregate failed: {message}", color=Fore.RED)
+        return jsonify({"message": message}), 400
+    except Exception as e:
+        log_and_print(f"An error occurred while aggregating: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+    log_and_print(f"Aggregated by {group_by or 'all rows'} ({source}, {len(rows)} groups).", color=Fore.GREEN)
+    return jsonify({
+        "group_by": group_by,
+        "metrics": [aggregates.metric_name(func, column) for func, column in metrics],
+        "source": source,
+        "rows": rows,
+    }), 200
+
+@app.route('/due', methods=['GET'])
+def due():
+    """Rows whose due date falls in a range, oldest first.
+
+    /due?from=10-01-2026&to=10-07-2026, /due?days=7 (today through 7 days out)
+    or /due?late=1 (due before today and not completed). status= keeps only
+    the given statuses (comma separated) and field= picks another date column.
+    """
+    field = request.args.get('field', "Due Date")
+    statuses = [s.strip().lower() for s in request.args.get('status', '').split(",") if s.strip()]
+    late = request.args.get('late', '').lower() in ("1", "true", "yes")
+    today = pd.Timestamp.today().normalize()
+
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    if not (late or request.args.get('days') or date_from or date_to):
+        return jsonify({"message": "Give from/to, days or late=1"}), 400
+
+    try:
+        # The index and the table are read under the cache lock, so an insert in between
+        # cannot give ids the table read here does not have yet
+        with table_cache.locked():
+            df = table_cache.get_table()  # Also picks up a workbook changed on disk
+            if late:
+                ids = date_index.range_ids(field, date_to=today, exclusive_to=True)
+            elif request.args.get('days'):
+                ids = date_index.range_ids(field, today, today + pd.Timedelta(days=int(request.args['days'])))
+            else:
+                ids = date_index.range_ids(
+                    field,
+                    parse_date_arg(date_from) if date_from else None,
+                    parse_date_arg(date_to) if date_to else None,
+                )
+            rows = df.loc[ids]
+    except KeyError as e:
+        log_and_print(f"Due-date query failed: {e.args[0]}", color=Fore.RED)
+        return jsonify({"message": f"{e.args[0]}. Date columns: {', '.join(date_index.indexed_columns())}"}), 400
+    except ValueError as e:
+        log_and_print(f"Due-date query failed: {str(e)}", color=Fore.RED)
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        status = status_column(df)
+        if status and (statuses or late):
+            current = rows[status].astype(str).str.strip().str.lower()
+            if statuses:
+                rows = rows[current.isin(statuses)]
+            else:
+                rows = rows[~current.isin(COMPLETED_STATUSES)]
+
+        log_and_print(f"Due-date query on {field}: {len(rows)} rows.", color=Fore.GREEN)
+        rows = table_cache.with_cold(rows)
+        records = [change_feed.json_row(row) for row in rows.to_dict(orient="records")]  # Blank cells as null, not NaN
+        return jsonify({"field": field, "count": len(rows), "rows": records}), 200
     except Exception as e:
-        log_and_print(f"An error occurred during synchronization: {str(e)}", color=Fore.RED, level="error")
+        log_and_print(f"An error occurred during the due-date query: {str(e)}", color=Fore.RED, level="error")
         return jsonify({"message": f"An error occurred: {str(e)}"}), 500
 
+@app.route('/query', methods=['POST'])
+def query_rows():
+    """Filter, sort and page rows on the server (see query.py for the request format)."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"message": "Request body must be a JSON object"}), 400
+
+    media_type = wire_format.negotiate(request.headers.get("Accept"))
+    seq = change_feed.current_seq()  # Taken first so no change after it can be missed
+    try:
+        result = query.run_query(
+            table_cache.get_table(),
+            filters=body.get("filters"),
+            sort=body.get("sort"),
+            page=body.get("page", 1),
+            page_size=body.get("page_size", 500),
+            records=media_type == wire_format.RECORDS_JSON,
+        )
+    except (KeyError, ValueError, TypeError) as e:
+        message = e.args[0] if e.args else str(e)
+        log_and_print(f"Query failed: {message}", color=Fore.RED)
+        return jsonify({"message": message}), 400
+    except Exception as e:
+        log_and_print(f"An error occurred while querying: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+    log_and_print(f"Query matched {result['total']} rows, returning page {result['page']}.", color=Fore.GREEN)
+    if media_type == wire_format.RECORDS_JSON:
+        return jsonify(result), 200, {"X-Change-Seq": str(seq), "Vary": "Accept"}
+    # A table format: the page of rows is the body, the rest goes in headers
+    return Response(wire_format.encode(result["rows"], media_type), mimetype=media_type, headers={
+        "X-Change-Seq": str(seq), "Vary": "Accept",
+        "X-Total-Rows": str(result["total"]), "X-Page": str(result["page"]), "X-Page-Size": str(result["page_size"]),
+        "X-Query-Plan": wire_format.header_value(result["plan"]),
+    }), 200
+
+@app.route('/search_text', methods=['GET'])
+def search_text():
+    """Word search in the free-text columns: /search_text?q=mandrel 3.0&column=NOTES&page=1&page_size=100
+
+    Rows contain every word (as the start of a word); without column all
+    free-text columns are searched.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"message": "q parameter is required"}), 400
+
+    seq = change_feed.current_seq()
+    try:
+        df = table_cache.get_table()
+        result = query.run_query(
+            df,
+            filters=[{"column": request.args.get('column') or "*", "op": "matches", "value": text}],
+            page=request.args.get('page', 1),
+            page_size=request.args.get('page_size', 100),
+        )
+    except (KeyError, ValueError, TypeError) as e:
+        message = e.args[0] if e.args else str(e)
+        log_and_print(f"Text search failed: {message}", color=Fore.RED)
+        return jsonify({"message": message}), 400
+    except Exception as e:
+        log_and_print(f"An error occurred while searching: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+    log_and_print(f"Text search '{text}' matched {result['total']} rows.", color=Fore.GREEN)
+    return jsonify(result), 200, {"X-Change-Seq": str(seq)}
+
+@app.route('/distinct', methods=['GET'])
+def distinct():
+    """Distinct values per column for filter dropdowns, e.g. /distinct?columns=Customer,Status"""
+    df = table_cache.get_table()  # Also picks up a workbook changed on disk
+    requested = [c.strip() for c in request.args.get('columns', '').split(",") if c.strip()]
+    unknown = [column for column in requested if column not in df.columns]
+    if unknown:
+        return jsonify({"message": f"Unknown column(s): {', '.join(unknown)}"}), 400
+
+    values = {
+        column: value_index.distinct(column) if value_index.is_indexed(column) else []
+        for column in (requested or list(df.columns))
+    }
+    log_and_print(f"Distinct values listed for {len(values)} columns.", color=Fore.GREEN)
+    return jsonify({"values": values}), 200
+
+@app.route('/history/<so_number>', methods=['GET'])
+def row_history(so_number):
+    """Past versions of one row from the journal (last JOURNAL_RETENTION_DAYS days) and its current values."""
+    if value_index.cell_text(so_number) is None:
+        return jsonify({"message": "S.O.# is required"}), 400
+    try:
+        versions = journal.history(so_number)
+        row_id = table_cache.find_row_id(so_number)
+        current = None if row_id is None else change_feed.json_row(table_cache.get_row(row_id))
+    except Exception as e:
+        log_and_print(f"An error occurred while reading the history of {so_number}: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+    if not versions and current is None:
+        log_and_print(f"History for S.O.# {so_number} not found.", color=Fore.RED)
+        return jsonify({"message": "S.O.# not found"}), 404
+    log_and_print(f"Returned {len(versions)} versions of S.O.# {so_number}.", color=Fore.GREEN)
+    return jsonify({"so": so_number, "current": current, "versions": versions}), 200
+
+@app.route('/journal', methods=['GET'])
+def journal_entries():
+    """Journal entries after ?since=<seq>, waiting up to ?timeout= seconds (max 30); followed by replicas."""
+    try:
+        since = int(request.args.get('since', 0))
+        timeout = min(float(request.args.get('timeout', 0)), 30)
+    except ValueError:
+        return jsonify({"message": "since and timeout must be numbers"}), 400
+
+    try:
+        entries = journal.entries_after(since, timeout=timeout)
+    except journal.ResyncRequired:
+        return jsonify({"message": "Journal entries no longer available; copy the table again", "seq": journal.current_seq()}), 410
+    return jsonify({"seq": entries[-1]["seq"] if entries else since, "entries": entries}), 200
+
+@app.route('/journal/snapshot', methods=['GET'])
+def journal_snapshot():
+    """The whole table and the journal entry it is current to, for a replica to start from."""
+    seq, table = journal.table_payload()
+    log_and_print(f"Sent a table copy (journal entry {seq}) to {request.remote_addr}.", color=Fore.CYAN)
+    return Response(f'{{"seq": {seq}, "table": {table}}}', mimetype="application/json")
+
+def start_job(kind, params=None):
+    """Queue a background job and answer 202 with its record (Location: /jobs/<id>)."""
+    try:
+        job = jobs.submit(kind, params)
+    except jobs.UnknownJobKind as e:
+        return jsonify({"message": str(e)}), 404
+    log_and_print(f"Queued {kind} job {job['id']}.", color=Fore.BLUE)
+    return jsonify({"message": f"{kind} job queued", "job": job}), 202, {"Location": f"/jobs/{job['id']}"}
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """Start a sync_refined, rebuild_refined, export, import or reindex job; returns its id at once.
+
+    import takes the same form upload as /import; export takes a JSON body
+    {"format": "xlsx"|"csv", "filters": [...], "sort": [...]} as for /query.
+    """
+    if kind == "import":
+        params, error = save_import_upload()
+        if error:
+            return error
+        return start_job("import", params)
+    params = request.get_json(silent=True) or {}
+    if not isinstance(params, dict):
+        return jsonify({"message": "Request body must be a JSON object"}), 400
+    if kind == "export":
+        try:
+            query.select(table_cache.get_table().head(0), params.get("filters"), params.get("sort"))
+        except (KeyError, ValueError, TypeError) as e:
+            return jsonify({"message": e.args[0] if e.args else str(e)}), 400
+    return start_job(kind, params)
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """The most recent jobs (?limit=, default 50)."""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError:
+        return jsonify({"message": "limit must be a number"}), 400
+    return jsonify({"jobs": jobs.recent(limit)}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """A job's status ("queued", "running", "done" or "failed"), progress and result."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"message": f"No job {job_id}"}), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Download the file a finished job produced (an export, an import's rejects report)."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"message": f"No job {job_id}"}), 404
+    if job["status"] != "done":
+        return jsonify({"message": f"Job {job_id} is {job['status']}"}), 409
+    path = jobs.result_file(job_id)
+    if not path or not os.path.exists(path):
+        return jsonify({"message": f"Job {job_id} has no result file"}), 404
+    return send_file(path, as_attachment=True, download_name=f"{job['kind']}_{job_id[:8]}{os.path.splitext(path)[1]}")
+
+@app.route('/replica/status', methods=['GET'])
+def replica_status():
+    """Replication state: the primary followed, the last entry applied and when it last answered."""
+    if not REPLICA_OF:
+        return jsonify({"role": "primary", "seq": journal.current_seq()}), 200
+    return jsonify({"role": "replica", **replica.status()}), 200
+
+@app.route('/cache/status', methods=['GET'])
+def cache_status():
+    """Response cache counters: hits, misses, coalesced requests and memory held."""
+    return jsonify(response_cache.stats()), 200
+
+@app.route('/scheduler/status', methods=['GET'])
+def scheduler_status():
+    """Rate limiter counters and the limits in force."""
+    return jsonify(scheduler.stats()), 200
+
+@app.route('/debug/memory', methods=['GET'])
+def debug_memory():
+    """Estimated memory of each in-process structure against its budget (see memory.py).
+
+    Walks every index, so it takes a moment on a big table; for occasional checks, not polling.
+    """
+    cache = response_cache.stats()
+    structures = {
+        "table": table_cache.memory_usage(),
+        "value_index": value_index.memory_usage(),
+        "text_index": text_index.memory_usage(),
+        "date_index": date_index.memory_usage(),
+        "row_ids": memory.row_ids_usage(),
+        "suggestions": memory.suggestions_usage(),
+        "aggregates": aggregates.memory_usage(),
+        "refined_store": refined_store.memory_usage(),
+        "change_feed": change_feed.memory_usage(),
+        "response_cache": {"bytes": cache["bytes"], "budget": cache["max_bytes"], "entries": cache["entries"],
+                           "evictions": cache["evictions"]},
+    }
+    return jsonify({"process_bytes": memory.process_bytes(),
+                    "estimated_bytes": sum(structure["bytes"] for structure in structures.values()),
+                    "structures": structures}), 200
+
+@app.route('/telemetry', methods=['POST'])
+def post_telemetry():
+    """Store a batch of timings from a USER tool: {"spans": [{"name", "seconds", "at", "attrs"}, ...]}."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "Expected a JSON object with a spans list"}), 400
+    try:
+        stored, rejected = telemetry.record(scheduler.client_id(request.headers, request.remote_addr), data.get("spans"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        log_and_print(f"Could not store telemetry: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+    return jsonify({"message": f"Stored {stored} spans", "stored": stored, "rejected": rejected}), 200
+
+@app.route('/telemetry/summary', methods=['GET'])
+def telemetry_summary():
+    """USER tool timings over the last ?days= (default 7, at most TELEMETRY_RETENTION_DAYS), slowest total first.
+
+    ?name= keeps names starting with it (e.g. "USERADD."), ?client= one PC,
+    and ?by=client splits every name by PC.
+    """
+    try:
+        days = float(request.args.get('days', 7))
+    except ValueError:
+        return jsonify({"message": "days must be a number"}), 400
+    try:
+        spans = telemetry.summary(time.time() - days * 86400, name=request.args.get('name'),
+                                  client=request.args.get('client'), by_client=request.args.get('by') == "client")
+        return jsonify({"days": days, "spans": spans, **telemetry.stats()}), 200
+    except Exception as e:
+        log_and_print(f"Could not summarize telemetry: {str(e)}", color=Fore.RED, level="error")
+        return jsonify({"message": f"An error occurred: {str(e)}"}), 500
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Sample the request and job threads for ?seconds= (default 30) and return collapsed stacks.
+
+    The file is what flamegraph.pl or speedscope take; the request itself
+    waits the whole time. Sampling costs the host little, so it can run under
+    real load.
+    """
+    try:
+        seconds = float(request.args.get("seconds", 30))
+    except ValueError:
+        return jsonify({"message": "seconds must be a number"}), 400
+    log_and_print(f"Profiling the host for {seconds:g} s...", color=Fore.BLUE)
+    stacks = profiling.collect(seconds)
+    log_and_print(f"Profile done: {sum(stacks.values())} samples in {len(stacks)} stacks.", color=Fore.GREEN)
+    return Response(profiling.folded(stacks), mimetype="text/plain", headers={
+        "Content-Disposition": f"attachment; filename=profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"})
+
+@app.route('/debug/profiles', methods=['GET'])
+def debug_profiles():
+    """Saved slow-request stacks (.folded) and X-Profile stats (.prof), newest first, with the profiler counters."""
+    return jsonify({"profiles": profiling.list_profiles(), **profiling.stats()}), 200
+
+@app.route('/debug/profiles/<name>', methods=['GET'])
+def debug_profile_file(name):
+    """Download one saved profile."""
+    path = profiling.profile_path(name)
+    if path is None:
+        return jsonify({"message": f"No saved profile named {name}"}), 404
+    return send_file(path, as_attachment=True, download_name=name)
+
 # Add similar log_and_print calls to all other routes for consistent visibility
 
 if __name__ == '__main__':
-    log_and_print("Starting the Flask server on http://0.0.0.0:5000", color=Fore.MAGENTA)
-    app.run(host="0.0.0.0", port=5000)
+    log_and_print(f"Starting the Flask server on http://0.0.0.0:{ARGS.port}", color=Fore.MAGENTA)
+    app.run(host="0.0.0.0", port=ARGS.port, threaded=True)  # Change streams each hold a thread
@@ -0,0 +1,206 @@
+# aggregates.py
+"""Dashboard rollups over the cached job table.
+
+Ad-hoc requests ("Total $'s by Customer this month") are answered with a
+vectorized pandas groupby over the cached table. The rollups management asks
+for every morning are kept materialized instead: they are built once when the
+table loads and then adjusted row by row on every insert/update event from
+table_cache, so serving them never touches the full table.
+"""
+import threading
+import memory
+import pandas as pd
+from schema import to_numbers, to_dates, parse_date_arg
+
+# Supported metric functions; "count" takes no column
+METRIC_FUNCTIONS = ["count", "sum", "mean", "min", "max"]
+
+# Date buckets that can be added as a group key
+DATE_BUCKETS = {"day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+
+# Rollups kept up to date on every write: (group_by columns, metrics)
+MATERIALIZED_ROLLUPS = [
+    (("Customer",), ("sum:Total $'s", "count")),
+    (("Engineer Status",), ("count",)),
+    (("Status",), ("count",)),
+    (("machine type",), ("count", "sum:Quantity")),
+]
+
+_lock = threading.Lock()
+_rollups = {}  # group_by tuple -> {group key tuple -> {"count": n, column: sum, "count:" + column: non-blank n}}
+
+def parse_metrics(text):
+    """Parse "sum:Total $'s,count" into [("sum", "Total $'s"), ("count", None)]."""
+    metrics = []
+    for item in (text or "count").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        func, _, column = item.partition(":")
+        func = func.strip().lower()
+        if func not in METRIC_FUNCTIONS:
+            raise ValueError(f"Unknown metric '{func}', expected one of {METRIC_FUNCTIONS}")
+        if func != "count" and not column.strip():
+            raise ValueError(f"Metric '{func}' needs a column, e.g. {func}:Total $'s")
+        metrics.append((func, column.strip() or None))
+    return metrics
+
+def metric_name(func, column):
+    return func if column is None else f"{func}:{column}"
+
+def _group_key(row, group_by):
+    return tuple("" if pd.isna(row.get(column)) else str(row.get(column)) for column in group_by)
+
+def _number(value):
+    """A cell as a number, or None when it is blank or not a number."""
+    number = to_numbers(pd.Series([value])).iloc[0]
+    return None if pd.isna(number) else float(number)
+
+def _count_key(column):
+    """Key of a summed column's non-blank count: a mean skips blanks, as pandas does."""
+    return f"count:{column}"
+
+def _sum_columns(metrics):
+    return sorted({column for func, column in parse_metrics(",".join(metrics)) if func == "sum"})
+
+def _apply_row(group_by, metrics, row, sign):
+    """Add (sign=1) or remove (sign=-1) one row from a materialized rollup."""
+    groups = _rollups[group_by]
+    key = _group_key(row, group_by)
+    totals = groups.setdefault(key, {"count": 0})
+    totals["count"] += sign
+    for column in _sum_columns(metrics):
+        number = _number(row.get(column))
+        if number is not None:
+            totals[column] = totals.get(column, 0.0) + sign * number
+            totals[_count_key(column)] = totals.get(_count_key(column), 0) + sign
+    if totals["count"] <= 0:
+        del groups[key]
+
+def _rebuild(df):
+    """Build every materialized rollup from scratch with one groupby each."""
+    _rollups.clear()
+    for group_by, metrics in MATERIALIZED_ROLLUPS:
+        if not set(group_by).issubset(df.columns):
+            continue
+        keys = [df[column].astype(str).where(df[column].notna(), "") for column in group_by]
+        sums, counts = {}, {}
+        for column in _sum_columns(metrics):
+            if column in df.columns:
+                numbers = to_numbers(df[column])
+                sums[column] = numbers.fillna(0.0)
+                counts[_count_key(column)] = numbers.notna().astype(int)
+        frame = pd.DataFrame({"count": 1, **sums, **counts}, index=df.index)
+        grouped = frame.groupby(keys, sort=False).sum()
+        groups = {}
+        for key, totals in grouped.iterrows():
+            key = key if isinstance(key, tuple) else (key,)
+            groups[key] = {column: (int(value) if column == "count" or column in counts else float(value))
+                           for column, value in totals.items()}
+        _rollups[group_by] = groups
+
+def on_table_change(event):
+    """table_cache listener: keep materialized rollups in step with writes."""
+    with _lock:
+        if event["type"] == "reload":
+            _rebuild(event["table"])
+            return
+        for group_by, metrics in MATERIALIZED_ROLLUPS:
+            if group_by not in _rollups:
+                continue
+            if event["type"] == "insert":
+                for row in event["rows"]:
+                    _apply_row(group_by, metrics, row, 1)
+            elif event["type"] == "update":
+                _apply_row(group_by, metrics, event["before"], -1)
+                _apply_row(group_by, metrics, event["after"], 1)
+
+def _materialized(group_by, metrics):
+    """Return the materialized result for this query, or None if it is not kept."""
+    for kept_group_by, kept_metrics in MATERIALIZED_ROLLUPS:
+        if kept_group_by != group_by or kept_group_by not in _rollups:
+            continue
+        kept_columns = _sum_columns(kept_metrics)
+        if not all(func == "count" or (func in ("sum", "mean") and column in kept_columns) for func, column in metrics):
+            return None
+        rows = []
+        with _lock:
+            for key, totals in sorted(_rollups[group_by].items()):
+                row = dict(zip(group_by, key))
+                for func, column in metrics:
+                    if func == "count":
+                        row["count"] = totals["count"]
+                    elif func == "sum":
+                        row[metric_name(func, column)] = totals.get(column, 0.0)
+                    else:
+                        counted = totals.get(_count_key(column), 0)
+                        row[metric_name(func, column)] = totals.get(column, 0.0) / counted if counted else None
+                rows.append(row)
+        return rows
+    return None
+
+def aggregate(df, group_by, metrics, date_field="Start Date", date_from=None, date_to=None, bucket=None):
+    """Group the table and compute metrics.
+
+    group_by is a list of column names, metrics a list of (func, column)
+    tuples from parse_metrics. date_from/date_to (inclusive) filter on
+    date_field, and bucket adds a date_field period ("month", "week", ...)
+    as the last group key. Returns (rows, source) where source says whether
+    the answer came from a materialized rollup or a groupby.
+    """
+    missing = [column for column in group_by + [c for _, c in metrics if c] if column not in df.columns]
+    if missing:
+        raise KeyError(f"Unknown column(s): {', '.join(missing)}")
+    if bucket and bucket not in DATE_BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', expected one of {list(DATE_BUCKETS)}")
+
+    if not (date_from or date_to or bucket):
+        rows = _materialized(tuple(group_by), metrics)
+        if rows is not None:
+            return rows, "materialized"
+
+    keys = [df[column].astype(str).where(df[column].notna(), "") for column in group_by]
+    mask = pd.Series(True, index=df.index)
+    if date_from or date_to or bucket:
+        if date_field not in df.columns:
+            raise KeyError(f"Unknown column(s): {date_field}")
+        dates = to_dates(df[date_field])
+        if date_from:
+            mask &= dates >= parse_date_arg(date_from)
+        if date_to:
+            mask &= dates <= parse_date_arg(date_to)
+        if bucket:
+            keys.append(dates.dt.to_period(DATE_BUCKETS[bucket]).astype(str).rename(f"{date_field} ({bucket})"))
+
+    values = {"count": pd.Series(1, index=df.index)}
+    for func, column in metrics:
+        if column is not None:
+            values[column] = to_numbers(df[column])
+    frame = pd.DataFrame(values)[mask]
+    keys = [key[mask] for key in keys]
+    names = [key.name for key in keys]
+
+    if not keys:
+        grouped = frame.groupby(pd.Series("", index=frame.index), sort=True)
+    else:
+        grouped = frame.groupby(keys, sort=True)
+
+    result = pd.DataFrame(index=grouped.size().index)
+    for func, column in metrics:
+        if func == "count":
+            result["count"] = grouped["count"].sum()
+        else:
+            result[metric_name(func, column)] = grouped[column].agg(func)
+
+    rows = []
+    for key, values in result.iterrows():
+        key = key if isinstance(key, tuple) else (key,)
+        row = dict(zip(names, key)) if keys else {}
+        for name, value in values.items():
+            row[name] = None if pd.isna(value) else (int(value) if name == "count" else float(value))
+        rows.append(row)
+    return rows, "computed"
+
+def memory_usage():
+    with _lock:
+        return {"bytes": memory.deep_bytes(_rollups), "rollups": len(_rollups)}
@@ -0,0 +1,122 @@
+# change_feed.py
+"""Sequence-numbered feed of changes for clients to follow.
+
+Every row insert/update and every value added to a refined vocabulary is
+published here with a sequence number. Clients remember the last sequence
+they applied and ask for everything after it, either by long-polling
+GET /changes or over the Server-Sent Events stream GET /changes/stream.
+
+Only the most recent RETAIN_EVENTS events are kept. A client that asks for
+a sequence older than that gets a "resync" answer and must reload the data
+it shows (e.g. /get_data) before following the feed again.
+"""
+import hashlib
+import json
+import threading
+import time
+import memory
+import numpy as np
+import pandas as pd
+from collections import deque
+from value_index import cell_text
+
+# How many events are kept for clients that reconnect
+RETAIN_EVENTS = 10000
+
+_condition = threading.Condition()
+_events = deque(maxlen=RETAIN_EVENTS)
+# Sequences start from the clock so they keep increasing across host restarts;
+# a client holding a sequence from before a restart is then told to resync.
+_seq = int(time.time() * 1000)
+
+class ResyncRequired(Exception):
+    """The requested sequence is no longer retained; the client must reload."""
+
+def json_value(value):
+    """Make a cell value safe for JSON (NaN -> None, numpy -> Python)."""
+    if isinstance(value, (np.generic,)):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if pd.isna(value):
+        return None
+    return str(value)
+
+def json_row(row):
+    return {column: json_value(value) for column, value in row.items()}
+
+def row_version(row):
+    """Version tag of a row's contents (the ETag of GET/PATCH /rows/<so>).
+
+    A hash rather than a counter, so the primary and its replicas give the
+    same row the same version and it survives a restart. Cells are hashed as
+    the text the indexes compare (5.0 and 5 are the same value).
+    """
+    text = json.dumps({column: cell_text(value) for column, value in row.items()}, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def publish(kind, data):
+    """Append an event and wake every waiting client. Returns its sequence number."""
+    global _seq
+    with _condition:
+        _seq += 1
+        _events.append({"seq": _seq, "type": kind, **data})
+        _condition.notify_all()
+        return _seq
+
+def current_seq():
+    with _condition:
+        return _seq
+
+def events_since(seq, timeout=0):
+    """Return the events after seq, waiting up to timeout seconds for one to arrive.
+
+    Raises ResyncRequired if events after seq have already been discarded.
+    """
+    with _condition:
+        if seq <= 0:
+            seq = _seq  # A client with no data yet just follows from now
+        if seq > _seq:
+            raise ResyncRequired()  # Sequence from a different host (clock moved back)
+        if seq < _seq and (not _events or _events[0]["seq"] > seq + 1):
+            raise ResyncRequired()  # Missed events were discarded or lost in a restart
+        if seq == _seq and timeout:
+            _condition.wait_for(lambda: _seq > seq, timeout=timeout)
+        return [event for event in _events if event["seq"] > seq]
+
+def on_table_change(event):
+    """table_cache listener: publish row inserts and updates."""
+    if event["type"] == "insert" and event.get("bulk"):
+        return  # Imports publish one "reload" when they finish instead of a row each
+    if event["type"] == "insert":
+        for row in event["rows"]:
+            publish("insert", {"so": json_value(row.get("S.O.#")), "row": json_row(row), "version": row_version(row)})
+    elif event["type"] == "update":
+        after = json_row(event["after"])
+        before = json_row(event["before"])
+        changed = [column for column in after if after[column] != before.get(column)]
+        publish("update", {"so": after.get("S.O.#"), "row": after, "changed": changed,
+                           "version": row_version(event["after"])})
+    elif event["type"] == "reload" and event["version"] > 1:
+        publish("reload", {})  # The workbook was replaced on disk; clients must reload
+
+def sse_stream(seq, heartbeat=15):
+    """Generator of Server-Sent Events for everything after seq."""
+    while True:
+        try:
+            events = events_since(seq, timeout=heartbeat)
+        except ResyncRequired:
+            yield f"event: resync\ndata: {json.dumps({'seq': current_seq()})}\n\n"
+            return
+        if not events:
+            yield ": keep-alive\n\n"
+            continue
+        for event in events:
+            seq = event["seq"]
+            yield f"id: {seq}\nevent: change\ndata: {json.dumps(event)}\n\n"
+
+def memory_usage():
+    with _condition:
+        return {"bytes": memory.deep_bytes(_events), "events": len(_events), "retained": RETAIN_EVENTS}
@@ -0,0 +1,77 @@
+# cold_store.py
+"""On-disk copy of the table columns moved out of memory (see table_cache).
+
+When the table is over its memory budget (memory.py), table_cache moves
+the free-text columns (NOTES, Description) here and keeps only None in them.
+Their cells are read back for the rows actually being sent, searched or
+saved; word search does not need them, since text_index keeps its own index.
+
+The store is one SQLite table keyed by (column, row id). Row ids only mean
+something for the life of the host process, so the file is started afresh
+every time the host starts and is not a backup of anything: the workbook and
+the journal are.
+"""
+import os
+import sqlite3
+import threading
+import pandas as pd
+
+_lock = threading.Lock()
+_db = None
+_path = None
+
+# Ids per "IN (...)" query (SQLite allows 999 parameters); more rows than
+# WHOLE_COLUMN_ROWS are read with one pass over the column instead
+CHUNK = 900
+WHOLE_COLUMN_ROWS = 20000
+
+def open_store(path):
+    """Start an empty store at path (replacing what an earlier run left)."""
+    global _db, _path
+    with _lock:
+        if _db is not None:
+            _db.close()
+        for leftover in (path, f"{path}-journal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        _db = sqlite3.connect(path, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=OFF")  # Rebuilt from the workbook on every start; no need to survive a crash
+        _db.execute("PRAGMA synchronous=OFF")
+        _db.execute("CREATE TABLE cells (name TEXT NOT NULL, row_id INTEGER NOT NULL, value, "
+                    "PRIMARY KEY (name, row_id)) WITHOUT ROWID")
+        _path = path
+
+def _cell(value):
+    """A cell as SQLite stores it: text and numbers as they are, empty cells as NULL."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+def clear():
+    with _lock, _db:
+        _db.execute("DELETE FROM cells")
+
+def put_many(name, row_ids, values):
+    """Store the cells of column name for the given rows (replacing any stored for them)."""
+    with _lock, _db:
+        _db.executemany("INSERT OR REPLACE INTO cells (name, row_id, value) VALUES (?, ?, ?)",
+                        [(name, int(row_id), _cell(value)) for row_id, value in zip(row_ids, values)])
+
+def get_many(name, row_ids):
+    """The stored cells of column name for row_ids, in the same order (None where there is none)."""
+    row_ids = [int(row_id) for row_id in row_ids]
+    with _lock:
+        if len(row_ids) > WHOLE_COLUMN_ROWS:
+            found = dict(_db.execute("SELECT row_id, value FROM cells WHERE name = ?", (name,)))
+        else:
+            found = {}
+            for start in range(0, len(row_ids), CHUNK):
+                chunk = row_ids[start:start + CHUNK]
+                found.update(_db.execute(f"SELECT row_id, value FROM cells WHERE name = ? AND row_id IN "
+                                         f"({', '.join('?' * len(chunk))})", (name, *chunk)))
+    return [found.get(row_id) for row_id in row_ids]
+
+def size_on_disk():
+    return os.path.getsize(_path) if _path and os.path.exists(_path) else 0
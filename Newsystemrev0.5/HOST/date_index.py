@@ -0,0 +1,102 @@
+# date_index.py
+"""Sorted indexes over the date columns of the cached job table.
+
+Each date column is parsed once into datetime64 and kept as two aligned numpy
+arrays sorted by date: the dates themselves and the row ids they belong to.
+A date range is then two binary searches (np.searchsorted) and a slice, so
+"what is due in the next 7 days" no longer scans the table. Rows with an
+empty or unparseable date are not indexed.
+
+The indexes follow table_cache events: a reload rebuilds them, inserts and
+updates adjust only the affected entries.
+"""
+import threading
+import numpy as np
+import pandas as pd
+from schema import DATE_COLUMNS, to_dates
+
+_lock = threading.Lock()
+_indexes = {}  # column -> (sorted datetime64[ns] array, row id array)
+
+def _build(series):
+    dates = to_dates(series)
+    dates = dates[dates.notna()]
+    order = np.argsort(dates.values, kind="stable")
+    return dates.values[order].astype("datetime64[ns]"), dates.index.values[order].astype(np.int64)
+
+def _parse(value):
+    """Parse one cell into datetime64, or None if it is empty or not a date."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    parsed = to_dates(pd.Series([value])).iloc[0]
+    return None if pd.isna(parsed) else np.datetime64(parsed, "ns")
+
+def _insert(column, row_id, value):
+    date = _parse(value)
+    if date is None:
+        return
+    keys, ids = _indexes[column]
+    position = np.searchsorted(keys, date, side="right")
+    _indexes[column] = (np.insert(keys, position, date), np.insert(ids, position, row_id))
+
+def _insert_many(column, row_ids, values):
+    """Insert several rows with one vectorized parse and one merge."""
+    new_keys, new_ids = _build(pd.Series(values, index=row_ids, dtype=object))
+    if not len(new_keys):
+        return
+    keys, ids = _indexes[column]
+    positions = np.searchsorted(keys, new_keys, side="right")
+    _indexes[column] = (np.insert(keys, positions, new_keys), np.insert(ids, positions, new_ids))
+
+def _remove(column, row_id, value):
+    date = _parse(value)
+    if date is None:
+        return
+    keys, ids = _indexes[column]
+    start, stop = np.searchsorted(keys, date, side="left"), np.searchsorted(keys, date, side="right")
+    hits = np.nonzero(ids[start:stop] == row_id)[0]
+    if len(hits):
+        position = start + hits[0]
+        _indexes[column] = (np.delete(keys, position), np.delete(ids, position))
+
+def on_table_change(event):
+    """table_cache listener: keep the date indexes in step with writes."""
+    with _lock:
+        if event["type"] == "reload":
+            df = event["table"]
+            _indexes.clear()
+            for column in DATE_COLUMNS:
+                if column in df.columns:
+                    _indexes[column] = _build(df[column])
+        elif event["type"] == "insert":
+            for column in _indexes:
+                _insert_many(column, event["ids"], [row.get(column) for row in event["rows"]])
+        elif event["type"] == "update":
+            for column in [column for column in event["changed"] if column in _indexes]:
+                before, after = event["before"].get(column), event["after"].get(column)
+                if _parse(before) != _parse(after):
+                    _remove(column, event["id"], before)
+                    _insert(column, event["id"], after)
+
+def indexed_columns():
+    return list(_indexes)
+
+def range_ids(column, date_from=None, date_to=None, exclusive_to=False):
+    """Return row ids whose date in column is within [date_from, date_to], oldest first.
+
+    Either bound may be None for an open range. With exclusive_to the upper
+    bound is excluded (used for "before today").
+    """
+    if column not in _indexes:
+        raise KeyError(f"No date index for column '{column}'")
+    keys, ids = _indexes[column]  # one consistent snapshot; writers replace the tuple
+    start = 0 if date_from is None else np.searchsorted(keys, np.datetime64(date_from, "ns"), side="left")
+    if date_to is None:
+        stop = len(keys)
+    else:
+        stop = np.searchsorted(keys, np.datetime64(date_to, "ns"), side="left" if exclusive_to else "right")
+    return ids[start:stop]
+
+def memory_usage():
+    with _lock:
+        return {"bytes": sum(keys.nbytes + ids.nbytes for keys, ids in _indexes.values()), "columns": len(_indexes)}
@@ -0,0 +1,278 @@
+# importer.py
+"""Bulk import of CSV/XLSX job lists into the cached job table.
+
+The file is read CHUNK_ROWS rows at a time, never whole, and each chunk is:
+
+1. renamed to the table's headers (map_headers),
+2. validated and type-coerced with vectorized pandas operations
+   (validate_chunk),
+3. de-duplicated on S.O.# against the table (through the S.O.# index) and
+   the rows imported so far,
+4. appended with table_cache.append_rows, so the indexes and refined
+   vocabularies update once per chunk.
+
+Steps 2-4 hold the table cache lock, so a row submitted while the import
+runs cannot slip in between the S.O.# check and the append.
+
+The workbook is written once at the end, and clients get a single "reload"
+on the change feed. Rejected rows go to a CSV report in DB/imports with the
+line they came from and the reason.
+
+Run it from the command line:
+
+    python importer.py jobs.xlsx
+    python importer.py legacy.csv --map "SO Number=S.O.#" --dry-run
+    python importer.py legacy.csv --server http://localhost:5000
+
+Use --server while the host is running, so the import goes through the host
+and its caches see it.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import time
+from collections import Counter
+import numpy as np
+import pandas as pd
+import change_feed
+import table_cache
+from schema import DATE_COLUMNS, DATE_FORMAT, NUMERIC_COLUMNS, column_key, to_dates, to_numbers
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DB_DIR = os.path.join(BASE_DIR, "DB")
+EXCEL_FILE_PATH = os.path.join(DB_DIR, "aggregated_data2.xlsx")
+REFINED_DIR = os.path.join(DB_DIR, "refined")
+VOCABULARY_PATH = os.path.join(DB_DIR, "vocabulary.sqlite3")
+IMPORTS_DIR = os.path.join(DB_DIR, "imports")  # Uploads and rejects reports
+
+CHUNK_ROWS = 5000  # Rows validated and appended at a time
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx", ".xlsm")
+
+# Other names legacy and customer spreadsheets use for our headers (compared by header_key)
+HEADER_ALIASES = {
+    "sonumber": "S.O.#", "salesorder": "S.O.#", "salesordernumber": "S.O.#",
+    "po": "P.O.#", "ponumber": "P.O.#", "purchaseorder": "P.O.#",
+    "dwg": "Dwg.", "drawing": "Dwg.", "dwgnumber": "Dwg.",
+    "qty": "Quantity",
+    "total": "Total $'s", "totalcost": "Total $'s", "totalprice": "Total $'s",
+    "costeach": "Cost Each", "unitcost": "Cost Each", "unitprice": "Cost Each",
+    "custnumber": "Customer Number", "customerno": "Customer Number",
+    "status": "Engineer Status",
+}
+
+def header_key(name):
+    """Compare headers ignoring case, spaces and punctuation ("s.o. #" == "S.O.#")."""
+    return re.sub(r"[_#$&]", "", column_key(name)).lower()
+
+def map_headers(source_columns, table_columns, mapping=None):
+    """Return ({source column: table header}, [source columns that are not imported]).
+
+    An explicit mapping {source column: table header} wins; otherwise a column
+    matches a table header with the same header_key or a HEADER_ALIASES entry.
+    """
+    mapping = mapping or {}
+    by_key = {header_key(header): header for header in table_columns}
+    for alias, header in HEADER_ALIASES.items():
+        if header in table_columns:
+            by_key.setdefault(alias, header)
+
+    mapped, unmapped, taken = {}, [], set()
+    for column in source_columns:
+        target = mapping.get(column) or by_key.get(header_key(column))
+        if target in table_columns and target not in taken:
+            mapped[column] = target
+            taken.add(target)
+        else:
+            unmapped.append(column)
+    return mapped, unmapped
+
+def _xlsx_cell(value):
+    """Text of one workbook cell as it would be typed (dates in DATE_FORMAT)."""
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _xlsx_chunks(path, chunk_rows):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)  # Streams rows from disk
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_xlsx_cell(value).strip() for value in next(rows, ())]
+        batch = []
+        for values in rows:
+            cells = [_xlsx_cell(value) for value in values[:len(header)]]
+            batch.append(cells + [""] * (len(header) - len(cells)))
+            if len(batch) == chunk_rows:
+                yield pd.DataFrame(batch, columns=header, dtype=object)
+                batch = []
+        if batch or not header:
+            yield pd.DataFrame(batch, columns=header, dtype=object)
+    finally:
+        workbook.close()
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Yield the file as DataFrames of text cells, chunk_rows rows at a time.
+
+    The index of each chunk is the line/row number in the file (the header is 1).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        chunks = pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+                             encoding="utf-8-sig", encoding_errors="replace")
+    elif extension in (".xlsx", ".xlsm"):
+        chunks = _xlsx_chunks(path, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported file type '{extension}', expected one of {', '.join(SUPPORTED_EXTENSIONS)}")
+
+    line = 2
+    for chunk in chunks:
+        chunk.index = range(line, line + len(chunk))
+        line += len(chunk)
+        yield chunk
+
+def validate_chunk(chunk, existing, imported):
+    """Coerce one mapped chunk; returns (rows to import, reasons of the rejected rows by line).
+
+    existing is the set of S.O.# already in the table and imported the set
+    accepted from earlier chunks; the S.O.# accepted now are added to imported.
+    """
+    clean = pd.DataFrame(index=chunk.index)
+    for column in chunk.columns:
+        text = chunk[column].fillna("").astype(str).str.strip()
+        clean[column] = text.where(text != "").astype(object)
+
+    reasons = pd.Series("", index=chunk.index, dtype=object)
+    def reject(mask, reason):
+        reasons[(reasons == "") & mask] = reason
+
+    so_numbers = clean["S.O.#"]
+    reject(so_numbers.isna(), "missing S.O.#")
+    reject(so_numbers.notna() & (so_numbers.duplicated() | so_numbers.isin(imported)), "S.O.# repeated in file")
+    reject(pd.Series(np.fromiter((value in existing for value in so_numbers), bool, len(so_numbers)),
+                     index=chunk.index), "S.O.# already exists")
+
+    for column in clean.columns:
+        if column in NUMERIC_COLUMNS:
+            numbers = to_numbers(clean[column])
+            reject(clean[column].notna() & numbers.isna(), f"{column} is not a number")
+            clean[column] = numbers
+        elif column in DATE_COLUMNS:
+            dates = to_dates(clean[column])
+            reject(clean[column].notna() & dates.isna(), f"{column} is not a date (mm-dd-yyyy or yyyy-mm-dd)")
+            clean[column] = dates.dt.strftime(DATE_FORMAT).astype(object).where(dates.notna())
+
+    accepted = reasons == ""
+    imported.update(so_numbers[accepted])
+    return clean[accepted], reasons[~accepted]
+
+def _write_rejects(rejects_path, rejected, source_columns):
+    """Append rejected rows (original cells) to the CSV report."""
+    report = rejected.reindex(columns=["reason"] + list(source_columns))
+    report.to_csv(rejects_path, mode="a", header=not os.path.exists(rejects_path),
+                  index_label="line", encoding="utf-8")
+
+def import_file(path, mapping=None, dry_run=False, chunk_rows=CHUNK_ROWS, rejects_dir=IMPORTS_DIR, log=print):
+    """Import a CSV/XLSX file into the table (table_cache must be loaded).
+
+    Returns a summary: accepted/rejected counts, reject reasons, unmapped
+    columns and the path of the rejects report. With dry_run nothing is
+    written to the table; the summary shows what would happen.
+    Raises ValueError if the file cannot be imported at all.
+    """
+    started = time.time()
+    table_columns = list(table_cache.get_table().columns)
+    imported = set()
+
+    os.makedirs(rejects_dir, exist_ok=True)
+    rejects_path = os.path.join(rejects_dir, f"{os.path.splitext(os.path.basename(path))[0]}_"
+                                             f"{time.strftime('%Y%m%d_%H%M%S')}_rejects.csv")
+    accepted = rejected = chunks = 0
+    reasons = Counter()
+    header_map = unmapped = None
+
+    for chunk in read_chunks(path, chunk_rows):
+        if header_map is None:
+            header_map, unmapped = map_headers(list(chunk.columns), table_columns, mapping)
+            if "S.O.#" not in header_map.values():
+                raise ValueError(f"No column maps to S.O.#; columns found: {', '.join(map(str, chunk.columns))}")
+            source_columns = list(chunk.columns)
+        if chunk.empty:
+            continue
+        chunks += 1
+
+        mapped = chunk[list(header_map)].rename(columns=header_map)
+        with table_cache.locked():  # Checked against the table as it is when the chunk goes in
+            existing = table_cache.existing_keys(mapped["S.O.#"].fillna("").astype(str).str.strip())
+            rows, reject_reasons = validate_chunk(mapped, existing, imported)
+            if len(rows) and not dry_run:
+                table_cache.append_rows(rows)
+        if len(reject_reasons):
+            rejects = chunk.loc[reject_reasons.index].copy()
+            rejects["reason"] = reject_reasons
+            _write_rejects(rejects_path, rejects, source_columns)
+            reasons.update(reject_reasons)
+        accepted += len(rows)
+        rejected += len(reject_reasons)
+        log(f"Import {os.path.basename(path)}: chunk {chunks}, {accepted} accepted, {rejected} rejected so far.")
+
+    if header_map is None:
+        raise ValueError("The file is empty")
+    if accepted and not dry_run:
+        table_cache.save()  # One workbook write for the whole import
+        change_feed.publish("reload", {})  # Open clients reload once instead of replaying every row
+
+    return {
+        "file": os.path.basename(path),
+        "dry_run": dry_run,
+        "accepted": accepted,
+        "rejected": rejected,
+        "reasons": dict(reasons),
+        "mapped_columns": header_map,
+        "unmapped_columns": unmapped,
+        "rejects_file": rejects_path if rejected else None,
+        "seconds": round(time.time() - started, 2),
+    }
+
+def parse_mapping(items):
+    """Turn ["Source=Header", ...] (CLI --map) into {source: header}."""
+    mapping = {}
+    for item in items or []:
+        source, separator, target = item.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid mapping '{item}', expected 'Source column=Header'")
+        mapping[source.strip()] = target.strip()
+    return mapping
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a CSV/XLSX job list into the job table.")
+    parser.add_argument("path", help="CSV or XLSX file to import")
+    parser.add_argument("--map", action="append", metavar="SOURCE=HEADER",
+                        help="map a file column to a table header (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="validate and report without importing")
+    parser.add_argument("--server", help="send the file to a running host (e.g. http://localhost:5000)")
+    parser.add_argument("--workbook", default=EXCEL_FILE_PATH, help="workbook to import into (without --server)")
+    args = parser.parse_args()
+    mapping = parse_mapping(args.map)
+
+    if args.server:
+        import requests
+        with open(args.path, "rb") as file:
+            response = requests.post(f"{args.server}/import", files={"file": file},
+                                     data={"mapping": json.dumps(mapping), "dry_run": "1" if args.dry_run else "0"})
+        print(json.dumps(response.json(), indent=2))
+        raise SystemExit(0 if response.ok else 1)
+
+    import refined_store
+    table_cache.add_listener(refined_store.on_table_change)
+    table_cache.load(args.workbook)
+    refined_store.load(VOCABULARY_PATH, list(table_cache.get_table().columns), legacy_dir=REFINED_DIR)
+    print(json.dumps(import_file(args.path, mapping=mapping, dry_run=args.dry_run), indent=2))
+
+if __name__ == "__main__":
+    main()
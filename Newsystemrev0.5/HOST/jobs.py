@@ -0,0 +1,161 @@
+# jobs.py
+"""Background jobs for long host operations (sync, export, import, reindex).
+
+POST /jobs/<kind> records a job and returns its id at once; a small pool of
+worker threads runs it, and GET /jobs/<id> shows its status and progress
+while it runs. A job that produces a file (an export, an import's rejects
+report) keeps it in DB/jobs/ until it is downloaded from
+GET /jobs/<id>/result or the job expires.
+
+Jobs are recorded in DB/jobs.sqlite3, so their outcome survives a restart.
+Records and result files older than the retention period are deleted when
+the host starts and then at most every PRUNE_INTERVAL as jobs are submitted.
+Jobs that were queued or running when the host stopped are marked failed
+when it starts again; they are not re-run, since a half-done import must be
+looked at before it is repeated.
+
+The workers are threads, not processes: every job works on the in-memory
+table (table_cache) and the indexes that follow it, which only this process
+holds. Each kind is a handler registered by HOST.py:
+
+    handler(job_id, params, progress) -> (result dict, result file path or None)
+
+progress(message, fraction=None) records how far the job has got, and a
+handler writing a file puts it at result_path(job_id, extension).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+PRUNE_INTERVAL = 3600  # Seconds between deletions of expired jobs
+
+_lock = threading.Lock()
+_db = None
+_results_dir = None
+_pool = None
+_handlers = {}  # kind -> handler
+_retention_seconds = None
+_expire_dirs = []  # Other folders whose files expire with the jobs (import uploads, rejects reports)
+_pruned = 0.0
+
+class UnknownJobKind(ValueError):
+    """No handler is registered for the requested kind."""
+
+def open_jobs(db_path, results_dir, workers=2, retention_days=7, expire_dirs=()):
+    """Open the job table, fail jobs interrupted by a restart and drop expired ones.
+
+    Files in expire_dirs older than retention_days are deleted along with them.
+    """
+    global _db, _results_dir, _pool, _retention_seconds, _expire_dirs
+    os.makedirs(results_dir, exist_ok=True)
+    with _lock:
+        _db = sqlite3.connect(db_path, check_same_thread=False)
+        _db.row_factory = sqlite3.Row
+        _results_dir = results_dir
+        _retention_seconds = retention_days * 86400
+        _expire_dirs = list(expire_dirs)
+        with _db:
+            _db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, params TEXT NOT NULL,
+                progress TEXT, fraction REAL, result TEXT, result_file TEXT, error TEXT,
+                created REAL NOT NULL, started REAL, finished REAL)""")
+            _db.execute("UPDATE jobs SET status = 'failed', error = 'The host stopped before the job finished', "
+                        "finished = ? WHERE status IN ('queued', 'running')", (time.time(),))
+        _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+    prune()
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass  # Already gone, or still open (deleted on a later pass)
+
+def prune():
+    """Delete job records and result files older than the retention period, and old files in expire_dirs."""
+    global _pruned
+    cutoff = time.time() - _retention_seconds
+    with _lock, _db:
+        expired = _db.execute("SELECT id, result_file FROM jobs WHERE created < ? AND status NOT IN ('queued', 'running')",
+                              (cutoff,)).fetchall()
+        _db.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in expired])
+        _pruned = time.monotonic()
+    for row in expired:
+        if row["result_file"]:
+            _remove(row["result_file"])
+    for folder in _expire_dirs:
+        if os.path.isdir(folder):
+            for entry in os.scandir(folder):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    _remove(entry.path)
+
+def register(kind, handler):
+    _handlers[kind] = handler
+
+def kinds():
+    return sorted(_handlers)
+
+def result_path(job_id, extension):
+    """Where a job should write its result file."""
+    return os.path.join(_results_dir, f"{job_id}{extension}")
+
+def _update(job_id, **fields):
+    with _lock, _db:
+        _db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                    (*fields.values(), job_id))
+
+def _record(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["has_result_file"] = bool(job.pop("result_file"))
+    return job
+
+def _run(job_id, kind, params):
+    _update(job_id, status="running", started=time.time())
+
+    def progress(message, fraction=None):
+        _update(job_id, progress=message, fraction=fraction)
+
+    try:
+        result, result_file = _handlers[kind](job_id, params, progress)
+        _update(job_id, status="done", result=json.dumps(result, default=str), result_file=result_file,
+                fraction=1.0, finished=time.time())
+    except Exception as e:
+        print(f"Job {job_id} ({kind}) failed: {e}")
+        _update(job_id, status="failed", error=str(e), finished=time.time())
+
+def submit(kind, params=None):
+    """Queue a job; returns its record. Raises UnknownJobKind."""
+    if kind not in _handlers:
+        raise UnknownJobKind(f"Unknown job kind {kind!r}; use one of {', '.join(kinds())}")
+    job_id = uuid.uuid4().hex
+    params = params or {}
+    with _lock, _db:
+        _db.execute("INSERT INTO jobs (id, kind, status, params, created) VALUES (?, ?, 'queued', ?, ?)",
+                    (job_id, kind, json.dumps(params), time.time()))
+    _pool.submit(_run, job_id, kind, params)
+    if time.monotonic() - _pruned > PRUNE_INTERVAL:
+        prune()
+    return get(job_id)
+
+def get(job_id):
+    """The job's record (status, progress, result...), or None."""
+    with _lock:
+        return _record(_db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+def result_file(job_id):
+    """Path of a finished job's result file, or None."""
+    with _lock:
+        row = _db.execute("SELECT result_file FROM jobs WHERE id = ? AND status = 'done'", (job_id,)).fetchone()
+    return row["result_file"] if row else None
+
+def recent(limit=50):
+    """The most recent jobs, newest first."""
+    with _lock:
+        return [_record(row) for row in _db.execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))]
@@ -0,0 +1,467 @@
+# journal.py
+"""Write journal, snapshots and point-in-time restore for the job table.
+
+Every write to the cached table is appended to a journal (DB/journal/
+journal_YYYYMMDD.jsonl, one JSON line per write, flushed to disk before the
+write returns), so a change is durable before the workbook is saved. The
+workbook itself is saved in the background by table_cache's flusher; when
+the host starts, journal entries newer than the last save are replayed.
+
+Every few minutes (start_snapshots) the table is also snapshotted into
+DB/journal/snapshots as a compressed pickle. Most snapshots are incremental:
+they hold only the rows written since the previous snapshot, and a full
+snapshot is taken every FULL_SNAPSHOT_EVERY snapshots, when the workbook is
+replaced on disk, or when most of the table changed. While writes are held
+only the changed rows (found through the S.O.# index) are copied, or for a
+full snapshot a copy-on-write view of the table is taken; spilled columns
+are read back and everything is pickled afterwards.
+
+Journals and snapshots older than the retention window are deleted, keeping
+what is needed to rebuild the table at the start of the window. Within the
+window:
+
+    GET /history/<so>                         past versions of one row
+    python journal.py history 12345           the same from the command line
+    python journal.py restore "2026-10-19 14:30" [--output FILE] [--replace]
+                                              rebuild the table as it was then
+
+Read replicas (replica.py) follow the journal over HTTP: GET /journal
+long-polls for entries after a sequence, answered from the last
+RECENT_ENTRIES in memory or, further back, from the journal files.
+"""
+import argparse
+import datetime
+import glob
+import gzip
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import deque
+import pandas as pd
+import table_cache
+from atomic_file import atomic_path, atomic_write, file_lock
+from change_feed import json_row
+from value_index import cell_text
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DB_DIR = os.path.join(BASE_DIR, "DB")
+EXCEL_FILE_PATH = os.path.join(DB_DIR, "aggregated_data2.xlsx")
+JOURNAL_DIR = os.path.join(DB_DIR, "journal")
+
+RETENTION_DAYS = 14         # Default history window
+SNAPSHOT_INTERVAL = 300     # Seconds between snapshots (skipped when nothing changed)
+FULL_SNAPSHOT_EVERY = 12    # Incremental snapshots between full ones
+RECENT_ENTRIES = 2000       # Entries kept in memory for replicas
+MAX_ENTRIES_PER_POLL = 200  # Entries returned by one entries_after call
+
+_lock = threading.RLock()
+_appended = threading.Condition(_lock)
+_recent = deque(maxlen=RECENT_ENTRIES)
+_journal_dir = None
+_excel_path = None
+_retention_days = RETENTION_DAYS
+_seq = 0                 # Sequence of the last journal entry
+_ready = False           # Set by recover(); writes before that are the replay itself
+_file = None             # Open journal file and the day it is for
+_file_day = None
+_touched = set()         # S.O.# written since the last snapshot
+_last_snapshot = None    # {"seq", "kind", "base_seq"} of the newest snapshot
+_deltas_since_base = 0
+_force_full = False
+
+class ResyncRequired(Exception):
+    """The entries after the requested sequence are no longer kept; the replica must reload."""
+
+def _snapshot_dir():
+    return os.path.join(_journal_dir, "snapshots")
+
+def _journal_files():
+    return sorted(glob.glob(os.path.join(_journal_dir, "journal_*.jsonl")))
+
+def _snapshots():
+    """[(seq, kind, base seq, time, path)] of every snapshot, oldest first.
+
+    Files are named <seq>_<full|delta>_<seq of its full snapshot>_<unix time>.pkl.gz.
+    """
+    found = []
+    for path in glob.glob(os.path.join(_snapshot_dir(), "*.pkl.gz")):
+        seq, kind, base_seq, taken = os.path.basename(path).split(".")[0].split("_")
+        found.append((int(seq), kind, int(base_seq), int(taken), path))
+    return sorted(found)
+
+def _read_snapshot(path):
+    with gzip.open(path, "rb") as file:
+        return pickle.load(file)
+
+def _state_path():
+    return os.path.join(_journal_dir, "state.json")
+
+def _read_state():
+    try:
+        with open(_state_path(), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def _write_state(**values):
+    state = _read_state()
+    state.update(values)
+    with atomic_write(_state_path()) as file:
+        json.dump(state, file)
+
+def open_journal(journal_dir=JOURNAL_DIR, excel_path=EXCEL_FILE_PATH, retention_days=RETENTION_DAYS):
+    """Point the journal at its directory and find the last sequence written."""
+    global _journal_dir, _excel_path, _retention_days, _seq, _last_snapshot, _deltas_since_base
+    with _lock:
+        _journal_dir, _excel_path, _retention_days = journal_dir, excel_path, retention_days
+        os.makedirs(_snapshot_dir(), exist_ok=True)
+        _seq = 0
+        for path in reversed(_journal_files()):
+            last = None
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        last = line
+            if last:
+                try:
+                    _seq = json.loads(last)["seq"]
+                except ValueError:
+                    pass  # A line cut short by a crash; entries_since skips it too
+                break
+        snapshots = _snapshots()
+        if snapshots:
+            seq, kind, base_seq, taken, path = snapshots[-1]
+            _seq = max(_seq, seq)
+            _last_snapshot = {"seq": seq, "kind": kind, "base_seq": base_seq}
+            _deltas_since_base = sum(1 for snapshot in snapshots if snapshot[2] == base_seq and snapshot[1] == "delta")
+
+def _append(entry):
+    """Write one entry durably and return it with its sequence and time."""
+    global _seq, _file, _file_day
+    with _lock:
+        _seq += 1
+        entry = {"seq": _seq, "time": time.time(), **entry}
+        day = time.strftime("%Y%m%d", time.localtime(entry["time"]))
+        if _file is None or _file_day != day:
+            if _file is not None:
+                _file.close()
+            _file = open(os.path.join(_journal_dir, f"journal_{day}.jsonl"), "a", encoding="utf-8")
+            _file_day = day
+        _file.write(json.dumps(entry) + "\n")
+        _file.flush()
+        os.fsync(_file.fileno())
+        _recent.append(entry)
+        _appended.notify_all()
+        return entry
+
+def current_seq():
+    with _lock:
+        return _seq
+
+def on_table_change(event):
+    """table_cache listener (registered first): journal every write before anything else sees it."""
+    global _force_full
+    if _journal_dir is None:
+        return
+    if event["type"] == "saved":
+        # The workbook now holds everything up to here; recover() replays only what follows
+        _write_state(workbook_seq=_seq, workbook_mtime=os.path.getmtime(_excel_path))
+        return
+    if not _ready:
+        return
+    if event["type"] == "insert":
+        rows = [json_row(row) for row in event["rows"]]
+        _append({"type": "insert", "rows": rows, **({"bulk": True} if event.get("bulk") else {})})
+        _touched.update(cell_text(row.get("S.O.#")) for row in rows)
+    elif event["type"] == "update":
+        before, after = json_row(event["before"]), json_row(event["after"])
+        changes = {column: [before.get(column), value] for column, value in after.items() if value != before.get(column)}
+        if changes:
+            _append({"type": "update", "so": after.get("S.O.#"), "changes": changes, "row": after})
+            _touched.add(cell_text(after.get("S.O.#")))
+    elif event["type"] == "reload":
+        # The workbook was replaced on disk: the journal cannot replay across this, start a new base
+        _append({"type": "reload"})
+        _force_full = True
+        take_snapshot()
+
+def entries_since(seq, until=None):
+    """Yield the journal entries after seq (and up to time until), oldest first."""
+    for path in _journal_files():
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash was never acknowledged
+                if entry["seq"] <= seq:
+                    continue
+                if until is not None and entry["time"] > until:
+                    return
+                yield entry
+
+def entries_after(seq, timeout=0):
+    """Return up to MAX_ENTRIES_PER_POLL entries after seq, waiting up to timeout seconds for one.
+
+    Raises ResyncRequired if seq is unknown here or its successors were pruned.
+    """
+    with _appended:
+        if seq > _seq:
+            raise ResyncRequired()
+        if seq == _seq and timeout:
+            _appended.wait_for(lambda: _seq > seq, timeout=timeout)
+        if _recent and _recent[0]["seq"] <= seq + 1:
+            return [entry for entry in _recent if entry["seq"] > seq][:MAX_ENTRIES_PER_POLL]
+    entries = []
+    for entry in entries_since(seq):  # Older than the entries in memory: read the files
+        entries.append(entry)
+        if len(entries) == MAX_ENTRIES_PER_POLL:
+            break
+    if (entries and entries[0]["seq"] != seq + 1) or (not entries and seq < current_seq()):
+        raise ResyncRequired()
+    return entries
+
+def table_payload():
+    """Return (journal seq, table as split-orient JSON text) taken together, for replicas.
+
+    Numbers are written in full (DataFrame.to_json keeps only 10 digits), so a
+    replica holds the same values as the primary and gives rows the same versions.
+    """
+    with table_cache.locked():
+        df = table_cache.with_cold(table_cache.get_table())
+        data = df.astype(object).where(df.notna(), None).values.tolist()
+        return _seq, json.dumps({"columns": list(df.columns), "data": data}, default=str)
+
+def recover():
+    """Replay the journal entries the workbook missed (after a crash), then start journaling.
+
+    Returns the number of entries replayed. If the workbook was replaced on
+    disk since the last save, nothing is replayed and a full snapshot is taken.
+    """
+    global _ready, _force_full
+    state = _read_state()
+    mtime = os.path.getmtime(_excel_path)
+    replayed = 0
+    if state.get("workbook_mtime") == mtime:
+        for entry in entries_since(state.get("workbook_seq", 0)):
+            apply_entry(entry)  # Not journaled again: _ready is still False
+            replayed += 1
+        _ready = True
+    else:
+        _ready = True
+        if state or _seq:
+            _append({"type": "reload"})  # Replaced on disk (e.g. by DB/demopull.py) while the host was down
+        _write_state(workbook_seq=_seq, workbook_mtime=mtime)
+    if replayed:
+        table_cache.flush()  # Bulk entries do not wake the flusher; save what was replayed now
+    # Writes journaled after the newest snapshot are in no snapshot, and which rows they touched
+    # was only kept in memory: a delta now would leave them out of rebuild(), so start a new base
+    _force_full = (bool(replayed) or _last_snapshot is None or _last_snapshot["seq"] < _seq
+                   or state.get("workbook_mtime") != mtime)
+    take_snapshot()
+    return replayed
+
+def apply_entry(entry):
+    """Apply one journal entry to the cached table (replay and replicas)."""
+    if entry["type"] == "insert":
+        existing = table_cache.existing_keys([row.get("S.O.#") for row in entry["rows"]])
+        rows = [row for row in entry["rows"] if cell_text(row.get("S.O.#")) not in existing]
+        if rows and entry.get("bulk"):
+            table_cache.append_rows(pd.DataFrame(rows))  # An import chunk: one bulk event, like on the primary
+        elif rows:
+            table_cache.insert_rows(rows)
+    elif entry["type"] == "update":
+        row_id = table_cache.find_row_id(entry["so"])
+        if row_id is not None:
+            table_cache.update_row(row_id, {column: change[1] for column, change in entry["changes"].items()})
+
+def _write_snapshot(data):
+    path = os.path.join(_snapshot_dir(), f"{data['seq']:020d}_{data['kind']}_{data['base_seq']:020d}_{int(data['time'])}.pkl.gz")
+    with atomic_write(path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1) as file:
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+def take_snapshot():
+    """Snapshot the rows written since the last snapshot (or the whole table). Returns its path or None."""
+    global _last_snapshot, _deltas_since_base, _force_full
+    with table_cache.locked():  # Writes wait only while the rows are picked
+        seq = _seq
+        if _last_snapshot and _last_snapshot["seq"] == seq and not _force_full:
+            return None
+        df = table_cache.get_table()
+        full = (_force_full or _last_snapshot is None or _deltas_since_base >= FULL_SNAPSHOT_EVERY
+                or len(_touched) > len(df) // 4)
+        if full:
+            # Copy-on-write (pandas 3): writes after this copy their column, the view keeps this table
+            data = {"kind": "full", "seq": seq, "time": time.time(), "base_seq": seq,
+                    "table": df.copy(deep=False)}
+        else:
+            data = {"kind": "delta", "seq": seq, "time": time.time(), "base_seq": _last_snapshot["base_seq"],
+                    "rows": df.loc[table_cache.so_row_ids(_touched)].copy()}
+        _touched.clear()
+        _force_full = False
+
+    # Spilled cells written since are read newer than seq; replaying the journal
+    # after seq sets them again, so a rebuild still ends at the same table
+    key = "table" if full else "rows"
+    data[key] = table_cache.with_cold(data[key])
+
+    path = _write_snapshot(data)
+    _last_snapshot = {"seq": seq, "kind": data["kind"], "base_seq": data["base_seq"]}
+    _deltas_since_base = 0 if full else _deltas_since_base + 1
+    prune()
+    return path
+
+def prune():
+    """Delete journals and snapshots older than the retention window.
+
+    The newest snapshot from before the window (with its full snapshot) and
+    the journals after it are kept, so the start of the window can be rebuilt.
+    """
+    cutoff = time.time() - _retention_days * 86400
+    snapshots = _snapshots()
+    before = [snapshot for snapshot in snapshots if snapshot[3] < cutoff]
+    if not before:
+        return
+    anchor = before[-1]  # Rebuilds the start of the window together with its full snapshot
+    for seq, kind, base_seq, taken, path in snapshots:
+        if seq < anchor[2]:
+            os.remove(path)
+    keep_day = time.strftime("%Y%m%d", time.localtime(anchor[3]))
+    for path in _journal_files()[:-1]:  # Never the file being written
+        if os.path.basename(path)[len("journal_"):-len(".jsonl")] < keep_day:
+            os.remove(path)
+
+def _snapshot_worker(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            take_snapshot()
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
+
+def start_snapshots(interval=SNAPSHOT_INTERVAL):
+    """Take a snapshot every interval seconds in the background."""
+    threading.Thread(target=_snapshot_worker, args=(interval,), daemon=True).start()
+
+def history(so_number):
+    """Return the journaled versions of one row (within the retention window), oldest first."""
+    wanted = cell_text(so_number)
+    if wanted is None:
+        return []  # A blank S.O.# has no history
+    needle = json.dumps(wanted)[1:-1]  # As the key appears in a journal line (escaped like json.dumps writes it)
+    versions = []
+    for path in _journal_files():
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if needle not in line:  # Cheap test before parsing
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["type"] == "update" and cell_text(entry["so"]) == wanted:
+                    versions.append({"seq": entry["seq"], "time": entry["time"], "type": "update",
+                                     "changes": entry["changes"], "row": entry["row"]})
+                elif entry["type"] == "insert":
+                    for row in entry["rows"]:
+                        if cell_text(row.get("S.O.#")) == wanted:
+                            versions.append({"seq": entry["seq"], "time": entry["time"], "type": "insert", "row": row})
+    return versions
+
+def _apply_delta(df, rows):
+    """Overwrite or append rows (keyed by S.O.#) of a delta snapshot."""
+    rows = rows.reindex(columns=df.columns)
+    positions = pd.Series(range(len(df)), index=df["S.O.#"].map(cell_text))
+    positions = positions[~positions.index.duplicated()]
+    keys = rows["S.O.#"].map(cell_text)
+    present = keys.isin(positions.index)
+    df = df.astype(object)
+    df.iloc[positions[keys[present]].values] = rows[present].astype(object).values
+    return pd.concat([df, rows[~present]], ignore_index=True)
+
+def rebuild(until):
+    """Return (table as it was at time until, seq it is current to, entries replayed).
+
+    Raises ValueError if until is before the oldest snapshot kept.
+    """
+    snapshots = _snapshots()
+    chosen = [snapshot for snapshot in snapshots if snapshot[3] <= until]
+    if not chosen:
+        raise ValueError("No snapshot that old is kept; the history window starts at "
+                         + (time.ctime(snapshots[0][3]) if snapshots else "the next snapshot"))
+
+    seq, kind, base_seq, taken, path = chosen[-1]
+    base_path = next(snapshot[4] for snapshot in snapshots if snapshot[0] == base_seq and snapshot[1] == "full")
+    df = _read_snapshot(base_path)["table"].reset_index(drop=True)
+    for delta_seq, delta_kind, delta_base_seq, delta_taken, delta_path in snapshots:
+        if delta_kind == "delta" and delta_base_seq == base_seq and delta_seq <= seq:
+            df = _apply_delta(df, _read_snapshot(delta_path)["rows"])
+
+    replayed = 0
+    for entry in entries_since(seq, until):
+        if entry["type"] == "reload":
+            print(f"The workbook was replaced on disk at {time.ctime(entry['time'])}; stopping there.")
+            break
+        if entry["type"] == "insert":
+            df = pd.concat([df, pd.DataFrame(entry["rows"]).reindex(columns=df.columns)], ignore_index=True)
+        elif entry["type"] == "update":
+            matches = df.index[df["S.O.#"].map(cell_text) == cell_text(entry["so"])]
+            for column, change in entry["changes"].items():
+                if len(matches) and column in df.columns:
+                    df[column] = df[column].astype(object)
+                    df.at[matches[0], column] = change[1]
+        seq = entry["seq"]
+        replayed += 1
+    return df, seq, replayed
+
+def _parse_time(text):
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%m-%d-%Y %H:%M", "%m-%d-%Y"):
+        try:
+            return datetime.datetime.strptime(text, fmt).timestamp()  # Local time
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time '{text}', expected e.g. 2026-10-19 14:30")
+
+def main():
+    parser = argparse.ArgumentParser(description="Job table history and point-in-time restore.")
+    parser.add_argument("--journal-dir", default=JOURNAL_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    restore = commands.add_parser("restore", help="rebuild the table as it was at a time")
+    restore.add_argument("time", help='local time, e.g. "2026-10-19 14:30"')
+    restore.add_argument("--output", help="workbook to write (default DB/restored_<time>.xlsx)")
+    restore.add_argument("--replace", action="store_true",
+                         help="replace aggregated_data2.xlsx, keeping a backup (stop the host first)")
+    show = commands.add_parser("history", help="print the versions of one row")
+    show.add_argument("so", help="S.O.#")
+    args = parser.parse_args()
+
+    global _journal_dir
+    _journal_dir = args.journal_dir
+    if args.command == "history":
+        for version in history(args.so):
+            details = version.get("changes") or {column: value for column, value in version["row"].items() if value is not None}
+            print(time.ctime(version["time"]), version["type"], json.dumps(details))
+        return
+
+    try:
+        until = _parse_time(args.time)
+        df, seq, replayed = rebuild(until)
+    except ValueError as e:
+        parser.error(str(e))
+    output = args.output or os.path.join(DB_DIR, f"restored_{time.strftime('%Y%m%d_%H%M%S', time.localtime(until))}.xlsx")
+    with atomic_path(output) as temp_path:
+        df.to_excel(temp_path, index=False, engine="openpyxl")
+    print(f"Rebuilt {len(df)} rows as of {time.ctime(until)} (journal seq {seq}, {replayed} entries replayed) into {output}")
+    if args.replace:
+        backup = f"{EXCEL_FILE_PATH}.{time.strftime('%Y%m%d_%H%M%S')}.bak"
+        with file_lock(EXCEL_FILE_PATH):  # Not in the middle of one of the host's saves
+            shutil.copy2(EXCEL_FILE_PATH, backup)
+            os.replace(output, EXCEL_FILE_PATH)
+        print(f"Replaced {EXCEL_FILE_PATH} (previous copy kept as {backup}).")
+
+if __name__ == "__main__":
+    main()
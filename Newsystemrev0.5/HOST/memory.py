@@ -0,0 +1,190 @@
+# memory.py
+"""Memory budgets for the host's in-process structures, and what they cost.
+
+Everything the host serves from lives in its one process: the table
+(table_cache), the value, date and text indexes, the rollups, the change
+feed, the cached responses and the sorted value lists behind the pickers.
+HOST.py sets one budget per cache through configure():
+
+  "table"          - bytes the cached table may hold; over it, the free-text
+                     columns (NOTES, Description) move to an on-disk store and
+                     are read back only for the rows being sent (table_cache)
+  "response_cache" - bytes of pre-serialized responses kept (response_cache)
+  "suggestions"    - bytes of sorted value/token lists kept for the S.O.#
+                     picker, /distinct and word-prefix search; least recently
+                     used lists are dropped first and rebuilt when next needed
+
+A budget of None leaves that structure unbounded. GET /debug/memory adds up
+the memory_usage() of each module.
+
+Sizes are estimates from sys.getsizeof: objects shared between cells (equal
+strings, see table_cache's compaction) are counted once.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict, deque
+import pandas as pd
+
+BUDGET_NAMES = ("table", "response_cache", "suggestions")
+
+_lock = threading.Lock()
+_budgets = {name: None for name in BUDGET_NAMES}
+_lists = OrderedDict()  # (owner, key) -> (bytes, evict), least recently used first
+_lists_size = 0
+_stats = {"evictions": 0}
+_row_ids = {}  # row id -> the one int object the indexes keep for it
+
+def configure(budgets):
+    """Set the budgets (bytes or None), e.g. configure({"table": 512 * 2**20}). Raises KeyError for an unknown name."""
+    for name in budgets:
+        if name not in _budgets:
+            raise KeyError(f"Unknown memory budget {name!r}; use one of {', '.join(BUDGET_NAMES)}")
+    with _lock:
+        _budgets.update(budgets)
+        evicted = _evict()
+    for evict in evicted:
+        evict()
+
+def budget(name):
+    return _budgets[name]
+
+def parse_size(text):
+    """Bytes for "512MB", "2GB", "64K" or a plain number of megabytes; "none" for no budget."""
+    text = str(text).strip().upper().removesuffix("B")
+    if text in ("NONE", "UNLIMITED", ""):
+        return None
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text) * 2**20)
+
+# Suggestion lists: sorted copies kept for fast prefix search, rebuilt on demand
+
+def remember(owner, key, size, evict):
+    """Account for a cached list of size bytes; evict() drops it when the "suggestions" budget needs room.
+
+    evict is called after this module's lock is released and may take the
+    owner's lock, so owners call remember without holding their own lock.
+    """
+    global _lists_size
+    with _lock:
+        old = _lists.pop((owner, key), None)
+        if old is not None:
+            _lists_size -= old[0]
+        _lists[(owner, key)] = (size, evict)
+        _lists_size += size
+        evicted = _evict(keep=(owner, key))
+    for evict_list in evicted:
+        evict_list()
+
+def touch(owner, key):
+    """Mark a cached list as just used."""
+    with _lock:
+        if (owner, key) in _lists:
+            _lists.move_to_end((owner, key))
+
+def forget(owner, key=None):
+    """The owner dropped a list itself (or all of its lists, key None)."""
+    global _lists_size
+    with _lock:
+        for entry in [entry for entry in _lists if entry[0] == owner and (key is None or entry[1] == key)]:
+            _lists_size -= _lists.pop(entry)[0]
+
+def _evict(keep=None):
+    """Drop the least recently used lists until the budget is met; returns their evict callbacks to call."""
+    global _lists_size
+    limit = _budgets["suggestions"]
+    evicted = []
+    if limit is None:
+        return evicted
+    for entry in list(_lists):
+        if _lists_size <= limit:
+            break
+        if entry == keep:
+            continue  # The list just built is in use; a list larger than the budget is dropped on the next one
+        size, evict = _lists.pop(entry)
+        _lists_size -= size
+        _stats["evictions"] += 1
+        evicted.append(evict)
+    return evicted
+
+def suggestions_usage():
+    with _lock:
+        return {"bytes": _lists_size, "budget": _budgets["suggestions"], "lists": len(_lists), **_stats}
+
+# Row ids
+
+def row_id(value):
+    """The shared int object for a row id.
+
+    Every index entry refers to a row id; without sharing, each index (and
+    each column of one) would hold its own 28-byte int per row.
+    """
+    return _row_ids.setdefault(value, value)
+
+def clear_row_ids():
+    """Called by table_cache before a reload: the ids of the old table are not needed any more."""
+    _row_ids.clear()
+
+def row_ids_usage():
+    return {"bytes": sys.getsizeof(_row_ids) + len(_row_ids) * sys.getsizeof(2**40), "rows": len(_row_ids)}
+
+# Size estimates
+
+def sorted_list_bytes(values):
+    """A sorted list of values (or of (folded, value) pairs); the values themselves are shared with an index."""
+    size = sys.getsizeof(values)
+    if values and isinstance(values[0], tuple):
+        size += sum(sys.getsizeof(pair) + (sys.getsizeof(pair[0]) if pair[0] is not pair[1] else 0) for pair in values)
+    return size
+
+def postings_bytes(postings):
+    """A {text: row id or set of row ids} dict; the shared row id ints are counted by row_ids_usage."""
+    return sys.getsizeof(postings) + sum(sys.getsizeof(text) + (sys.getsizeof(ids) if isinstance(ids, set) else 0)
+                                         for text, ids in postings.items())
+
+def deep_bytes(value):
+    """Nested dicts, lists, tuples and sets with what they hold, each object counted once."""
+    seen = set()
+    stack = [value]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+    return size
+
+def holds_objects(dtype):
+    """True for columns that keep a Python object per cell (object, and text without pyarrow)."""
+    return dtype == object or (isinstance(dtype, pd.StringDtype) and dtype.storage == "python")
+
+def frame_bytes(df):
+    """A DataFrame, counting each distinct object in an object or text column once."""
+    size = int(df.memory_usage(index=True, deep=False).sum())
+    for column in df.columns:
+        if holds_objects(df[column].dtype):
+            values = df[column].dropna().to_numpy(dtype=object)
+            if len(values):
+                size += sum(map(sys.getsizeof, pd.unique(values)))
+    return size
+
+def process_bytes():
+    """Resident memory of this process, or None where it cannot be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:  # Optional: without psutil only Linux can tell
+        pass
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
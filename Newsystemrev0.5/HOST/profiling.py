@@ -0,0 +1,217 @@
+# profiling.py
+"""Where the host's time goes, measured on the running server.
+
+Three opt-in ways in, none of which need a restart:
+
+  GET /debug/profile?seconds=30  - samples the stacks of the threads serving
+                                   requests (and running jobs) for that long
+                                   and returns them as collapsed stacks, one
+                                   "root;caller;callee count" line per stack:
+                                   the input of flamegraph.pl and speedscope
+  X-Profile: 1 request header    - runs that one request under cProfile and
+                                   saves the stats (.prof, for pstats or
+                                   snakeviz) in the profiles folder; the
+                                   response names the file in X-Profile
+  slow-request capture           - with a threshold set (HOST.py
+                                   PROFILE_SLOW_REQUEST_MS or --profile-slow-ms),
+                                   every request is sampled while it runs and
+                                   one that took longer has its stacks saved
+                                   to the profiles folder as a .folded file
+
+Sampling is a thread reading sys._current_frames() every SAMPLE_INTERVAL
+seconds; it only runs while a request or capture wants it. Code holding the
+GIL in C (a long pandas call) is seen when it lets go, so a sample lands on
+the Python line that called it - which is the line we want anyway.
+
+The profiles folder keeps the newest KEEP_FILES files; older ones are deleted.
+"""
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.01  # Seconds between samples (100 per second)
+MAX_CAPTURE_SECONDS = 300  # Longest /debug/profile capture
+MAX_DEPTH = 200  # Frames kept per stack, innermost dropped beyond it
+KEEP_FILES = 200  # Saved profiles kept in the profiles folder
+
+_lock = threading.Lock()
+_wake = threading.Condition(_lock)
+_dir = None
+_slow_seconds = None
+_requests = {}  # thread id -> {"name": "GET /path", "started", "stacks": Counter or None}
+_captures = []  # Counters of the /debug/profile captures running now
+_sampler = None
+_stats = {"slow_requests": 0, "profiled_requests": 0, "captures": 0}
+
+def configure(profile_dir, slow_ms=None):
+    """Save profiles in profile_dir; sample every request and keep those slower than slow_ms (None: off)."""
+    global _dir, _slow_seconds
+    os.makedirs(profile_dir, exist_ok=True)
+    with _lock:
+        _dir = profile_dir
+        _slow_seconds = slow_ms / 1000 if slow_ms else None
+
+def slow_threshold_ms():
+    return int(_slow_seconds * 1000) if _slow_seconds else None
+
+# Stacks
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _collapse(frame, root):
+    """A stack as one collapsed line, outermost first, under a root frame (e.g. the request)."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.append(root)
+    return ";".join(reversed(names))
+
+def _job_threads():
+    """{thread id: root frame name} of the background job workers (jobs.py names them job_0, job_1...)."""
+    return {thread.ident: f"job worker {thread.name}" for thread in threading.enumerate()
+            if thread.name.startswith("job_")}
+
+def _idle(frame):
+    """True for a job worker waiting for work (its innermost Python frame is the pool's loop)."""
+    return frame.f_code.co_name == "_worker" and frame.f_code.co_filename.endswith(os.path.join("futures", "thread.py"))
+
+def _sample_once():
+    frames = sys._current_frames()
+    with _lock:
+        for ident, entry in _requests.items():
+            frame = frames.get(ident)
+            if frame is not None and entry["stacks"] is not None:
+                entry["stacks"][_collapse(frame, entry["name"])] += 1
+        if _captures:
+            roots = {**_job_threads(), **{ident: entry["name"] for ident, entry in _requests.items()}}
+            for ident, root in roots.items():
+                frame = frames.get(ident)
+                if frame is not None and not _idle(frame):
+                    stack = _collapse(frame, root)
+                    for capture in _captures:
+                        capture[stack] += 1
+    del frames  # Frames keep their locals alive
+
+def _wanted():
+    return bool(_captures) or any(entry["stacks"] is not None for entry in _requests.values())
+
+def _sample_loop():
+    while True:
+        with _lock:
+            _wake.wait_for(_wanted)
+        _sample_once()
+        time.sleep(SAMPLE_INTERVAL)
+
+def _ensure_sampler():
+    """Start the sampler thread the first time it is needed (called with _lock held)."""
+    global _sampler
+    if _sampler is None:
+        _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+        _sampler.start()
+    _wake.notify_all()
+
+def collect(seconds):
+    """Sample request and job threads for seconds; returns a Counter of collapsed stacks."""
+    seconds = max(0.1, min(float(seconds), MAX_CAPTURE_SECONDS))
+    capture = Counter()
+    with _lock:
+        _captures.append(capture)
+        _stats["captures"] += 1
+        _ensure_sampler()
+    try:
+        time.sleep(seconds)
+    finally:
+        with _lock:
+            _captures.remove(capture)
+    return capture
+
+def folded(stacks):
+    """Collapsed-stack text for a Counter of stacks, heaviest first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+# Per-request hooks (called by HOST.py around each request)
+
+def start_request(method, path, profile=False):
+    """Begin watching the current request; profile=True runs it under cProfile. Returns the profiler or None."""
+    name = f"{method} {path}"
+    with _lock:
+        sampled = _slow_seconds is not None
+        _requests[threading.get_ident()] = {"name": name, "started": time.monotonic(),
+                                            "stacks": Counter() if sampled else None}
+        if sampled:
+            _ensure_sampler()
+    if not profile:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def stop_profile(profiler, method, path):
+    """Stop a request's cProfile and save its stats; returns the file name."""
+    profiler.disable()
+    name = _file_name(method, path, time.monotonic() - _requests.get(threading.get_ident(), {}).get(
+        "started", time.monotonic()), "prof")
+    profiler.dump_stats(os.path.join(_dir, name))
+    with _lock:
+        _stats["profiled_requests"] += 1
+    _rotate()
+    return name
+
+def finish_request():
+    """Stop watching the current request; if it was slow, save its stacks. Returns (seconds, file name or None)."""
+    with _lock:
+        entry = _requests.pop(threading.get_ident(), None)
+        threshold = _slow_seconds
+    if entry is None:
+        return None, None
+    elapsed = time.monotonic() - entry["started"]
+    if threshold is None or elapsed < threshold or not entry["stacks"]:
+        return elapsed, None
+    method, _, path = entry["name"].partition(" ")
+    name = _file_name(method, path, elapsed, "folded")
+    with open(os.path.join(_dir, name), "w", encoding="utf-8") as file:
+        file.write(folded(entry["stacks"]))
+    with _lock:
+        _stats["slow_requests"] += 1
+    _rotate()
+    return elapsed, name
+
+# Saved profiles
+
+def _file_name(method, path, elapsed, extension):
+    """e.g. 20240611-141502-123_GET_get_data_2350ms.folded"""
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+    route = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")[:60] or "root"
+    return f"{stamp}_{method}_{route}_{int(elapsed * 1000)}ms.{extension}"
+
+def _rotate():
+    """Delete all but the newest KEEP_FILES profiles."""
+    for name in list_profiles()[KEEP_FILES:]:
+        try:
+            os.remove(os.path.join(_dir, name))
+        except OSError:
+            pass  # Being read, or already gone
+
+def list_profiles():
+    """Saved profile file names, newest first."""
+    if _dir is None or not os.path.isdir(_dir):
+        return []
+    return sorted((name for name in os.listdir(_dir) if name.endswith((".folded", ".prof"))), reverse=True)
+
+def profile_path(name):
+    """Full path of a saved profile, or None if name is not one."""
+    if name not in list_profiles():
+        return None
+    return os.path.join(_dir, name)
+
+def stats():
+    with _lock:
+        return {**_stats, "slow_request_ms": slow_threshold_ms(), "in_flight": len(_requests),
+                "sampling": _sampler is not None and _wanted(), "saved": len(list_profiles())}
@@ -0,0 +1,178 @@
+# query.py
+"""Structured filter/sort/page queries over the cached job table.
+
+A query is a list of filters and sort keys, e.g.
+
+    {"filters": [{"column": "Customer", "op": "in", "values": ["Acme", "Foo"]},
+                 {"column": "Due Date", "op": "range", "from": "10-01-2026", "to": "10-31-2026"},
+                 {"column": "*", "op": "contains", "value": "mandrel"},
+                 {"column": "NOTES", "op": "matches", "value": "rush 3.0"}],
+     "sort": [{"column": "Due Date", "descending": false}],
+     "page": 1, "page_size": 500}
+
+Filters are planned before anything is scanned: equals/in on a value-indexed
+column and ranges on a date-indexed column are answered from the indexes
+(smallest candidate set first), and only the rows that survive are scanned
+for contains and numeric ranges. Column "*" with "contains" searches every
+column, like the ShowData search box. "matches" is a word search over the
+free-text columns answered by text_index ("*" searches all of them).
+
+Columns table_cache moved to disk are read back only for the rows a scan or
+sort needs, and for the page returned.
+"""
+import pandas as pd
+import date_index
+from change_feed import json_row
+import table_cache
+import text_index
+import value_index
+from schema import DATE_COLUMNS, to_dates, to_numbers, parse_date_arg
+
+OPERATORS = ["equals", "contains", "in", "range", "matches"]
+
+# Largest page a client may ask for
+MAX_PAGE_SIZE = 5000
+
+def _validate(filters, sort, columns):
+    for item in filters:
+        if item.get("op") not in OPERATORS:
+            raise ValueError(f"Unknown op '{item.get('op')}', expected one of {OPERATORS}")
+        column = item.get("column")
+        if column == "*" and item["op"] not in ("contains", "matches"):
+            raise ValueError("Column '*' only supports 'contains' and 'matches'")
+        if item["op"] == "matches" and column != "*" and column not in text_index.indexed_columns():
+            raise ValueError(f"'matches' needs a free-text column ({', '.join(text_index.indexed_columns())}) or '*'")
+        if column != "*" and column not in columns:
+            raise KeyError(f"Unknown column: {column}")
+        if item["op"] == "in" and not isinstance(item.get("values"), list):
+            raise ValueError(f"'in' filter on {column} needs a 'values' list")
+        if item["op"] == "range" and item.get("from") in (None, "") and item.get("to") in (None, ""):
+            raise ValueError(f"'range' filter on {column} needs 'from' and/or 'to'")
+    for key in sort:
+        if key.get("column") not in columns:
+            raise KeyError(f"Unknown sort column: {key.get('column')}")
+
+def _index_plan(item):
+    """Return (estimated rows, fetch) if an index can answer this filter, else None."""
+    column, op = item["column"], item["op"]
+    if op == "matches":
+        ids = text_index.search(item.get("value", ""), None if column == "*" else [column])
+        return len(ids), lambda: ids
+    if op in ("equals", "in") and value_index.is_indexed(column):
+        values = [item.get("value")] if op == "equals" else item["values"]
+        return value_index.count(column, values), lambda: value_index.lookup(column, values)
+    if op == "range" and column in date_index.indexed_columns():
+        date_from = parse_date_arg(item["from"]) if item.get("from") else None
+        date_to = parse_date_arg(item["to"]) if item.get("to") else None
+        ids = date_index.range_ids(column, date_from, date_to)
+        return len(ids), lambda: set(ids.tolist())
+    return None
+
+def _scan_mask(rows, item):
+    """Evaluate one filter against a (small) frame of candidate rows."""
+    column, op = item["column"], item["op"]
+    if op == "contains":
+        needle = str(item.get("value", ""))
+        if column == "*":
+            mask = pd.Series(False, index=rows.index)
+            for name in rows.columns:
+                mask |= rows[name].astype(str).str.contains(needle, case=False, regex=False, na=False)
+            return mask
+        return rows[column].astype(str).str.contains(needle, case=False, regex=False, na=False)
+    if op in ("equals", "in"):
+        values = [item.get("value")] if op == "equals" else item["values"]
+        texts = {value_index.cell_text(value) for value in values}
+        return rows[column].map(value_index.cell_text).isin(texts)
+    # range on a column without a date index
+    if column in DATE_COLUMNS:
+        values = to_dates(rows[column])
+        low = parse_date_arg(item["from"]) if item.get("from") else None
+        high = parse_date_arg(item["to"]) if item.get("to") else None
+    else:
+        values = to_numbers(rows[column])
+        low = float(item["from"]) if item.get("from") not in (None, "") else None
+        high = float(item["to"]) if item.get("to") not in (None, "") else None
+    mask = values.notna()
+    if low is not None:
+        mask &= values >= low
+    if high is not None:
+        mask &= values <= high
+    return mask
+
+def _sort(rows, sort):
+    if not sort:
+        return rows
+    keys = {}
+    for key in sort:
+        column = key["column"]
+        if column in DATE_COLUMNS:
+            keys[column] = to_dates(rows[column])
+        else:
+            numbers = to_numbers(rows[column])
+            keys[column] = numbers if numbers.notna().sum() == rows[column].notna().sum() else rows[column].astype(str).str.lower()
+    order = pd.DataFrame(keys, index=rows.index)
+    order = order.sort_values(
+        [key["column"] for key in sort],
+        ascending=[not key.get("descending", False) for key in sort],
+        na_position="last", kind="stable",
+    )
+    return rows.loc[order.index]
+
+def select(df, filters=None, sort=None):
+    """Filter and sort the table. Returns (matching rows, plan)."""
+    filters = filters or []
+    sort = sort or []
+    _validate(filters, sort, df.columns)
+
+    # Index-backed filters first, most selective first; the rest are scanned
+    indexed, scanned = [], []
+    for item in filters:
+        plan = _index_plan(item)
+        if plan is None:
+            scanned.append(item)
+        else:
+            indexed.append((plan[0], item, plan[1]))
+    indexed.sort(key=lambda entry: entry[0])
+
+    plan = []
+    candidates = None
+    for estimate, item, fetch in indexed:
+        if candidates is not None and not candidates:
+            break
+        ids = fetch()
+        candidates = ids if candidates is None else candidates & ids
+        plan.append({"column": item["column"], "op": item["op"], "via": "index", "rows": estimate})
+
+    if candidates is None:
+        rows = df
+    else:
+        rows = df.loc[df.index.isin(candidates)]
+    needed = {item["column"] for item in scanned} | {key["column"] for key in sort}
+    rows = table_cache.with_cold(rows, None if "*" in needed else needed)
+    for item in scanned:
+        before = len(rows)
+        rows = rows[_scan_mask(rows, item)]
+        plan.append({"column": item["column"], "op": item["op"], "via": "scan", "rows": before})
+
+    return _sort(rows, sort), plan
+
+def run_query(df, filters=None, sort=None, page=1, page_size=500, records=True):
+    """Filter, sort and page the table.
+
+    Returns a dict with the page of rows (as records with blank cells as None,
+    or as a DataFrame when records is False), the total number of matches and
+    the plan, i.e. how each filter was evaluated.
+    """
+    page = max(int(page), 1)
+    page_size = min(max(int(page_size), 1), MAX_PAGE_SIZE)
+    rows, plan = select(df, filters, sort)
+    total = len(rows)
+    start = (page - 1) * page_size
+    rows = table_cache.with_cold(rows.iloc[start:start + page_size])
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "plan": plan,
+        "rows": [json_row(row) for row in rows.to_dict(orient="records")] if records else rows,
+    }
@@ -0,0 +1,293 @@
+# refined_store.py
+"""Refined vocabularies: the values each column has been given, ranked by use.
+
+Every column has one vocabulary, named by schema.column_key, so "Tube C.L.R."
+typed anywhere and the old Tube_C_L_R_.txt end up in the same place. Values
+are compared normalized (case and runs of whitespace ignored): " ACME  Corp"
+and "acme corp" are one entry, shown with the spelling seen first. Each entry
+counts how often it was written and remembers when it was last used, and
+values are served most used first, then most recently used, so the likely
+value is at the top of a dropdown. Only "enum" columns (schema.column_policy)
+have vocabularies: free text goes to text_index, and S.O.# and dates are
+never suggested.
+
+The vocabularies are kept in memory and in DB/vocabulary.sqlite3. The first
+time the store is opened it is filled from the legacy DB/refined/*.txt files
+(left on disk as they are), merging the duplicates the old sanitizers made
+(Tube_C_L_R.txt/Tube_C_L_R_.txt, Customer_2.txt, ...). sync() counts the
+values the job table holds. New values are published on the change feed.
+
+rebuild() recounts every vocabulary from the table into a new file that
+replaces the old one in one step (a store that cannot be read is set aside
+and rebuilt the same way when the host starts). Counting is fast, a few
+milliseconds per column, so it is done in this process, one column after
+the other, and the time each column took is reported.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import change_feed
+import memory
+from schema import column_key, column_policy
+from value_index import cell_text
+
+_lock = threading.Lock()
+_db = None
+_db_path = None
+_vocabularies = {}  # column key -> {normalized value -> [value, count, last used]}
+_headers = {}       # column key -> header, for the columns of the job table
+_ranked = {}        # column key -> ranked values (cleared when the vocabulary changes)
+
+def refined_file_name(header):
+    """Name the refined values of a column are served under ("Tube C.L.R." -> "Tube_C_L_R.txt")."""
+    return f"{column_key(header)}.txt"
+
+def normalize_value(value):
+    """Return (value as shown, value as compared) for a cell, or None if it is empty."""
+    text = cell_text(value)
+    if text is None:
+        return None
+    text = " ".join(text.split())
+    return text, text.casefold()
+
+def _legacy_key(stem, known_keys):
+    """Vocabulary a legacy refined file belongs to ("Customer_2" -> "Customer" if that exists)."""
+    key = column_key(stem)
+    match = re.fullmatch(r"(.+)_\d+", key)
+    if match and match.group(1) in known_keys:
+        return match.group(1)
+    return key
+
+def _import_legacy(db, refined_dir, headers):
+    """Fill an empty store from the DB/refined/*.txt files; returns the number of values."""
+    stems = [file_name[:-4] for file_name in sorted(os.listdir(refined_dir)) if file_name.endswith(".txt")]
+    known_keys = {column_key(name) for name in list(headers) + stems}
+    rows = {}
+    for stem in stems:
+        key = _legacy_key(stem, known_keys)
+        if column_policy(key) != "enum":
+            continue
+        # Files written on the shop PCs may not be valid in this platform's encoding
+        with open(os.path.join(refined_dir, f"{stem}.txt"), "r", errors="replace") as file:
+            for line in file:
+                normalized = normalize_value(line)
+                if normalized is not None:
+                    rows.setdefault((key, normalized[1]), normalized[0])
+    db.executemany("INSERT OR IGNORE INTO vocabulary (column_key, norm, value, count, last_used) VALUES (?, ?, ?, 0, 0)",
+                    [(key, norm, value) for (key, norm), value in rows.items()])
+    return len(rows)
+
+def _connect(db_path):
+    db = sqlite3.connect(db_path, check_same_thread=False)
+    with db:
+        db.execute("""CREATE TABLE IF NOT EXISTS vocabulary (
+            column_key TEXT NOT NULL, norm TEXT NOT NULL, value TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (column_key, norm))""")
+    return db
+
+def _open(db_path, headers, legacy_dir):
+    """Open the store, setting aside a file sqlite cannot read; fills an empty store from legacy_dir."""
+    try:
+        db = _connect(db_path)
+        empty = db.execute("SELECT COUNT(*) FROM vocabulary").fetchone()[0] == 0
+    except sqlite3.DatabaseError as e:
+        corrupt_path = f"{db_path}.corrupt-{time.strftime('%Y%m%d_%H%M%S')}"
+        print(f"Vocabulary store {db_path} cannot be read ({e}); moved to {corrupt_path}, rebuilding.")
+        os.replace(db_path, corrupt_path)
+        db = _connect(db_path)
+        empty = True
+    with db:
+        if empty and legacy_dir and os.path.isdir(legacy_dir):
+            print(f"Imported {_import_legacy(db, legacy_dir, headers)} values from the legacy refined files.")
+        # Stores filled before columns had policies still hold free text and S.O.#
+        keys = [row[0] for row in db.execute("SELECT DISTINCT column_key FROM vocabulary")]
+        db.executemany("DELETE FROM vocabulary WHERE column_key = ?",
+                       [(key,) for key in keys if column_policy(key) != "enum"])
+    return db
+
+def load(db_path, headers, legacy_dir=None):
+    """Open the store (importing legacy_dir the first time) and read it into memory."""
+    global _db, _db_path
+    with _lock:
+        _db = _open(db_path, headers, legacy_dir)
+        _db_path = db_path
+        _vocabularies.clear()
+        _ranked.clear()
+        for key, norm, value, count, last_used in _db.execute(
+                "SELECT column_key, norm, value, count, last_used FROM vocabulary ORDER BY rowid"):
+            _vocabularies.setdefault(key, {})[norm] = [value, count, last_used]
+        _headers.clear()
+        _headers.update({column_key(header): header for header in headers if column_policy(header) == "enum"})
+
+def _write(entries):
+    """Persist [(key, norm, entry)] in one transaction."""
+    with _db:
+        _db.executemany(
+            "INSERT INTO vocabulary (column_key, norm, value, count, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (column_key, norm) DO UPDATE SET count = excluded.count, last_used = excluded.last_used",
+            [(key, norm, *entry) for key, norm, entry in entries])
+
+def _count_column(series):
+    """{normalized value: [value as shown, rows holding it]} for one column."""
+    counts = {}
+    for value, rows in series.value_counts(sort=False).items():  # Normalize each distinct value once
+        normalized = normalize_value(value)
+        if normalized is not None:
+            entry = counts.setdefault(normalized[1], [normalized[0], 0])
+            entry[1] += int(rows)
+    return counts
+
+def rebuild(df, legacy_dir=None):
+    """Recount every vocabulary from the table and replace the store with the result in one step.
+
+    Values no row holds any more are dropped, except those from legacy_dir;
+    when each value was last used is kept. Returns {header: {"values": n,
+    "seconds": s}} for the columns counted.
+    """
+    global _db
+    timings = {}
+    with _lock:
+        vocabularies = {}
+        for header in df.columns:
+            if column_policy(header) != "enum":
+                continue
+            started = time.perf_counter()
+            key = column_key(header)
+            counted = vocabularies.setdefault(key, {})
+            for norm, (text, rows) in _count_column(df[header]).items():
+                previous = _vocabularies.get(key, {}).get(norm)
+                entry = counted.setdefault(norm, [previous[0] if previous else text, 0, previous[2] if previous else 0])
+                entry[1] += rows
+            timings[header] = {"values": len(counted), "seconds": round(time.perf_counter() - started, 4)}
+
+        # Written to a new file that replaces the store only once it is complete
+        new_path = f"{_db_path}.rebuild"
+        if os.path.exists(new_path):
+            os.remove(new_path)
+        db = _connect(new_path)
+        with db:
+            if legacy_dir and os.path.isdir(legacy_dir):
+                _import_legacy(db, legacy_dir, df.columns)
+            db.executemany("INSERT OR REPLACE INTO vocabulary (column_key, norm, value, count, last_used) "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           [(key, norm, *entry) for key, counted in vocabularies.items()
+                            for norm, entry in counted.items()])
+        db.close()
+        _db.close()
+        os.replace(new_path, _db_path)
+        _db = _connect(_db_path)
+
+        _vocabularies.clear()
+        for key, norm, value, count, last_used in _db.execute(
+                "SELECT column_key, norm, value, count, last_used FROM vocabulary ORDER BY rowid"):
+            _vocabularies.setdefault(key, {})[norm] = [value, count, last_used]
+        _ranked.clear()
+        _headers.clear()
+        _headers.update({column_key(header): header for header in df.columns if column_policy(header) == "enum"})
+    return timings
+
+def sync(df):
+    """Make every table column a vocabulary and count the values the table already holds.
+
+    A value's count becomes at least the number of rows holding it; counts
+    from writes since are kept.
+    """
+    with _lock:
+        _headers.clear()
+        changed = []
+        for header in df.columns:
+            if column_policy(header) != "enum":
+                continue
+            key = column_key(header)
+            _headers[key] = header
+            vocabulary = _vocabularies.setdefault(key, {})
+            for norm, (text, count) in _count_column(df[header]).items():
+                entry = vocabulary.setdefault(norm, [text, 0, 0])
+                if entry[1] < count:
+                    entry[1] = count
+                    changed.append((key, norm, entry))
+            _ranked.pop(key, None)
+        _write(changed)
+        return len(changed)
+
+def _ranked_values(key):
+    values = _ranked.get(key)
+    if values is None:
+        entries = _vocabularies.get(key, {}).values()
+        values = [entry[0] for entry in sorted(entries, key=lambda entry: (-entry[1], -entry[2], entry[0].casefold()))]
+        _ranked[key] = values
+    return values
+
+def list_files(all_columns=False, limit=None):
+    """Return {file name: values ranked by use} for the table's columns.
+
+    all_columns also returns the vocabularies of columns the table no longer
+    has (imported from legacy files); limit keeps the top values of each.
+    """
+    with _lock:
+        keys = sorted(_vocabularies) if all_columns else sorted(_headers)
+        return {f"{key}.txt": _ranked_values(key)[:limit] for key in keys}
+
+def suggest(header, prefix="", limit=10):
+    """Ranked values of a column starting with prefix, then those containing it (normalized)."""
+    prefix = " ".join(str(prefix).split()).casefold()
+    with _lock:
+        values = _ranked_values(column_key(header))
+        if not prefix:
+            return values[:limit]
+        starts, contains = [], []
+        for value in values:
+            norm = value.casefold()  # Stored values are already whitespace-normalized
+            if norm.startswith(prefix):
+                starts.append(value)
+                if len(starts) == limit:
+                    break
+            elif prefix in norm and len(contains) < limit:
+                contains.append(value)
+        return (starts + contains)[:limit]
+
+def absorb_rows(rows):
+    """Count the values written in rows, adding the new ones. Returns {file name: new values}."""
+    added = {}
+    now = time.time()
+    with _lock:
+        changed = {}
+        for row in rows:
+            for header, value in row.items():
+                normalized = normalize_value(value)
+                if normalized is None or column_policy(header) != "enum":
+                    continue
+                text, norm = normalized
+                key = column_key(header)
+                vocabulary = _vocabularies.setdefault(key, {})
+                entry = vocabulary.get(norm)
+                if entry is None:
+                    entry = vocabulary[norm] = [text, 0, 0]
+                    added.setdefault(key, (header, []))[1].append(text)
+                entry[1] += 1
+                entry[2] = now
+                changed[(key, norm)] = entry
+                _ranked.pop(key, None)
+        if changed:
+            _write([(key, norm, entry) for (key, norm), entry in changed.items()])
+
+    for key, (header, values) in added.items():
+        change_feed.publish("refined", {"file": f"{key}.txt", "column": header, "values": values})
+    return {f"{key}.txt": values for key, (header, values) in added.items()}
+
+def on_table_change(event):
+    """table_cache listener: count the values of inserted rows and of changed fields."""
+    if event["type"] == "insert":
+        absorb_rows(event["rows"])
+    elif event["type"] == "update":
+        before = event["before"]
+        absorb_rows([{column: value for column, value in event["after"].items()
+                      if normalize_value(value) != normalize_value(before.get(column))}])
+
+def memory_usage():
+    with _lock:
+        return {"bytes": memory.deep_bytes(_vocabularies) + memory.deep_bytes(_ranked),
+                "values": sum(len(values) for values in _vocabularies.values())}
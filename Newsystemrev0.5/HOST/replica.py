@@ -0,0 +1,121 @@
+# replica.py
+"""Read-replica mode for the host: python HOST.py --replica-of http://primary:5000
+
+A replica keeps its own cached table, indexes, refined vocabularies and
+change feed, and answers every read route locally, so clients in another
+building read over their LAN instead of the link to the primary.
+
+It starts from a copy of the primary's table (GET /journal/snapshot) and
+then follows the primary's write journal like `tail -f`: GET /journal
+long-polls for entries after the last applied sequence, and each entry is
+applied to the local table with journal.apply_entry, exactly as the primary
+replays its own journal after a crash. If the replica falls too far behind
+or the primary's workbook was replaced, it copies the table again.
+
+Writes are forwarded to the primary (forward). The primary answers with
+X-Journal-Seq, and the replica waits (briefly) until it has applied that
+entry before answering, so a client reads its own write back.
+"""
+import threading
+import time
+import pandas as pd
+import requests
+import change_feed
+import journal
+import table_cache
+
+POLL_TIMEOUT = 25       # Seconds the primary holds a /journal request open
+RETRY_DELAY = 5         # Seconds between attempts while the primary is unreachable
+READ_YOUR_WRITES_WAIT = 5  # Longest a forwarded write waits for its entry to arrive
+
+# Request headers passed through when forwarding a write
+FORWARDED_HEADERS = ["Content-Type", "X-Client-Id", "X-Request-Class", "If-Match", "Accept"]
+
+_primary = None
+_session = requests.Session()
+_applied = threading.Condition()
+_applied_seq = 0
+_status = {"connected": False, "last_contact": None, "resyncs": 0, "error": None}
+
+def copy_table():
+    """Copy the primary's table into the cache. Returns the journal sequence it is current to."""
+    global _applied_seq
+    response = _session.get(f"{_primary}/journal/snapshot", timeout=300)
+    response.raise_for_status()
+    body = response.json()
+    df = pd.DataFrame(body["table"]["data"], columns=body["table"]["columns"])
+    table_cache.load_frame(df)
+    with _applied:
+        _applied_seq = body["seq"]
+        _applied.notify_all()
+    return _applied_seq
+
+def _apply(entries):
+    global _applied_seq
+    bulk = False
+    for entry in entries:
+        if entry["type"] == "reload":
+            raise journal.ResyncRequired()
+        journal.apply_entry(entry)
+        bulk = bulk or entry.get("bulk", False)
+        with _applied:
+            _applied_seq = entry["seq"]
+            _applied.notify_all()
+    if bulk:
+        change_feed.publish("reload", {})  # Imports are not published row by row; clients reload once
+
+def _follow():
+    while True:
+        try:
+            response = _session.get(f"{_primary}/journal", params={"since": _applied_seq, "timeout": POLL_TIMEOUT},
+                                    timeout=POLL_TIMEOUT + 10)
+            if response.status_code == 410:
+                raise journal.ResyncRequired()
+            response.raise_for_status()
+            _apply(response.json()["entries"])
+            _status.update(connected=True, last_contact=time.time(), error=None)
+        except journal.ResyncRequired:
+            print("Replica is behind what the primary keeps; copying the table again.")
+            _status["resyncs"] += 1
+            try:
+                copy_table()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                _status.update(connected=False, error=str(e))
+                time.sleep(RETRY_DELAY)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            _status.update(connected=False, error=str(e))
+            time.sleep(RETRY_DELAY)
+
+def start(primary):
+    """Copy the primary's table and follow its journal in the background."""
+    global _primary
+    _primary = primary.rstrip("/")
+    seq = copy_table()
+    _status.update(connected=True, last_contact=time.time())
+    threading.Thread(target=_follow, daemon=True).start()
+    return seq
+
+def applied_seq():
+    with _applied:
+        return _applied_seq
+
+def wait_for(seq, timeout=READ_YOUR_WRITES_WAIT):
+    """Wait until the journal entry seq has been applied here. Returns True if it was."""
+    with _applied:
+        return _applied.wait_for(lambda: _applied_seq >= seq, timeout=timeout)
+
+def status():
+    return {"primary": _primary, "applied_seq": applied_seq(), **_status}
+
+def forward(request):
+    """Send a Flask request to the primary; returns (body, status, headers) for Flask."""
+    headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+    headers["X-Forwarded-For"] = request.remote_addr or ""
+    response = _session.request(request.method, f"{_primary}{request.full_path.rstrip('?')}",
+                                data=request.get_data(), headers=headers, timeout=300)
+    seq = response.headers.get("X-Journal-Seq")
+    if seq and request.method != "GET":
+        wait_for(int(seq))
+    passed = {name: response.headers[name] for name in ("Content-Type", "X-Journal-Seq", "Retry-After", "ETag")
+              if name in response.headers}
+    return response.content, response.status_code, passed
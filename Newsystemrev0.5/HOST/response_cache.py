@@ -0,0 +1,119 @@
+# response_cache.py
+"""Cached, pre-serialized responses for the big read routes.
+
+At shift start dozens of clients ask for /list_headers, /get_data and
+/list_refined within a few seconds, and between writes they all get the
+same answer. Each answer is serialized once and the bytes are kept, keyed
+by (route, query parameters) and stamped with the data version they were
+built from; a request at the same version is answered with those bytes.
+Any write moves the version on, and the next request rebuilds the entry.
+
+Requests that miss at the same moment are coalesced: the first builds the
+response, the others wait for it and are answered with the same bytes
+("single flight"), so a burst of identical requests costs one build.
+
+Entries are evicted least recently used first once they hold more than
+the memory cap; a response larger than the cap is served but not kept.
+"""
+import threading
+from collections import OrderedDict
+from flask import Response
+import change_feed
+import table_cache
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # (route, params) -> (version, body bytes, mimetype, headers), least recently used first
+_size = 0                 # Bytes held in _entries
+_max_bytes = 64 * 1024 * 1024
+_in_flight = {}           # (route, params, version) -> _Build
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+class _Build:
+    """A response being built; requests for the same key wait on it."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+def configure(max_bytes):
+    """Set the memory cap (bytes of response bodies kept; None for no cap)."""
+    global _max_bytes
+    with _lock:
+        _max_bytes = max_bytes
+        _evict()
+
+def data_version():
+    """The version cached responses are stamped with; changes on every write, reload and refined sync."""
+    table_cache.get_table()  # Picks up a workbook replaced on disk before the version is read
+    return table_cache.get_version(), change_feed.current_seq()
+
+def _evict():
+    global _size
+    while _max_bytes is not None and _size > _max_bytes and _entries:
+        _, (_, body, _, _) = _entries.popitem(last=False)
+        _size -= len(body)
+        _stats["evictions"] += 1
+
+def _store(key, version, body, mimetype, headers):
+    global _size
+    old = _entries.pop(key, None)
+    if old is not None:
+        _size -= len(old[1])
+    if _max_bytes is None or len(body) <= _max_bytes:
+        _entries[key] = (version, body, mimetype, headers)
+        _size += len(body)
+        _evict()
+
+def _response(body, mimetype, headers, state):
+    response = Response(body, status=200, mimetype=mimetype, headers=headers)
+    response.headers["X-Cache"] = state
+    return response
+
+def cached(route, params, build):
+    """Return the response for route/params at the current data version.
+
+    build() makes the response when it is not cached: a 200 Flask Response
+    (check the parameters before calling, errors are not cached).
+    """
+    key = (route, tuple(sorted(params.items())))
+    version = data_version()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == version:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return _response(*entry[1:], "hit")
+        flight = _in_flight.get((*key, version))
+        leader = flight is None
+        if leader:
+            flight = _in_flight[(*key, version)] = _Build()
+            _stats["misses"] += 1
+        else:
+            _stats["coalesced"] += 1
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return _response(*flight.result, "coalesced")
+
+    try:
+        response = build()
+        headers = {name: value for name, value in response.headers.items()
+                   if name not in ("Content-Type", "Content-Length")}
+        flight.result = (response.get_data(), response.mimetype, headers)
+        with _lock:
+            _store(key, version, *flight.result)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _in_flight.pop((*key, version), None)
+        flight.done.set()
+    return _response(*flight.result, "miss")
+
+def stats():
+    """Hit/miss counters and the memory held, for monitoring."""
+    with _lock:
+        return {**_stats, "entries": len(_entries), "bytes": _size, "max_bytes": _max_bytes}
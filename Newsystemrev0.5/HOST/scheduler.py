@@ -0,0 +1,113 @@
+# scheduler.py
+"""Per-client rate limits and priority classes for host requests.
+
+Saving a job in USERADD/USEREDIT has to stay quick while someone pastes
+2,000 P.O.#s into testpobatching.py or keeps reopening ShowData. Every
+request is put in a class:
+
+  interactive  writes and small lookups (the default)
+  bulk         whole-table reads, queries, imports, batch searches; also any
+               request sent with "X-Request-Class: bulk"
+  exempt       long-polls and streams, which wait by design
+
+Each client address has a token bucket per class: a request takes a token,
+tokens come back at the class rate, and a client with an empty bucket gets
+429 with Retry-After saying when the next token is due. The X-Client-Id
+header only names the client in logs and telemetry; a client can send any
+id it likes, but not change its address to get a fresh bucket. Bulk requests also run at most a few at a time across all
+clients; the rest queue for a while and are told to come back (429) if
+the queue does not move, so bulk work never takes all the host's time.
+"""
+import math
+import threading
+import time
+
+# Requests answered without limits (long-polls, streams, monitoring and the tools' timing reports)
+EXEMPT_PATHS = {"/changes", "/changes/stream", "/journal", "/replica/status", "/cache/status",
+               "/scheduler/status", "/debug/memory", "/debug/profile", "/debug/profiles", "/telemetry"}
+
+# Routes that read or write many rows at once
+BULK_PATHS = {"/get_data", "/list_refined", "/query", "/search_text", "/aggregate", "/due", "/distinct",
+              "/import", "/submit_data/batch", "/sync_refined", "/journal/snapshot",
+              "/telemetry/summary"}
+
+IDLE_BUCKET_SECONDS = 600  # Buckets of clients quiet this long are forgotten
+
+_lock = threading.Lock()
+_limits = {"interactive": (20.0, 40), "bulk": (10.0, 20)}  # class -> (tokens per second, bucket size)
+_slots = {"bulk": threading.BoundedSemaphore(2)}            # class -> running requests allowed
+_queue_timeout = 30.0                                         # Seconds a request waits for a slot
+_buckets = {}  # (client address, class) -> [tokens, last refill time]
+_stats = {"admitted": 0, "limited": 0, "queue_timeouts": 0}
+
+def configure(limits=None, concurrency=None, queue_timeout=None):
+    """Set {class: (rate, burst)}, {class: running requests allowed} and the slot wait."""
+    global _queue_timeout
+    with _lock:
+        if limits:
+            _limits.update(limits)
+        if concurrency:
+            _slots.update({kind: threading.BoundedSemaphore(count) for kind, count in concurrency.items()})
+        if queue_timeout is not None:
+            _queue_timeout = queue_timeout
+
+def classify(method, path, headers):
+    """Class of a request: "exempt", "bulk" or "interactive"."""
+    if path in EXEMPT_PATHS:
+        return "exempt"
+    if path in BULK_PATHS or headers.get("X-Request-Class", "").lower() == "bulk":
+        return "bulk"
+    return "interactive"
+
+def client_id(headers, remote_addr):
+    """Who sent a request, for logs and telemetry (not for limits: the header is the client's to choose)."""
+    return headers.get("X-Client-Id") or remote_addr or "unknown"
+
+def _forget_idle(now):
+    for key in [key for key, (_, updated) in _buckets.items() if now - updated > IDLE_BUCKET_SECONDS]:
+        del _buckets[key]
+
+def take_token(client, kind):
+    """Take a token from the bucket of a client address. Returns 0, or the seconds until one is available."""
+    rate, burst = _limits[kind]
+    now = time.monotonic()
+    with _lock:
+        if len(_buckets) > 1000:
+            _forget_idle(now)
+        bucket = _buckets.setdefault((client, kind), [float(burst), now])
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / rate
+
+def admit(method, path, headers, remote_addr):
+    """Decide whether a request may run now.
+
+    Returns (slot, None) when it may (pass slot to release() when it is
+    done), or (None, retry_after_seconds) when the client must come back.
+    """
+    kind = classify(method, path, headers)
+    if kind == "exempt":
+        return None, None
+    wait = take_token(remote_addr or "unknown", kind)
+    if wait:
+        _stats["limited"] += 1
+        return None, max(1, math.ceil(wait))
+    slot = _slots.get(kind)
+    if slot is not None and not slot.acquire(timeout=_queue_timeout):
+        _stats["queue_timeouts"] += 1
+        return None, max(1, math.ceil(_queue_timeout / 2))
+    _stats["admitted"] += 1
+    return slot, None
+
+def release(slot):
+    if slot is not None:
+        slot.release()
+
+def stats():
+    """Counters and current limits, for monitoring."""
+    with _lock:
+        return {**_stats, "clients": len({client for client, _ in _buckets}),
+                "limits": {kind: {"rate": rate, "burst": burst} for kind, (rate, burst) in _limits.items()}}
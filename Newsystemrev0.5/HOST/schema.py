@@ -0,0 +1,101 @@
+# schema.py
+"""Column typing helpers shared by the HOST routes.
+
+The workbook stores dates as "%m-%d-%Y" strings (see DB/demopull.py) and money
+and measurements as plain numbers, but nothing guarantees a cell was not typed
+in by hand. Everything that needs typed values goes through these helpers.
+"""
+import re
+import pandas as pd
+
+# Predefined headers for the Excel file
+DEFAULT_HEADERS = [
+    "S.O.#", "Dwg.", "REP", "Customer", "Contact", "P.O.#", "Quantity", 
+    "Description", "Cost Each", "Start Date", "Due Date", "Completion Date", 
+    "Total $'s", "NOTES", "Received in Engineering", "Engineer Start Date", 
+    "Released Date", "Customer Number", "Engineer Status", "machine type", 
+    "Tooling type", "Tube O.D.", "Tube C.L.R.", "Tube W.T.", "Unit"
+]
+
+# Date format used by the workbook and the USER clients
+DATE_FORMAT = "%m-%d-%Y"
+
+# Columns that hold dates
+DATE_COLUMNS = [
+    "Start Date", "Due Date", "Completion Date", "Received in Engineering",
+    "Engineer Start Date", "Released Date"
+]
+
+# Columns that hold numbers
+NUMERIC_COLUMNS = [
+    "Quantity", "Cost Each", "Total $'s", "Tube O.D.", "Tube C.L.R.", "Tube W.T."
+]
+
+# Long free-text columns; these are searched through text_index.py, never indexed by value
+# ("Notes / Hold" is the notes column of older workbooks)
+FREE_TEXT_COLUMNS = ["NOTES", "Description", "Notes / Hold"]
+
+# Columns with a different value on every row
+KEY_COLUMNS = ["S.O.#"]
+
+# Job status column; older workbooks (and DB/demopull.py) call it "Status"
+STATUS_COLUMNS = ["Engineer Status", "Status"]
+
+# Statuses that mean a job is finished
+COMPLETED_STATUSES = ["completed"]
+
+def column_key(header):
+    """Canonical key of a column header, used for refined file names and header matching.
+
+    Every run of characters other than letters, digits, "#", "$" and "&" becomes
+    one "_", with none at the ends: "Tube C.L.R." -> "Tube_C_L_R", "S.O.#" -> "S_O_#".
+    USER/client_context.py has a copy; keep them the same.
+    """
+    return re.sub(r"[^0-9A-Za-z#$&]+", "_", str(header)).strip("_")
+
+def column_policy(header):
+    """How a column's values are kept, besides the table itself:
+
+    "text" - free text, tokenized into the full-text index (text_index.py)
+    "key"  - unique per row, found through the value index, never suggested
+    "date" - picked from a calendar or typed, never suggested
+    "enum" - everything else; its values make up a refined vocabulary
+    Headers are compared by column_key, so legacy spellings get the same policy.
+    """
+    key = column_key(header)
+    if key in {column_key(column) for column in FREE_TEXT_COLUMNS}:
+        return "text"
+    if key in {column_key(column) for column in KEY_COLUMNS}:
+        return "key"
+    if key in {column_key(column) for column in DATE_COLUMNS}:
+        return "date"
+    return "enum"
+
+def status_column(df):
+    """Return the name of the status column in df, or None if there is none."""
+    return next((column for column in STATUS_COLUMNS if column in df.columns), None)
+
+def to_numbers(series):
+    """Convert a column to floats; anything that is not a number becomes NaN."""
+    return pd.to_numeric(series, errors="coerce")
+
+def to_dates(series):
+    """Convert a column of workbook dates to datetime64; unparseable cells become NaT."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    text = series.astype(str).str.strip()
+    parsed = pd.to_datetime(text, format=DATE_FORMAT, errors="coerce")
+    # Cells typed by hand or written by the calendar picker use yyyy-mm-dd
+    missing = parsed.isna() & series.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(text[missing], format="%Y-%m-%d", errors="coerce")
+    return parsed
+
+def parse_date_arg(value):
+    """Parse a date given as a query parameter (mm-dd-yyyy or yyyy-mm-dd)."""
+    for fmt in (DATE_FORMAT, "%Y-%m-%d"):
+        try:
+            return pd.to_datetime(value, format=fmt)
+        except (ValueError, TypeError):
+            continue
+    raise ValueError(f"Invalid date '{value}', expected mm-dd-yyyy or yyyy-mm-dd")
@@ -0,0 +1,425 @@
+# table_cache.py
+"""In-memory copy of the job table shared by every HOST route.
+
+The workbook is read once at startup and again only when it changes on disk
+(for example after DB/demopull.py regenerates it). Writes go through
+insert_rows/update_row, which update the cached table and tell every
+registered listener what changed so derived structures (aggregates,
+indexes, the journal) can update incrementally instead of being rebuilt.
+
+Once start_flusher() has been called, the workbook is not written on every
+change: writes are made durable by journal.py and the workbook is saved in
+the background once writes have paused (see start_flusher). Without the
+flusher (command-line tools) every write saves the workbook as before. The
+workbook is always written with atomic_file (a temporary file swapped in),
+so a failed save never leaves a half-written table, and under its file lock,
+so another process replacing the workbook does not collide with a save.
+
+Row ids are the DataFrame index labels. They are stable for the life of the
+process: updates keep the id and inserts get the next free id.
+
+Memory: on every load, equal strings in a text column become one shared
+object (read_excel makes one per cell). If the table is still over its
+budget (configure_memory), the free-text columns are moved to cold_store on
+disk, largest first, until it fits; the table keeps None in them. Code that
+sends, searches or saves rows reads them back with with_cold(rows) (or
+get_row), only for those rows; listeners are always given full rows.
+"""
+import os
+import threading
+import time
+import pandas as pd
+import cold_store
+import memory
+import value_index
+from atomic_file import atomic_path, file_lock
+from schema import NUMERIC_COLUMNS, column_policy, to_numbers
+from value_index import cell_text
+
+SAVE_LOCK_TIMEOUT = 60  # Seconds a save waits for another process to let go of the workbook
+
+_lock = threading.RLock()
+_excel_path = None
+_df = None
+_mtime = None
+_version = 0
+_next_id = 0
+_listeners = []
+_dirty = False          # The cached table has changes the workbook does not
+_flush_delay = None     # Seconds without writes before a background save (None: save on every write)
+_flush_max_delay = None # Longest a change waits for its save while writes keep coming
+_flush_wakeup = threading.Event()
+_table_budget = None    # Bytes the table may hold before free-text columns are spilled (None: no limit)
+_spilled = []           # Columns whose values are in cold_store; the table holds None in them
+
+def configure_memory(table_budget, cold_path):
+    """Set the table's memory budget (bytes or None) and where spilled columns are kept; call before load."""
+    global _table_budget
+    _table_budget = table_budget
+    if table_budget is not None:
+        cold_store.open_store(cold_path)
+
+def _compact(df):
+    """Make equal strings in each repetitive text column one shared object (in place)."""
+    for column in df.columns:
+        series = df[column]
+        if not memory.holds_objects(series.dtype):
+            continue
+        values = series.to_numpy(dtype=object)
+        codes, uniques = pd.factorize(values)
+        if len(uniques) > len(values) // 2:
+            continue  # Mostly distinct (S.O.#, NOTES): nothing to share
+        if series.dtype == object and pd.api.types.infer_dtype(uniques, skipna=True) != "string":
+            continue  # Mixed types: factorize would merge 5 and 5.0
+        shared = uniques.take(codes)
+        missing = codes < 0
+        shared[missing] = values[missing]
+        df[column] = pd.Series(shared, index=df.index, dtype=series.dtype)
+
+def _spill():
+    """Move free-text columns to cold_store, largest first, until the table fits its budget."""
+    global _spilled
+    _spilled = []
+    if _table_budget is None:
+        return
+    cold_store.clear()
+    size = memory.frame_bytes(_df)
+    candidates = [column for column in _df.columns if column_policy(column) == "text"]
+    sizes = {column: memory.frame_bytes(_df[[column]]) for column in candidates}
+    for column in sorted(candidates, key=lambda column: -sizes[column]):
+        if size <= _table_budget:
+            break
+        cold_store.put_many(column, _df.index, _df[column])
+        _df[column] = None
+        size -= sizes[column] - memory.frame_bytes(_df[[column]])
+        _spilled.append(column)
+
+def _loaded():
+    """After a (re)load has been passed to the listeners: make the table small."""
+    _compact(_df)
+    _spill()
+
+def spilled_columns():
+    return list(_spilled)
+
+def with_cold(rows, columns=None):
+    """rows (a frame of table rows) with their spilled columns read back from disk.
+
+    columns limits which spilled columns are read. Returns rows itself when
+    nothing is spilled.
+    """
+    wanted = [column for column in _spilled if column in rows.columns and (columns is None or column in columns)]
+    if not wanted:
+        return rows
+    values = {column: cold_store.get_many(column, rows.index) for column in wanted}
+    return pd.DataFrame({column: pd.Series(values[column], index=rows.index, dtype=object) if column in values
+                         else rows[column] for column in rows.columns}, index=rows.index)
+
+def get_row(row_id):
+    """One full row as a dict (spilled columns included)."""
+    with _lock:
+        row = get_table().loc[row_id].to_dict()
+        for column in _spilled:
+            row[column] = cold_store.get_many(column, [row_id])[0]
+        return row
+
+def memory_usage():
+    """Estimated bytes of the cached table, and what was moved to disk."""
+    with _lock:
+        df = _df
+        spilled = list(_spilled)
+    return {"bytes": memory.frame_bytes(df) if df is not None else 0, "budget": _table_budget,
+            "rows": 0 if df is None else len(df), "spilled_columns": spilled,
+            "spilled_bytes_on_disk": cold_store.size_on_disk() if spilled else 0}
+
+def load(excel_path):
+    """Point the cache at a workbook and read it."""
+    global _excel_path
+    with _lock:
+        _excel_path = excel_path
+        _reload()
+
+def load_frame(df):
+    """Use df as the table without a workbook behind it (read replicas, see replica.py).
+
+    Writes still update the cache and notify listeners but are never saved.
+    """
+    global _excel_path, _df, _mtime, _version, _next_id
+    with _lock:
+        _excel_path = None
+        _df = df
+        _mtime = None
+        _next_id = len(df)
+        _version += 1
+        memory.clear_row_ids()
+        _notify({"type": "reload", "version": _version, "table": df})
+        _loaded()
+
+def _reload():
+    """Re-read the workbook from disk and tell listeners to rebuild."""
+    global _df, _mtime, _version, _next_id
+    df = pd.read_excel(_excel_path)
+    _df = df
+    _mtime = os.path.getmtime(_excel_path)
+    _next_id = len(df)
+    _version += 1
+    memory.clear_row_ids()
+    _notify({"type": "reload", "version": _version, "table": df})
+    _loaded()
+
+def _save():
+    """Write the cached table back to the workbook (through a temporary file)."""
+    global _mtime, _dirty
+    if _excel_path is None:
+        return  # A replica's table (load_frame) is never saved
+    with file_lock(_excel_path, timeout=SAVE_LOCK_TIMEOUT), atomic_path(_excel_path) as temp_path:
+        with_cold(_df).to_excel(temp_path, index=False, engine="openpyxl")
+    _mtime = os.path.getmtime(_excel_path)
+    _dirty = False
+    _notify({"type": "saved", "version": _version})
+
+def _written():
+    """Called after every write: save now, or leave it to the flusher."""
+    global _dirty
+    if _flush_delay is None:
+        _save()
+    else:
+        _dirty = True
+        _flush_wakeup.set()
+
+def _flusher():
+    global _dirty
+    while True:
+        _flush_wakeup.wait()
+        first_change = last_change = time.time()
+        # Wait for writes to pause, but not longer than _flush_max_delay in total
+        while time.time() - first_change < _flush_max_delay:
+            _flush_wakeup.clear()
+            if not _flush_wakeup.wait(max(0, min(_flush_delay - (time.time() - last_change),
+                                                  _flush_max_delay - (time.time() - first_change)))):
+                break
+            last_change = time.time()
+        _flush_wakeup.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"Saving the workbook failed ({e}); retrying with the next change.")
+            with _lock:
+                _dirty = True
+
+def start_flusher(delay=30, max_delay=300):
+    """Save the workbook in the background delay seconds after writes pause.
+
+    Only use this when the writes are journaled (journal.py); until the save,
+    the journal is the only durable copy of them.
+    """
+    global _flush_delay, _flush_max_delay
+    _flush_delay, _flush_max_delay = delay, max_delay
+    threading.Thread(target=_flusher, daemon=True).start()
+
+def flush():
+    """Save the workbook now if it is behind the cached table."""
+    with _lock:
+        if _dirty:
+            _save()
+
+def _notify(event):
+    for callback in list(_listeners):
+        callback(event)
+
+def add_listener(callback):
+    """Register callback(event) to be called after every reload or write.
+
+    Events are dicts with a "type" of "reload", "insert", "update" or "saved"
+    (the workbook on disk caught up with the cache). Reload
+    events carry the new "table"; insert events carry "ids" and "rows" (and
+    "bulk": True when they come from an import); update
+    events carry "id", "before" and "after" (full row dicts) and the "changed" columns. Callbacks run while the cache lock is held, so
+    they see writes in order and must not call back into the writers.
+    """
+    _listeners.append(callback)
+
+def get_table():
+    """Return the cached DataFrame, re-reading the workbook if it changed on disk.
+
+    The returned frame is shared; callers must treat it as read-only.
+    """
+    with _lock:
+        if _df is None:
+            raise RuntimeError("Table cache has not been loaded")
+        if _excel_path is not None and os.path.exists(_excel_path) and os.path.getmtime(_excel_path) != _mtime:
+            _reload()
+        return _df
+
+def locked():
+    """The cache lock, for code that must read the table and its own state without a write in between."""
+    return _lock
+
+def replay_reload(callback):
+    """Send one listener a reload event for the current table, to rebuild what it derives from it.
+
+    The lock is held, so no write falls between the table it is given and
+    the events that follow.
+    """
+    with _lock:
+        callback({"type": "reload", "version": _version, "table": with_cold(_df)})
+
+def get_version():
+    """Return a counter that changes every time the table changes."""
+    with _lock:
+        return _version
+
+def _so_row_ids(so_numbers):
+    """Row ids of the given S.O.# values, compared as value_index.cell_text ("12345" matches 12345.0)."""
+    df = get_table()
+    if "S.O.#" not in df.columns:
+        return {}
+    if value_index.is_indexed("S.O.#"):
+        return {cell_text(so_number): value_index.lookup("S.O.#", [so_number]) for so_number in so_numbers}
+    # No index (a table loaded without the value_index listener): one pass over the column
+    wanted = {cell_text(so_number) for so_number in so_numbers}
+    present = df["S.O.#"].map(cell_text)
+    found = {}
+    for row_id, key in present[present.isin(wanted)].items():
+        found.setdefault(key, set()).add(row_id)
+    return found
+
+def find_row_id(so_number):
+    """Return the row id for an S.O.#, or None if it does not exist."""
+    with _lock:
+        ids = _so_row_ids([so_number]).get(cell_text(so_number))
+    return min(ids) if ids else None
+
+def so_row_ids(so_numbers):
+    """Sorted row ids of every row with one of the given S.O.# values (compared as value_index.cell_text)."""
+    with _lock:
+        return sorted(set().union(*_so_row_ids(so_numbers).values()))
+
+def existing_keys(so_numbers):
+    """Return which of the given S.O.# values are already in the table (as value_index.cell_text)."""
+    with _lock:
+        return {key for key, ids in _so_row_ids(so_numbers).items() if ids and key is not None}
+
+def _coerce(column, value):
+    """Turn client input (always text) into the value stored in the table."""
+    if isinstance(value, str):
+        value = value.strip()
+        if value == "":
+            return None
+    if column in NUMERIC_COLUMNS and value is not None:
+        number = to_numbers(pd.Series([value])).iloc[0]
+        if pd.notna(number):
+            return int(number) if float(number).is_integer() else float(number)
+    return value
+
+def invalid_numbers(fields):
+    """Reasons a row's fields cannot be stored: text in a numeric column would make the
+    whole column text, breaking the rollups and number queries (same wording as importer.py)."""
+    reasons = []
+    for column, value in fields.items():
+        if column not in NUMERIC_COLUMNS or cell_text(value) is None:
+            continue  # Blank cells are allowed
+        if pd.isna(to_numbers(pd.Series([value])).iloc[0]):
+            reasons.append(f"{column} is not a number")
+    return reasons
+
+def _clean_row(row, columns):
+    """Keep only known columns, coerce their values and fill the missing ones with None."""
+    return {column: _coerce(column, row.get(column)) for column in columns}
+
+def _fits(series, value):
+    """True if value can be stored in series without changing its dtype."""
+    if series.dtype == object:
+        return True
+    if pd.api.types.is_string_dtype(series.dtype):
+        return value is None or isinstance(value, str)
+    kind = series.dtype.kind
+    if kind == "f":
+        return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+    if kind == "i":
+        return isinstance(value, int) and not isinstance(value, bool)
+    return False
+
+def insert_rows(rows):
+    """Append rows to the table and return the new row ids."""
+    global _df, _version, _next_id
+    with _lock:
+        df = get_table()
+        rows = [_clean_row(row, df.columns) for row in rows]
+        ids = list(range(_next_id, _next_id + len(rows)))
+        new_rows = pd.DataFrame(rows, index=ids, columns=df.columns)
+        for column in _spilled:
+            cold_store.put_many(column, ids, new_rows[column])
+            new_rows[column] = None
+        _df = pd.concat([df, new_rows]) if len(df) else new_rows
+        _next_id += len(rows)
+        _version += 1
+        _notify({"type": "insert", "version": _version, "ids": ids, "rows": rows})
+        _written()
+        return ids
+
+def append_rows(frame):
+    """Append already validated and typed rows in bulk (used by importer.py).
+
+    Unlike insert_rows this never saves the workbook; call save() once the
+    whole import is in. Listeners get one "insert" event for the whole frame,
+    marked "bulk", so they can update once per chunk.
+    """
+    global _df, _version, _next_id, _dirty
+    with _lock:
+        df = get_table()
+        frame = frame.reindex(columns=df.columns)
+        ids = list(range(_next_id, _next_id + len(frame)))
+        frame.index = ids
+        rows = frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+        for column in _spilled:
+            cold_store.put_many(column, ids, frame[column])
+            frame[column] = None
+        _df = pd.concat([df, frame]) if len(df) else frame
+        _next_id += len(frame)
+        _version += 1
+        _notify({"type": "insert", "version": _version, "ids": ids, "rows": rows, "bulk": True})
+        _dirty = True  # Saved by save() at the end of the import
+        return ids
+
+def save():
+    """Write the cached table to the workbook (after append_rows)."""
+    with _lock:
+        _save()
+
+def update_row(row_id, fields):
+    """Change some fields of one row and return the new row.
+
+    Fields whose value would not change (5 for 5.0, "" for an empty cell) are
+    skipped; if none is left nothing is written and no event is sent.
+    """
+    global _version
+    with _lock:
+        df = get_table()
+        before = get_row(row_id)
+        changed = []
+        for column, value in fields.items():
+            if column not in df.columns:
+                continue
+            value = _coerce(column, value)
+            if cell_text(value) == cell_text(before[column]):
+                continue
+            changed.append(column)
+            if column in _spilled:
+                cold_store.put_many(column, [row_id], [value])
+                continue
+            if not _fits(df[column], value):
+                if df[column].dtype.kind == "i" and isinstance(value, float):
+                    df[column] = df[column].astype(float)
+                else:
+                    # Mixed columns (e.g. text typed into a number column) need object dtype
+                    df[column] = df[column].astype(object)
+            df.at[row_id, column] = float("nan") if value is None and df[column].dtype.kind == "f" else value
+        if not changed:
+            return before
+        after = get_row(row_id)
+        _version += 1
+        _notify({"type": "update", "version": _version, "id": row_id, "before": before, "after": after,
+                 "changed": changed})
+        _written()
+        return after
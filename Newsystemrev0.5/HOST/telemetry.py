@@ -0,0 +1,131 @@
+# telemetry.py
+"""Timings reported by the USER tools (POST /telemetry) and their summary.
+
+Each shop PC's tools time what the user waits for - opening a window,
+every request to this host, filling a table, an export - and send the
+timings ("spans") here in batches. GET /telemetry/summary ranks them across
+all PCs, so "Add Data is slow" can be told apart into the request, the
+table fill or the window itself.
+
+A span is {"name": "USERADD.first_window", "seconds": 1.8, "at": <epoch>,
+"attrs": {...}}; the client id (X-Client-Id) says which PC sent it. Spans
+are kept in DB/telemetry.sqlite3 for retention_days.
+"""
+import json
+import math
+import sqlite3
+import threading
+import time
+
+MAX_SPANS_PER_POST = 1000  # A bigger batch is refused (the tools send every 30 seconds)
+MAX_NAME_LENGTH = 200
+MAX_ATTRS_LENGTH = 1000  # Characters of JSON; bigger attrs are dropped, the span is kept
+PRUNE_INTERVAL = 3600  # Seconds between deletions of expired spans
+MAX_SUMMARY_GROUPS = 200  # Most groups a summary returns (slowest total first)
+
+_lock = threading.Lock()
+_db = None
+_retention_seconds = None
+_pruned = 0.0
+_stats = {"received": 0, "rejected": 0}
+
+def open_store(db_path, retention_days=30):
+    """Open (and if needed create) the span table and drop expired spans."""
+    global _db, _retention_seconds
+    with _lock:
+        _db = sqlite3.connect(db_path, check_same_thread=False)
+        with _db:
+            _db.execute("""CREATE TABLE IF NOT EXISTS spans (
+                client TEXT NOT NULL, name TEXT NOT NULL, seconds REAL NOT NULL, at REAL NOT NULL, attrs TEXT)""")
+            _db.execute("CREATE INDEX IF NOT EXISTS spans_at ON spans (at)")
+            _db.execute("CREATE INDEX IF NOT EXISTS spans_name ON spans (name, seconds)")  # Percentiles of one name
+        _retention_seconds = retention_days * 86400
+    prune()
+
+def prune():
+    """Delete spans older than the retention period."""
+    global _pruned
+    with _lock, _db:
+        _db.execute("DELETE FROM spans WHERE at < ?", (time.time() - _retention_seconds,))
+        _pruned = time.monotonic()
+
+def _valid(span, now):
+    """(name, seconds, at, attrs JSON) for a well-formed span, else None."""
+    if not isinstance(span, dict):
+        return None
+    name, seconds, at = span.get("name"), span.get("seconds"), span.get("at", now)
+    if not isinstance(name, str) or not name or len(name) > MAX_NAME_LENGTH:
+        return None
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or not 0 <= seconds < 86400:
+        return None
+    if isinstance(at, bool) or not isinstance(at, (int, float)) or at > now + 86400:
+        at = now  # The PC's clock is off; when it arrived is close enough
+    attrs = span.get("attrs")
+    attrs = json.dumps(attrs, default=str) if isinstance(attrs, dict) and attrs else None
+    if attrs is not None and len(attrs) > MAX_ATTRS_LENGTH:
+        attrs = None
+    return name, float(seconds), float(at), attrs
+
+def record(client, spans):
+    """Store a batch of spans from one client. Returns (stored, rejected) counts.
+
+    Raises ValueError when spans is not a list or is over MAX_SPANS_PER_POST.
+    """
+    if not isinstance(spans, list):
+        raise ValueError("spans must be a list")
+    if len(spans) > MAX_SPANS_PER_POST:
+        raise ValueError(f"At most {MAX_SPANS_PER_POST} spans per request")
+    now = time.time()
+    rows = [(client, *valid) for valid in (_valid(span, now) for span in spans) if valid is not None]
+    with _lock, _db:
+        _db.executemany("INSERT INTO spans (client, name, seconds, at, attrs) VALUES (?, ?, ?, ?, ?)", rows)
+        _stats["received"] += len(rows)
+        _stats["rejected"] += len(spans) - len(rows)
+    if time.monotonic() - _pruned > PRUNE_INTERVAL:
+        prune()
+    return len(rows), len(spans) - len(rows)
+
+def _percentile(where, args, count, fraction):
+    """Nearest-rank percentile of the seconds of count spans matching where, read in SQLite."""
+    offset = max(0, math.ceil(fraction * count) - 1)
+    return _db.execute(f"SELECT seconds FROM spans WHERE {where} ORDER BY seconds LIMIT 1 OFFSET ?",
+                       (*args, offset)).fetchone()[0]
+
+def summary(since, name=None, client=None, by_client=False, limit=MAX_SUMMARY_GROUPS):
+    """Spans since an epoch time, grouped by name (and client with by_client), slowest total first.
+
+    Each group has count, total_seconds, p50, p95, max and the clients seen;
+    name filters to names starting with it ("USERADD." for one tool). since
+    is no earlier than the retention period, and at most limit groups are
+    returned. Counting and sorting happen in SQLite, not here.
+    """
+    since = max(since, time.time() - _retention_seconds)
+    where, args = ["at >= ?"], [since]
+    if name:
+        where.append("substr(name, 1, ?) = ?")
+        args += [len(name), name]
+    if client:
+        where.append("client = ?")
+        args.append(client)
+    where = " AND ".join(where)
+    group_by = "name, client" if by_client else "name"
+    result = []
+    with _lock:
+        groups = _db.execute(f"SELECT name, {'client' if by_client else 'NULL'}, COUNT(*), SUM(seconds), MAX(seconds), "
+                             f"COUNT(DISTINCT client) FROM spans WHERE {where} GROUP BY {group_by} "
+                             f"ORDER BY SUM(seconds) DESC LIMIT ?", (*args, limit)).fetchall()
+        for span_name, span_client, count, total, longest, clients in groups:
+            group_where = f"{where} AND name = ?" + (" AND client = ?" if by_client else "")
+            group_args = (*args, span_name, *((span_client,) if by_client else ()))
+            entry = {"name": span_name, "count": count, "total_seconds": round(total, 4),
+                     "p50": round(_percentile(group_where, group_args, count, 0.5), 4),
+                     "p95": round(_percentile(group_where, group_args, count, 0.95), 4),
+                     "max": round(longest, 4), "clients": clients}
+            if by_client:
+                entry["client"] = span_client
+            result.append(entry)
+    return result
+
+def stats():
+    with _lock:
+        return {**_stats, "stored": _db.execute("SELECT COUNT(*) FROM spans").fetchone()[0]}
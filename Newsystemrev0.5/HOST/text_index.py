@@ -0,0 +1,153 @@
+# text_index.py
+"""Full-text index over the free-text columns of the cached job table.
+
+NOTES and Description (schema.column_policy "text") are long, mostly unique
+text, so they get no refined vocabulary and no value index. Instead each
+cell is split into words and we keep token -> set of row ids per column.
+Words like part numbers are kept whole ("eln-00317-03", "3.000") and also as
+their parts ("eln", "00317", "03"), so either can be searched.
+
+A search matches rows containing every word of the query, each word as the
+start of a token: "mand 3.0" finds "MANDREL ASSEMBLY 3.000 X .065". Prefixes
+are found with a binary search over the sorted token list of the column.
+
+The index follows table_cache events like the value index does, and keeps
+its postings as compact: a token found on one row maps to the bare row id,
+and the sorted token lists count against the "suggestions" memory budget.
+"""
+import bisect
+import re
+import threading
+import memory
+from schema import column_policy
+from value_index import cell_text
+
+_lock = threading.Lock()
+_postings = {}  # column -> {token -> row id, or set of row ids when several rows have it}
+_tokens = {}    # column -> sorted tokens (cleared when the column gets a new token)
+
+_WORD = re.compile(r"[0-9a-z]+(?:[.\-/][0-9a-z]+)*")
+_PART = re.compile(r"[0-9a-z]+")
+
+def tokenize(value):
+    """The set of tokens a cell is indexed under (empty for an empty cell)."""
+    text = cell_text(value)
+    if text is None:
+        return set()
+    text = text.casefold()
+    return set(_WORD.findall(text)) | set(_PART.findall(text))
+
+def _changed(column):
+    if _tokens.pop(column, None) is not None:
+        memory.forget("text_index", column)
+
+def _add(column, value, row_id):
+    postings = _postings[column]
+    row_id = memory.row_id(row_id)
+    for token in tokenize(value):
+        ids = postings.get(token)
+        if ids is None:
+            postings[token] = row_id
+            _changed(column)
+        elif isinstance(ids, set):
+            ids.add(row_id)
+        elif ids != row_id:
+            postings[token] = {ids, row_id}
+
+def _discard(column, value, row_id):
+    postings = _postings[column]
+    for token in tokenize(value):
+        ids = postings.get(token)
+        if ids is None:
+            continue
+        if isinstance(ids, set):
+            ids.discard(row_id)
+            if len(ids) == 1:
+                postings[token] = next(iter(ids))
+        elif ids == row_id:
+            del postings[token]
+            _changed(column)
+
+def on_table_change(event):
+    """table_cache listener: keep the text index in step with writes."""
+    with _lock:
+        if event["type"] == "reload":
+            df = event["table"]
+            _postings.clear()
+            _tokens.clear()
+            memory.forget("text_index")
+            for column in df.columns:
+                if column_policy(column) == "text":
+                    _postings[column] = {}
+                    for row_id, value in df[column].dropna().items():
+                        _add(column, value, row_id)
+        elif event["type"] == "insert":
+            for column in _postings:
+                for row_id, row in zip(event["ids"], event["rows"]):
+                    _add(column, row.get(column), row_id)
+        elif event["type"] == "update":
+            for column in [column for column in event["changed"] if column in _postings]:
+                before, after = event["before"].get(column), event["after"].get(column)
+                if cell_text(before) != cell_text(after):
+                    _discard(column, before, event["id"])
+                    _add(column, after, event["id"])
+
+def indexed_columns():
+    return list(_postings)
+
+def _evicted(column, tokens):
+    """memory.py dropped a sorted token list to stay in budget (unless it has been rebuilt since)."""
+    with _lock:
+        if _tokens.get(column) is tokens:
+            del _tokens[column]
+
+def _prefix_ids(column, word, built):
+    """Row ids with a token in column starting with word; a token list sorted now is added to built."""
+    tokens = _tokens.get(column)
+    if tokens is None:
+        tokens = _tokens[column] = sorted(_postings[column])
+        built.append((column, tokens))
+    else:
+        memory.touch("text_index", column)
+    postings = _postings[column]
+    ids = set()
+    position = bisect.bisect_left(tokens, word)
+    while position < len(tokens) and tokens[position].startswith(word):
+        entry = postings[tokens[position]]
+        if isinstance(entry, set):
+            ids |= entry
+        else:
+            ids.add(entry)
+        position += 1
+    return ids
+
+def search(text, columns=None):
+    """Return the set of row ids whose columns (default: all indexed) contain every word of text.
+
+    Raises ValueError if text has no searchable words.
+    """
+    words = _PART.findall(str(text).casefold())
+    if not words:
+        raise ValueError("Search text needs at least one letter or digit")
+    built = []
+    with _lock:
+        columns = [column for column in (columns or _postings) if column in _postings]
+        matches = None
+        for word in sorted(set(words), key=len, reverse=True):  # Longest (most selective) words first
+            ids = set()
+            for column in columns:
+                ids |= _prefix_ids(column, word, built)
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                break
+    # Accounted once _lock is released: an eviction takes _lock (see memory.remember)
+    for column, tokens in built:
+        memory.remember("text_index", column, memory.sorted_list_bytes(tokens),
+                        lambda column=column, tokens=tokens: _evicted(column, tokens))
+    return matches or set()
+
+def memory_usage():
+    """Estimated bytes held by the postings (the sorted token lists and row ids are counted by memory.py)."""
+    with _lock:
+        return {"bytes": sum(memory.postings_bytes(postings) for postings in _postings.values()),
+                "columns": len(_postings), "tokens": sum(len(postings) for postings in _postings.values())}
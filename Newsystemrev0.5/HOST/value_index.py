@@ -0,0 +1,188 @@
+# value_index.py
+"""Exact-value indexes over the cached job table.
+
+For every indexed column we keep value -> set of row ids. That answers
+"Customer equals X" / "Status in (A, B)" without a scan, and the sorted key
+list doubles as the column's distinct values for the ShowData filter window
+and answers prefix searches (the USEREDIT S.O.# picker).
+Free-text columns are not indexed here; text_index.py tokenizes them for search.
+
+The indexes follow table_cache events: a reload rebuilds them, inserts and
+updates touch only the affected values. Distinct lists are sorted lazily and
+cached until the column changes, within the "suggestions" memory budget
+(memory.py): the least recently used ones are dropped and sorted again when
+next asked for.
+
+Most values of a key-like column (S.O.#, Dwg., P.O.#) occur on one row, so a
+value on one row maps to the bare row id and only values on several rows get
+a set; all indexes share one int object per row id (memory.row_id).
+"""
+import bisect
+import threading
+import pandas as pd
+import memory
+from schema import column_policy
+
+_lock = threading.Lock()
+_indexes = {}    # column -> {value text -> row id, or set of row ids when several rows have it}
+_distincts = {}  # column -> sorted list of values (cleared when the column changes)
+_folded = {}     # column -> sorted (casefolded value, value) pairs for prefix search (cleared likewise)
+
+def cell_text(value):
+    """The text an index stores for a cell; empty cells are not indexed."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # 5.0 read from the workbook and 5 typed by a user are the same value
+    text = str(value).strip()
+    return text or None
+
+def _ids(entry):
+    """The row ids of an index entry as a set (empty for None)."""
+    if entry is None:
+        return set()
+    return entry if isinstance(entry, set) else {entry}
+
+def _changed(column):
+    """The column got a new value or lost one: its sorted lists are out of date."""
+    if _distincts.pop(column, None) is not None:
+        memory.forget("value_index", ("distinct", column))
+    if _folded.pop(column, None) is not None:
+        memory.forget("value_index", ("prefix", column))
+
+def _add(column, value, row_id):
+    text = cell_text(value)
+    if text is not None:
+        row_id = memory.row_id(row_id)
+        index = _indexes[column]
+        ids = index.get(text)
+        if ids is None:
+            index[text] = row_id
+            _changed(column)
+        elif isinstance(ids, set):
+            ids.add(row_id)
+        elif ids != row_id:
+            index[text] = {ids, row_id}
+
+def _discard(column, value, row_id):
+    text = cell_text(value)
+    index = _indexes[column]
+    ids = index.get(text)
+    if ids is None:
+        return
+    if isinstance(ids, set):
+        ids.discard(row_id)
+        if len(ids) == 1:
+            index[text] = next(iter(ids))
+    elif ids == row_id:
+        del index[text]
+        _changed(column)
+
+def _build(series):
+    """Vectorized equivalent of calling _add for every cell of series."""
+    values = series[series.notna()]
+    texts = values.astype(str)
+    if values.dtype.kind == "f":
+        whole = values == values.round()
+        texts[whole] = values[whole].astype("int64").astype(str)
+    texts = texts.str.strip()
+    texts = texts[texts != ""]
+    row_ids = [memory.row_id(row_id) for row_id in texts.index.tolist()]
+    index = {}
+    for text, positions in texts.groupby(texts).indices.items():
+        index[text] = row_ids[positions[0]] if len(positions) == 1 else {row_ids[position] for position in positions}
+    return index
+
+def on_table_change(event):
+    """table_cache listener: keep the value indexes in step with writes."""
+    with _lock:
+        if event["type"] == "reload":
+            df = event["table"]
+            _indexes.clear()
+            _distincts.clear()
+            _folded.clear()
+            memory.forget("value_index")
+            for column in df.columns:
+                if column_policy(column) != "text":
+                    _indexes[column] = _build(df[column])
+        elif event["type"] == "insert":
+            for column in _indexes:
+                for row_id, row in zip(event["ids"], event["rows"]):
+                    _add(column, row.get(column), row_id)
+        elif event["type"] == "update":
+            for column in [column for column in event["changed"] if column in _indexes]:
+                before, after = event["before"].get(column), event["after"].get(column)
+                if cell_text(before) != cell_text(after):
+                    _discard(column, before, event["id"])
+                    _add(column, after, event["id"])
+
+def is_indexed(column):
+    return column in _indexes
+
+def lookup(column, values):
+    """Return the set of row ids whose column equals any of values."""
+    with _lock:
+        index = _indexes[column]
+        ids = set()
+        for value in values:
+            ids |= _ids(index.get(cell_text(value)))
+        return ids
+
+def count(column, values):
+    """How many rows lookup(column, values) would return, without building the set."""
+    with _lock:
+        index = _indexes[column]
+        return sum(len(_ids(index.get(cell_text(value)))) for value in values)
+
+def _evicted(cache, column, values):
+    """memory.py dropped a sorted list to stay in budget (unless it has been rebuilt since)."""
+    with _lock:
+        if cache.get(column) is values:
+            del cache[column]
+
+def distinct(column):
+    """Sorted distinct values of an indexed column (cached until it changes)."""
+    with _lock:
+        values = _distincts.get(column)
+        if values is not None:
+            memory.touch("value_index", ("distinct", column))
+            return values
+        values = _distincts[column] = sorted(_indexes[column], key=str.lower)
+    # Accounted once _lock is released: an eviction takes _lock (see memory.remember)
+    memory.remember("value_index", ("distinct", column), memory.sorted_list_bytes(values),
+                    lambda: _evicted(_distincts, column, values))
+    return values
+
+def prefix(column, text, limit=50):
+    """Values of an indexed column starting with text (case ignored), sorted; at most limit of them.
+
+    Returns (values, more), more being True if there were further matches.
+    """
+    text = str(text).strip().casefold()
+    with _lock:
+        folded = _folded.get(column)
+        built = folded is None
+        if built:
+            # Values casefold leaves alone (most are digits) are kept once, not twice
+            folded = _folded[column] = sorted((value.casefold() if value.casefold() != value else value, value)
+                                              for value in _indexes[column])
+        else:
+            memory.touch("value_index", ("prefix", column))
+    if built:  # Accounted once _lock is released: an eviction takes _lock (see memory.remember)
+        memory.remember("value_index", ("prefix", column), memory.sorted_list_bytes(folded),
+                        lambda: _evicted(_folded, column, folded))
+    # folded is never changed in place (a write replaces it), so it is read without the lock
+    values = []
+    position = bisect.bisect_left(folded, (text,))
+    while position < len(folded) and folded[position][0].startswith(text):
+        if len(values) == limit:
+            return values, True
+        values.append(folded[position][1])
+        position += 1
+    return values, False
+
+def memory_usage():
+    """Estimated bytes held by the indexes (the sorted lists and row ids are counted by memory.py)."""
+    with _lock:
+        return {"bytes": sum(memory.postings_bytes(index) for index in _indexes.values()),
+                "columns": len(_indexes), "values": sum(len(index) for index in _indexes.values())}
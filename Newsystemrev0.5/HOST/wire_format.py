@@ -0,0 +1,73 @@
+# wire_format.py
+"""Compact formats for sending many rows at once (/get_data, /query).
+
+JSON records repeat all 25 column names in every row and are slow to
+build and to parse. A client that lists one of these formats in its Accept
+header gets the rows as one table instead:
+
+  application/vnd.apache.arrow.stream  Arrow IPC stream; columnar and typed,
+                                       read straight into a DataFrame. Only
+                                       offered when pyarrow is installed.
+  application/vnd.table.split+json     {"columns": [...], "data": [[...], ...]}:
+                                       the column names once, then one list
+                                       per row (pandas orient="split").
+
+Anything else, or no Accept header, gets the JSON records as before, so
+older clients are unaffected. Extra values (totals, paging) travel in
+headers when the body is a table.
+"""
+import json
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:  # Optional: without it only the JSON formats are offered
+    pyarrow = None
+
+ARROW = "application/vnd.apache.arrow.stream"
+SPLIT_JSON = "application/vnd.table.split+json"
+RECORDS_JSON = "application/json"
+
+def supported():
+    """Table formats this host can send, best first."""
+    return ([ARROW] if pyarrow is not None else []) + [SPLIT_JSON]
+
+def negotiate(accept):
+    """Pick the table format for an Accept header; RECORDS_JSON when the client asks for none of them."""
+    offers = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *parameters = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type in supported() and quality > 0:
+            offers.append((-quality, position, media_type))
+    return min(offers)[2] if offers else RECORDS_JSON
+
+def _arrow_ready(df):
+    """Arrow needs one type per column: object columns (mixed text and numbers) are sent as text."""
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].map(lambda value: None if pd.isna(value) else str(value))
+    return df
+
+def encode(df, media_type):
+    """Serialize a frame in a table format; returns the body bytes."""
+    if media_type == ARROW:
+        table = pyarrow.Table.from_pandas(_arrow_ready(df), preserve_index=False)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    if media_type == SPLIT_JSON:
+        return df.to_json(orient="split", index=False, date_format="iso", double_precision=15).encode("utf-8")
+    raise ValueError(f"Unsupported table format {media_type}")
+
+def header_value(value):
+    """A value for an extra header (JSON for anything but a string)."""
+    return value if isinstance(value, str) else json.dumps(value)
@@ -1,97 +1,185 @@
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
-import pandas as pd
 import requests
-import os
+from change_feed import start_change_feed
+import client_cache
+import client_context
+import telemetry
 
 # Define the Flask server endpoints
-SERVER_URL = "http://127.0.0.1:5000"
-GET_DATA_URL = f"{SERVER_URL}/get_data"
-LIST_HEADERS_URL = f"{SERVER_URL}/list_headers"
-REFINED_DIR = os.path.join("DB", "refined")  # Directory for refined .txt files
-
-# Sanitize header names by replacing spaces, slashes, and dots with underscores
-def sanitize_header_name(header):
-    return header.replace(" ", "_").replace("/", "_").replace(".", "_")
-
-# Ensure .txt files for headers exist
-def ensure_refined_files(headers):
-    if not os.path.exists(REFINED_DIR):
-        os.makedirs(REFINED_DIR)  # Create the refined directory if it doesn't exist
-    for header in headers:
-        sanitized_header = sanitize_header_name(header)
-        file_path = os.path.join(REFINED_DIR, f"{sanitized_header}.txt")
-
-        # Only create new files and print a message if the file does not exist
-        if not os.path.exists(file_path):
-            with open(file_path, "w") as file:
-                file.write("")  # Create an empty file
-            print(f"Creating new file: {file_path}")  # Print only when creating a new file
-
-# Load data from the Flask server
-def load_data():
+SERVER_URL = client_context.FLASK_SERVER
+QUERY_URL = f"{SERVER_URL}/query"
+DISTINCT_URL = f"{SERVER_URL}/distinct"
+PAGE_SIZE = 500  # Rows shown per page
+
+# Text of a cell as shown in the table (blank for missing values)
+def cell_text(value):
+    return "" if value is None or value != value else str(value)  # value != value is NaN
+
+# Does a cached row pass one filter of a query
+def row_matches(row, item):
+    texts = [cell_text(value) for value in row.values()] if item["column"] == "*" \
+        else [cell_text(row.get(item["column"]))]
+    if item["op"] == "contains":
+        needle = str(item["value"]).lower()
+        return any(needle in text.lower() for text in texts)
+    if item["op"] in ("equals", "in"):
+        values = {str(value) for value in item["value"]} if item["op"] == "in" else {str(item["value"])}
+        return all(text in values for text in texts)
+    return True  # "range" needs the host's date/number parsing
+
+# Run a query against the rows in the local cache (used while the server is unreachable)
+def query_cached_rows(filters, sort, page=1, page_size=PAGE_SIZE):
+    """Same result shape as query_data, evaluated locally; "range" filters are not applied."""
+    rows = [row for row in client_cache.get_rows() if all(row_matches(row, item) for item in filters)]
+    for key in reversed(sort):
+        rows.sort(key=lambda row: cell_text(row.get(key["column"])), reverse=key["descending"])
+    start = (page - 1) * page_size
+    return rows[start:start + page_size], len(rows)
+
+# Fetch one page of rows from the server, filtered and sorted there
+def query_data(filters, sort, page=1, page_size=PAGE_SIZE):
+    """Return (rows of the page as dicts, total matching rows, change-feed sequence)."""
     try:
-        response = requests.get(GET_DATA_URL)
+        response = client_context.session().post(QUERY_URL, json={
+            "filters": filters, "sort": sort, "page": page, "page_size": page_size
+        })
         if response.status_code == 200:
-            data = response.json()
-            df = pd.DataFrame(data)
-            return df
+            result = response.json()
+            return result["rows"], result["total"], response.headers.get("X-Change-Seq", 0)
         else:
             messagebox.showerror("Error", f"Failed to fetch data: {response.json().get('message')}")
-            return pd.DataFrame()
+            return [], 0, 0
+    except requests.exceptions.ConnectionError:
+        # Offline: show the rows cached by the last download (no live updates until reconnect)
+        rows, total = query_cached_rows(filters, sort, page, page_size)
+        return rows, total, client_cache.get_seq("rows") or 0
     except requests.exceptions.RequestException as e:
         messagebox.showerror("Error", f"Could not connect to the server: {e}")
-        return pd.DataFrame()
+        return [], 0, 0
 
-# Get headers from the Flask server
-def get_headers():
+# Get the distinct values of every column from the server (for the filter dropdowns)
+def get_distinct_values():
     try:
-        response = requests.get(LIST_HEADERS_URL)
+        response = client_context.session().get(DISTINCT_URL)
         if response.status_code == 200:
-            return response.json().get("headers", [])
+            return response.json().get("values", {})
         else:
-            messagebox.showerror("Error", f"Failed to fetch headers: {response.json().get('message')}")
-            return []
+            messagebox.showerror("Error", f"Failed to fetch filter values: {response.json().get('message')}")
+            return {}
     except requests.exceptions.RequestException as e:
         messagebox.showerror("Error", f"Could not connect to the server: {e}")
-        return []
+        return {}
 
-# Populate Treeview with DataFrame data
-def populate_treeview(tree, df):
+# Get headers from the Flask server
+def get_headers():
+    headers = client_context.get_headers()  # Shared with the other tools; cached copy when offline
+    if not headers:
+        messagebox.showerror("Error", "Could not fetch headers from the server.")
+    return headers
+
+# Populate Treeview with rows (dicts keyed by header)
+def populate_treeview(tree, rows, headers, on_heading_click=None):
     # Clear any existing data
     tree.delete(*tree.get_children())
     
     # Set columns and auto-size based on content
-    tree["columns"] = list(df.columns)
+    tree["columns"] = list(headers)
     tree["show"] = "headings"  # Hide row indices
     
     # Configure columns with fixed width and stretching
-    for column in df.columns:
-        tree.heading(column, text=column)
+    for column in headers:
+        if on_heading_click:
+            tree.heading(column, text=column, command=lambda c=column: on_heading_click(c))
+        else:
+            tree.heading(column, text=column)
         tree.column(column, anchor="center", width=150)  # Fixed width
 
-    # Add rows to the treeview
-    for _, row in df.iterrows():
-        tree.insert("", "end", values=list(row))
+    # Add rows to the treeview (columns in header order, blanks for missing values)
+    with telemetry.span("ShowData.populate_table", rows=len(rows)):
+        for row in rows:
+            tree.insert("", "end", values=[cell_text(row.get(header)) for header in headers])
 
-# Filter DataFrame based on search query and column filters
-def filter_data(tree, df, search_query, column_filters):
-    filtered_df = df
-
-    # Apply search query filter if any
+# Build the server-side filter list from the search box and column filters
+def build_filters(search_query, column_filters, distinct_values):
+    filters = []
     if search_query:
-        filtered_df = filtered_df[filtered_df.apply(
-            lambda row: row.astype(str).str.contains(search_query, case=False).any(), axis=1)]
-
-    # Apply column filters on top of the search filter
+        filters.append({"column": "*", "op": "contains", "value": search_query})
     for column, value in column_filters.items():
         if value:
-            filtered_df = filtered_df[filtered_df[column].astype(str).str.contains(value, case=False, na=False)]
-    
-    populate_treeview(tree, filtered_df)
+            # A value picked from the dropdown is an exact match; typed text is a substring search
+            op = "equals" if value in distinct_values.get(column, []) else "contains"
+            filters.append({"column": column, "op": op, "value": value})
+    return filters
+
+# Re-run the query for the current search, filters, sort and page and show the result
+def refresh_view(view):
+    rows, total, seq = query_data(view["filters"], view["sort"], view["page"])
+    populate_treeview(view["tree"], rows, view["headers"], lambda column: sort_by_column(view, column))
+    view["total"] = total
+    view["seq"] = seq
+    update_status(view)
+
+# Show which rows of the result are on screen
+def update_status(view):
+    total = view["total"]
+    first = (view["page"] - 1) * PAGE_SIZE + 1 if total else 0
+    last = min(view["page"] * PAGE_SIZE, total)
+    view["status_var"].set(f"Rows {first}-{last} of {total}")
+
+# Apply a change pushed by the host to the rows on screen
+def apply_change(view, event):
+    tree = view["tree"]
+    headers = view["headers"]
+    row = event.get("row", {})
+    values = [cell_text(row.get(header)) for header in headers]
+
+    so_index = headers.index("S.O.#") if "S.O.#" in headers else None
+    shown = [item for item in tree.get_children()
+             if so_index is not None and str(tree.item(item, "values")[so_index]) == str(event.get("so"))]
+
+    if event["type"] == "update":
+        for item in shown:
+            tree.item(item, values=values)
+    elif event["type"] == "insert" and not shown:
+        view["total"] += 1
+        # Unfiltered, unsorted results are in insertion order, so a new row goes at the end
+        if not view["filters"] and not view["sort"] and len(tree.get_children()) < PAGE_SIZE \
+                and view["page"] * PAGE_SIZE >= view["total"]:
+            tree.insert("", "end", values=values)
+        update_status(view)
+
+# Reload the current page when the host can no longer replay missed changes
+def resync_view(view):
+    refresh_view(view)
+    view["feed"]["resume"](view["seq"])
+
+# Filter on the server based on search query and column filters
+def filter_data(view, search_query, column_filters):
+    view["column_filters"] = dict(column_filters)
+    view["filters"] = build_filters(search_query, column_filters, view["distinct_values"])
+    view["page"] = 1
+    refresh_view(view)
+
+# Sort by a column on the server; clicking the same heading again reverses the order
+def sort_by_column(view, column):
+    current = view["sort"][0] if view["sort"] else None
+    descending = bool(current and current["column"] == column and not current["descending"])
+    view["sort"] = [{"column": column, "descending": descending}]
+    view["page"] = 1
+    refresh_view(view)
+
+# Move to the previous/next page of results
+def change_page(view, step):
+    last_page = max((view["total"] - 1) // PAGE_SIZE + 1, 1)
+    page = min(max(view["page"] + step, 1), last_page)
+    if page != view["page"]:
+        view["page"] = page
+        refresh_view(view)
 
 # Open column filter window with dropdowns
-def open_column_filter_window(root, tree, df, filters, search_var):
+def open_column_filter_window(root, view, search_var):
     def apply_filters():
         # Get the current search query
         search_query = search_var.get()
@@ -99,61 +187,70 @@ def open_column_filter_window(root, tree, df, filters, search_var):
         # Update column filters with user inputs
         column_filters = {col: var.get() for col, var in column_vars.items()}
 
-        # Combine existing filters with the new ones
-        current_filters = filters.copy()  # Copy the existing filters
-        current_filters.update(column_filters)  # Update with the new column filters
-        
-        # Apply the combined filters
-        filter_data(tree, df, search_query, current_filters)
+        # Apply the combined filters on the server
+        filter_data(view, search_query, column_filters)
         filter_window.destroy()
 
+    # Distinct values come from the server's cached per-column lists
+    if not view["distinct_values"]:
+        view["distinct_values"] = get_distinct_values()
+
     filter_window = tk.Toplevel(root)
     filter_window.title("Filter by Column")
 
     column_vars = {}
-    for idx, column in enumerate(df.columns):
+    for idx, column in enumerate(view["headers"]):
         # Create label and dropdown for each column
         label = tk.Label(filter_window, text=column)
         label.grid(row=idx, column=0, padx=5, pady=5, sticky="w")
         
-        var = tk.StringVar(value="")  # Set the default value to an empty string
+        var = tk.StringVar(value=view["column_filters"].get(column, ""))  # Keep the current filter
         column_vars[column] = var
         
-        # Create a dropdown box for each column with unique values from the column
-        unique_values = df[column].dropna().unique().tolist()
+        # Create a dropdown box for each column with its distinct values
+        unique_values = view["distinct_values"].get(column, [])
         dropdown = ttk.Combobox(filter_window, textvariable=var, values=[""] + unique_values, width=30)  # Add an empty string to the values
         dropdown.grid(row=idx, column=1, padx=5, pady=5)
 
     # Apply button
     apply_button = tk.Button(filter_window, text="Apply Filters", command=apply_filters)
-    apply_button.grid(row=len(df.columns), column=0, columnspan=2, pady=10)
+    apply_button.grid(row=len(view["headers"]), column=0, columnspan=2, pady=10)
 
 # Clear all filters and reset the treeview
-def clear_filters(tree, df, search_var, filters):
+def clear_filters(view, search_var):
     # Clear search entry and column filters
     search_var.set("")
-    for var in filters.values():
-        var.set("")  # Reset all column filters
-    
-    # Reset the DataFrame and reload the original data
-    populate_treeview(tree, df)
+    view["column_filters"] = {}
+    view["filters"] = []
+    view["sort"] = []
+    view["page"] = 1
+
+    # Reload the first page of unfiltered data
+    refresh_view(view)
 
-# Main GUI
-def main():
-    root = tk.Tk()
+# Main GUI; opened as a Toplevel of master when run from the main menu
+def main(master=None):
+    started = time.perf_counter()
+    root = tk.Toplevel(master) if master else tk.Tk()
     root.title("Excel Data Viewer")
     root.geometry("1200x800")  # Set initial window size
 
-    # Load data and headers from the Flask server
+    # Load headers from the Flask server; rows are fetched a page at a time
     headers = get_headers()
-    df = load_data()
+    client_context.start_rows_refresh()  # Keep the offline copy of the rows current
 
-    if not df.empty:
-        # Ensure .txt files for headers exist
-        ensure_refined_files(headers)
-
-        # Initialize filters dictionary to store the column filters
-        filters = {}
+    if headers:
+        # Current search/filter/sort/page state of the viewer
+        view = {
+            "headers": headers,
+            "filters": [],
+            "column_filters": {},
+            "distinct_values": {},
+            "sort": [],
+            "page": 1,
+            "total": 0,
+            "status_var": tk.StringVar(),
+        }
 
         # Create a Frame for the search bar and Treeview
         frame = tk.Frame(root)
@@ -165,9 +262,14 @@ def main():
         tk.Label(search_frame, text="Search:").pack(side="left", padx=5)
         search_var = tk.StringVar()
         tk.Entry(search_frame, textvariable=search_var, width=30).pack(side="left", padx=5)
-        tk.Button(search_frame, text="Search", command=lambda: filter_data(tree, df, search_var.get(), filters)).pack(side="left", padx=5)
-        tk.Button(search_frame, text="Filter by Column", command=lambda: open_column_filter_window(root, tree, df, filters, search_var)).pack(side="left", padx=5)
-        tk.Button(search_frame, text="Clear Filters", command=lambda: clear_filters(tree, df, search_var, filters)).pack(side="left", padx=5)
+        tk.Button(search_frame, text="Search", command=lambda: filter_data(view, search_var.get(), view["column_filters"])).pack(side="left", padx=5)
+        tk.Button(search_frame, text="Filter by Column", command=lambda: open_column_filter_window(root, view, search_var)).pack(side="left", padx=5)
+        tk.Button(search_frame, text="Clear Filters", command=lambda: clear_filters(view, search_var)).pack(side="left", padx=5)
+
+        # Paging controls
+        tk.Button(search_frame, text="Next >", command=lambda: change_page(view, 1)).pack(side="right", padx=5)
+        tk.Button(search_frame, text="< Prev", command=lambda: change_page(view, -1)).pack(side="right", padx=5)
+        tk.Label(search_frame, textvariable=view["status_var"]).pack(side="right", padx=5)
 
         # Treeview Frame
         tree_frame = tk.Frame(frame)
@@ -186,10 +288,20 @@ def main():
         # Configure treeview to work with scrollbars
         tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
 
-        # Populate Treeview with initial data
-        populate_treeview(tree, df)
+        # Populate Treeview with the first page of data
+        view["tree"] = tree
+        refresh_view(view)
+
+        # Apply new and edited rows live instead of re-querying
+        view["feed"] = start_change_feed(root, SERVER_URL, view["seq"],
+                                         lambda event: apply_change(view, event),
+                                         lambda: resync_view(view))
+        telemetry.window_shown(root, "ShowData.first_window", started)  # Includes the first page of rows
 
-        root.mainloop()
+        if master is None:
+            root.mainloop()
+    else:
+        root.destroy()
 
 if __name__ == "__main__":
     main()
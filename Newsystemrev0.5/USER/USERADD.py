@@ -1,178 +1,119 @@
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-import requests
-import os
-import json
-from tkcalendar import Calendar
-
-# Define paths
-base_dir = os.path.dirname(os.path.abspath(__file__))  # Get the program's directory
-state_file_path = os.path.join(base_dir, "DB", "settings", "combobox_states2.json")  # JSON file to save field states
-visual_settings_file = os.path.join(base_dir, "visual_settings.json")  # Visual settings file
-refined_dir = os.path.join(base_dir, "Db", "refined")  # Directory for refined .txt files
+from change_feed import start_change_feed
+import client_cache
+import client_context
+import telemetry
 
 # Flask server endpoint
-FLASK_SERVER = "http://localhost:5000"
-
-def ensure_file_refined():
-    # Step 1: Send the request to the Flask server
-    url = 'http://localhost:5000/list_refined'  # Replace with your Flask server URL
-    response = requests.get(url)
-
-    # Check if the response is valid
-    if response.status_code == 200:
-        data = response.json()
-        
-        # Step 2: Parse the JSON data
-        files_data = data.get("files", {})
-        
-        # Get the directory where the script is located
-        script_dir = os.path.dirname(os.path.realpath(__file__))
-        
-        # Path to the DB/Refined directory in the same folder as the script
-        base_directory = os.path.join(script_dir, "DB", "Refined")
-        
-        # Step 3: Check if the files exist and create them if they don't
-        for file_name, file_data in files_data.items():
-            file_path = os.path.join(base_directory, file_name)
-            
-            # If the file doesn't exist, create it and write the data inside
-            if not os.path.exists(file_path):
-                # Create the directory if it doesn't exist
-                os.makedirs(base_directory, exist_ok=True)
-                
-                # Write each item in file_data on a new line
-                with open(file_path, 'w') as file:
-                    for item in file_data:
-                        file.write(f"{item}\n")  # Write each item on a new line
-                print(f"Created file: {file_name} with data: {file_data}")
-            else:
-                print(f"File {file_name} already exists, skipping.")
-    else:
-        print("Failed to retrieve data from Flask server.")
-
-# Call the function to ensure the files are created
-ensure_file_refined()
-
-# Ensure the directory and the state file exists
-def ensure_directory_exists():
-    directory = os.path.dirname(state_file_path)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    if not os.path.exists(state_file_path):
-        with open(state_file_path, 'w') as file:
-            json.dump({}, file)
+FLASK_SERVER = client_context.FLASK_SERVER
+refined_seq = 0  # Change-feed sequence of the last refined download
+suggestion_sets = {}  # Header -> set of its known suggestions (client_context.vocabulary_key), loaded once per window
+
+# Columns that usually differ between the lines of one purchase order (multi-row entry)
+LINE_COLUMNS = ["S.O.#", "Dwg.", "Tooling type", "Quantity", "Cost Each", "Total $'s", "Description"]
+MULTI_ROW_START_LINES = 10  # Empty lines shown when the multi-row window opens
 
 # Load visual settings
 def load_visual_settings():
-    default_settings = {
-        "font_family": "Arial",
-        "font_size": 12,
-        "bg_color": "#ffffff",
-        "fg_color": "#000000",
-        "button_bg_color": "#f0f0f0",
-        "button_fg_color": "#000000"
-    }
     try:
-        if os.path.exists(visual_settings_file):
-            with open(visual_settings_file, "r") as file:
-                settings = json.load(file)
-                for key, value in default_settings.items():
-                    settings.setdefault(key, value)
-                return settings
+        return client_context.visual_settings()
     except Exception as e:
         messagebox.showerror("Error", f"Failed to load visual settings: {e}")
-    return default_settings
+    return dict(client_context.DEFAULT_VISUAL_SETTINGS)
 
 # Load saved field states
 def load_field_states():
-    ensure_directory_exists()  # Ensure the directory and file exist before loading
-    with open(state_file_path, 'r') as file:
-        return json.load(file)
+    return client_cache.get_setting("useradd_field_states", {})
 
-# Save field states to file
+# Save field states to the local cache
 def save_field_states(states):
-    ensure_directory_exists()  # Ensure the directory and file exist before saving
-    with open(state_file_path, 'w') as file:
-        json.dump(states, file)
+    client_cache.set_setting("useradd_field_states", states)
 
-# Sanitize header names by replacing spaces, slashes, and dots with underscores
-def sanitize_header_name(header):
-    return header.replace(" ", "_").replace("/", "_").replace(".", "_")
+# Download refined files from the server into the local cache
+def download_refined_files(refresh=False):
+    """Make sure the refined values are cached; they are downloaded once per process unless refresh is set."""
+    global refined_seq
+    refined_seq = client_context.refresh_refined() if refresh else client_context.refined_seq()
 
-# Download refined files from the server
-def download_refined_files():
-    """Download refined files from the Flask server."""
-    try:
-        response = requests.get(f"{FLASK_SERVER}/list_refined")
-        if response.status_code == 200:
-            refined_files = response.json().get("files", {})
-            if not os.path.exists(refined_dir):
-                os.makedirs(refined_dir)  # Ensure the directory exists
-
-            # Download and save each refined file
-            for file_name, content in refined_files.items():
-                file_path = os.path.join(refined_dir, file_name)
-                with open(file_path, "w") as file:
-                    file.write("\n".join(content))
-                print(f"Downloaded refined file: {file_path}")
-        else:
-            messagebox.showerror("Error", f"Failed to fetch refined files: {response.json().get('message')}")
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not connect to server: {e}")
-
-# Load suggestions for a header
+# Load suggestions for a header (and remember them for membership checks)
 def load_suggestions(header):
-    sanitized_header = sanitize_header_name(header)
-    file_path = os.path.join(refined_dir, f"{sanitized_header}.txt")
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            return [line.strip() for line in file if line.strip()]
-    return []
-
-# Save a new entry to the .txt file if it doesn't already exist
-def save_suggestion(header, value):
-    sanitized_header = sanitize_header_name(header)
-    file_path = os.path.join(refined_dir, f"{sanitized_header}.txt")
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            lines = [line.strip() for line in file if line.strip()]
-        if value not in lines:
-            with open(file_path, "a") as file:
-                file.write(f"{value}\n")
-
-# Fetch headers from the Flask server
+    suggestions = client_cache.get_refined(client_context.refined_file_name(header))  # Most used first
+    suggestion_sets[header] = set(map(client_context.vocabulary_key, suggestions))
+    return suggestions
+
+# Add values to the in-memory suggestions; returns {header: [values not seen before]}
+def add_suggestions(values_by_header):
+    added = {}
+    for header, values in values_by_header.items():
+        known = suggestion_sets.setdefault(header, set())
+        for value in values:
+            if value and client_context.vocabulary_key(value) not in known:
+                known.add(client_context.vocabulary_key(value))
+                added.setdefault(header, []).append(value)
+    return added
+
+# Save the new values of one or more entries to the cached suggestions in one write.
+# The host adds them to its refined files itself when it gets the entries.
+def save_suggestions(entries):
+    values_by_header = {}
+    for entry_data in entries:
+        for header, value in entry_data.items():
+            values_by_header.setdefault(header, []).append(value)
+    added = add_suggestions(values_by_header)
+    if added:
+        client_cache.add_refined_files({client_context.refined_file_name(header): values for header, values in added.items()})
+    return added
+
+# Fetch headers from the Flask server (shared with the other tools)
 def fetch_headers_from_server():
+    headers = client_context.get_headers()
+    if not headers:
+        messagebox.showerror("Error", "Could not fetch headers from the server.")
+    return headers
+
+# Submit a new entry to the Flask server.
+# Returns True when it was added or queued to be sent later.
+def submit_new_entry(entry_data):
     try:
-        response = requests.get(f"{FLASK_SERVER}/get_data")
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                return list(data[0].keys())  # Get headers from the first row of data
+        response = client_cache.send_or_queue(FLASK_SERVER, "POST", "/submit_data", entry_data)
+        if response is None:
+            messagebox.showinfo("Saved Offline", "The server is unreachable or busy. The entry was saved and will be sent automatically.")
+            return True
+        elif response.status_code == 200:
+            messagebox.showinfo("Success", "New entry submitted successfully.")
+            return True
         else:
-            messagebox.showerror("Error", f"Failed to fetch headers: {response.json().get('message')}")
-            return []
+            messagebox.showerror("Error", f"Failed to submit data: {response.json().get('message')}")
     except Exception as e:
         messagebox.showerror("Error", f"Could not connect to server: {e}")
-        return []
+    return False
 
-# Submit a new entry to the Flask server
-def submit_new_entry(entry_data):
+# Submit several entries in one request (one workbook write on the host).
+# Returns True when they were added or queued to be sent later.
+def submit_new_entries(entries):
     try:
-        response = requests.post(f"{FLASK_SERVER}/submit_data", json=entry_data)
-        if response.status_code == 200:
-            messagebox.showinfo("Success", "New entry submitted successfully.")
+        response = client_cache.send_or_queue(FLASK_SERVER, "POST", "/submit_data/batch", {"rows": entries})
+        if response is None:
+            messagebox.showinfo("Saved Offline", f"The server is unreachable or busy. {len(entries)} entries were saved and will be sent automatically.")
+            return True
+        elif response.status_code == 200:
+            messagebox.showinfo("Success", f"{len(entries)} entries submitted successfully.")
+            return True
         else:
-            messagebox.showerror("Error", f"Failed to submit data: {response.json().get('message')}")
+            result = response.json()
+            details = ", ".join(str(item) for item in result.get("so_numbers", []))
+            messagebox.showerror("Error", f"Failed to submit data: {result.get('message')}" + (f": {details}" if details else ""))
     except Exception as e:
         messagebox.showerror("Error", f"Could not connect to server: {e}")
+    return False
 
-# Main UI setup
-# Main UI setup
-def setup_ui(headers):
+# Main UI setup; opened as a Toplevel of master when run from the main menu
+def setup_ui(headers, master=None, started=None):
     global admin_mode_active, checkboxes, field_states, notes_text, description_text
 
-    root = tk.Tk()
+    root = tk.Toplevel(master) if master else tk.Tk()
     root.title("Add New Data Entry")
     visual_settings = load_visual_settings()
     root.configure(bg=visual_settings["bg_color"])
@@ -267,6 +208,8 @@ def setup_ui(headers):
             entry_fields[header].config(text=date)  # Update the button text with the selected date
             top.destroy()
 
+        from tkcalendar import Calendar  # Loaded the first time a calendar is opened
+
         top = tk.Toplevel(root)
         top.title(f"Select Date for {header}")
 
@@ -291,7 +234,8 @@ def setup_ui(headers):
             else:
                 messagebox.showerror("Error", "Incorrect password.")
 
-    def save_entry():
+    def collect_entry():
+        """Values currently on the form, by header."""
         entry_data = {}
         for header, field in entry_fields.items():
             if isinstance(field, tk.Text):
@@ -301,13 +245,30 @@ def setup_ui(headers):
                     entry_data[header] = field.cget("text").strip()
                 else:
                     entry_data[header] = field.get().strip()
-                save_suggestion(header, entry_data[header])
-
+        return entry_data
+
+    def remember_values(entries):
+        """Remember new dropdown values locally (NOTES/Description are free text)."""
+        new_values = save_suggestions([{header: value for header, value in entry_data.items()
+                                        if not isinstance(entry_fields.get(header), tk.Text)}
+                                       for entry_data in entries])
+        for header, values in new_values.items():
+            if isinstance(entry_fields.get(header), ttk.Combobox):
+                entry_fields[header]["values"] = list(entry_fields[header]["values"]) + values
+
+    def save_lock_states():
         for header, lock_info in checkboxes.items():
             field_states[header] = lock_info["var"].get()
         save_field_states(field_states)
 
-        submit_new_entry(entry_data)
+    def save_entry():
+        with telemetry.span("USERADD.prepare_entry"):  # Everything before the entry is sent
+            entry_data = collect_entry()
+            remember_values([entry_data])
+            save_lock_states()
+
+        if not submit_new_entry(entry_data):
+            return  # Keep what was typed so it can be fixed and saved again
 
         for widget in entry_fields.values():
             if isinstance(widget, tk.Text):
@@ -322,11 +283,111 @@ def setup_ui(headers):
     tk.Button(root, text="Save Entry", command=save_entry, bg=visual_settings["button_bg_color"], fg=visual_settings["button_fg_color"],
               font=(visual_settings["font_family"], visual_settings["font_size"])).grid(row=2, column=0, pady=20, sticky="w")
 
+    def open_multi_row_window():
+        """Enter many lines of one order at once; every line starts from the values on the form."""
+        columns = [header for header in LINE_COLUMNS if header in entry_fields]
+        font = (visual_settings["font_family"], visual_settings["font_size"])
+
+        top = tk.Toplevel(root)
+        top.title("Multi-Row Entry")
+        top.geometry("1200x600")
+        top.configure(bg=visual_settings["bg_color"])
+        tk.Label(top, text="Each line uses the values filled in on the main form; cells filled in here replace them for that line.\n"
+                           "Empty lines are skipped.", bg=visual_settings["bg_color"], fg=visual_settings["fg_color"],
+                 font=font, justify="left").pack(anchor="w", padx=10, pady=5)
+
+        # Scrollable grid of lines
+        grid_area = tk.Frame(top)
+        grid_area.pack(fill="both", expand=True, padx=10, pady=5)
+        canvas = tk.Canvas(grid_area, bg=visual_settings["bg_color"], highlightthickness=0)
+        scrollbar = ttk.Scrollbar(grid_area, orient="vertical", command=canvas.yview)
+        grid_frame = tk.Frame(canvas, bg=visual_settings["bg_color"])
+        grid_frame.bind("<Configure>", lambda event: canvas.configure(scrollregion=canvas.bbox("all")))
+        canvas.create_window((0, 0), window=grid_frame, anchor="nw")
+        canvas.configure(yscrollcommand=scrollbar.set)
+        canvas.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        for col, header in enumerate(columns):
+            tk.Label(grid_frame, text=header, bg=visual_settings["bg_color"], fg=visual_settings["fg_color"],
+                     font=font).grid(row=0, column=col, padx=2, pady=2, sticky="w")
+
+        lines = []
+
+        def add_line():
+            cells = {}
+            for col, header in enumerate(columns):
+                field = entry_fields[header]
+                cell = ttk.Combobox(grid_frame, font=font, width=18,
+                                    values=field["values"] if isinstance(field, ttk.Combobox) else [])
+                cell.grid(row=len(lines) + 1, column=col, padx=2, pady=2)
+                cells[header] = cell
+            lines.append(cells)
+
+        def submit_lines():
+            shared = collect_entry()
+            entries = []
+            for cells in lines:
+                values = {header: cell.get().strip() for header, cell in cells.items() if cell.get().strip()}
+                if values:
+                    entries.append({**shared, **values})
+            if not entries:
+                messagebox.showerror("Error", "Fill in at least one line.", parent=top)
+                return
+
+            with telemetry.span("USERADD.prepare_lines", lines=len(entries)):
+                remember_values(entries)
+                save_lock_states()
+            if submit_new_entries(entries):
+                for cells in lines:
+                    for cell in cells.values():
+                        cell.set("")
+
+        for _ in range(MULTI_ROW_START_LINES):
+            add_line()
+
+        button_frame = tk.Frame(top, bg=visual_settings["bg_color"])
+        button_frame.pack(fill="x", padx=10, pady=10)
+        tk.Button(button_frame, text="Add Line", command=add_line, bg=visual_settings["button_bg_color"],
+                  fg=visual_settings["button_fg_color"], font=font).pack(side="left", padx=5)
+        tk.Button(button_frame, text="Submit All Lines", command=submit_lines, bg=visual_settings["button_bg_color"],
+                  fg=visual_settings["button_fg_color"], font=font).pack(side="left", padx=5)
+
+    tk.Button(root, text="Multi-Row Entry", command=open_multi_row_window, bg=visual_settings["button_bg_color"], fg=visual_settings["button_fg_color"],
+              font=(visual_settings["font_family"], visual_settings["font_size"])).grid(row=3, column=0, pady=5, sticky="w")
+
     tk.Button(root, text="Toggle Admin", command=toggle_admin_mode, bg=visual_settings["button_bg_color"], fg=visual_settings["button_fg_color"],
               font=(visual_settings["font_family"], visual_settings["font_size"])).grid(row=2, column=1, pady=20, sticky="w")
 
-    root.mainloop()
-
-headers = fetch_headers_from_server()
-if headers:
-    setup_ui(headers)
+    # Add values others save to the dropdowns as they appear on the server
+    def apply_change(event):
+        client_cache.apply_event(event, "refined")
+        field = entry_fields.get(event.get("column"))
+        if event["type"] == "refined" and isinstance(field, ttk.Combobox):
+            new_values = add_suggestions({event["column"]: event["values"]}).get(event["column"])
+            if new_values:
+                field["values"] = list(field["values"]) + new_values
+
+    def resync():
+        download_refined_files(refresh=True)
+        for header, field in entry_fields.items():
+            if isinstance(field, ttk.Combobox):
+                field["values"] = load_suggestions(header)
+        feed["resume"](refined_seq)
+
+    feed = start_change_feed(root, FLASK_SERVER, refined_seq, apply_change, resync)
+    client_context.start_outbox_flusher()  # Send entries saved while offline
+    if started is not None:
+        telemetry.window_shown(root, "USERADD.first_window", started)
+
+    if master is None:
+        root.mainloop()
+
+def main(master=None):
+    started = time.perf_counter()
+    headers = fetch_headers_from_server()
+    if headers:
+        setup_ui(headers, master, started)
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,110 @@
+import time
 import tkinter as tk
+from urllib.parse import quote
 from tkinter import ttk, messagebox
 import requests
-import json
-import os
+from change_feed import start_change_feed
+import client_cache
+import client_context
+import telemetry
 
 # Flask server endpoint
-FLASK_SERVER = "http://localhost:5000"
+FLASK_SERVER = client_context.FLASK_SERVER
 
-# File to store combobox and checkbox states
-STATE_FILE = "combobox_states.json"
+PICKER_LIMIT = 50  # S.O.# values offered at a time while typing
+PICKER_DELAY_MS = 200  # Pause in typing before the host is asked
+TEXT_FIELDS = ("NOTES", "Description")  # Edited in text boxes instead of comboboxes
 
 admin_mode = False  # Tracks if Admin mode is enabled
 checkboxes = {}  # Stores checkboxes globally to be accessible in toggle_admin
 
-def ensure_file_refined():
-    # Step 1: Send the request to the Flask server
-    url = 'http://localhost:5000/list_refined'  # Replace with your Flask server URL
-    response = requests.get(url)
-
-    # Check if the response is valid
-    if response.status_code == 200:
-        data = response.json()
-        
-        # Step 2: Parse the JSON data
-        files_data = data.get("files", {})
-        
-        # Get the directory where the script is located
-        script_dir = os.path.dirname(os.path.realpath(__file__))
-        
-        # Path to the DB/Refined directory in the same folder as the script
-        base_directory = os.path.join(script_dir, "DB", "Refined")
-        
-        # Step 3: Check if the files exist and create them if they don't
-        for file_name, file_data in files_data.items():
-            file_path = os.path.join(base_directory, file_name)
-            
-            # If the file doesn't exist, create it and write the data inside
-            if not os.path.exists(file_path):
-                # Create the directory if it doesn't exist
-                os.makedirs(base_directory, exist_ok=True)
-                
-                # Write each item in file_data on a new line
-                with open(file_path, 'w') as file:
-                    for item in file_data:
-                        file.write(f"{item}\n")  # Write each item on a new line
-                print(f"Created file: {file_name} with data: {file_data}")
-            else:
-                print(f"File {file_name} already exists, skipping.")
-    else:
-        print("Failed to retrieve data from Flask server.")
-
-# Call the function to ensure the files are created
-ensure_file_refined()
-
-# Fetch data from the Flask server
-def fetch_data():
+# S.O.# values starting with what was typed (the host searches its S.O.# index)
+def search_so_numbers(prefix, limit=PICKER_LIMIT):
     try:
-        response = requests.get(f"{FLASK_SERVER}/get_data")
+        response = client_context.session().get(f"{FLASK_SERVER}/keys/so", params={"prefix": prefix, "limit": limit},
+                                                timeout=5)
+        response.raise_for_status()
+        return response.json()["keys"]
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        # Offline: search the rows cached by the last refresh, if any
+        prefix = prefix.strip().casefold()
+        keys = sorted(str(row["S.O.#"]) for row in client_cache.get_rows()
+                      if str(row.get("S.O.#")).casefold().startswith(prefix))
+        return keys[:limit]
+
+
+# Fetch the one row being edited; returns (row, change-feed sequence, row version) or (None, 0, None)
+def fetch_row(so_value):
+    try:
+        response = client_context.session().get(f"{FLASK_SERVER}/rows/{quote(str(so_value), safe='')}", timeout=10)
         if response.status_code == 200:
-            return response.json()
-        else:
-            messagebox.showerror("Error", f"Failed to fetch data: {response.json().get('message')}")
-            return []
+            row, seq, etag = response.json(), int(response.headers.get("X-Change-Seq", 0)), response.headers.get("ETag")
+            client_cache.save_row(row, seq, etag.strip('"') if etag else None)  # For editing it offline later
+            return row, seq, etag
+        messagebox.showerror("Error", response.json().get("message", f"No matching data found for S.O.#: {so_value}"))
+        return None, 0, None
+    except requests.exceptions.ConnectionError as e:
+        row = client_cache.get_row(so_value)  # Work offline from the last download
+        version = client_cache.get_row_version(so_value)
+        if row is not None and version:
+            # The edit is queued with this version, so it is refused if the row changes on the host meanwhile
+            return row, client_cache.get_seq("rows") or 0, f'"{version}"'
+        if row is not None:
+            messagebox.showerror("Error", f"S.O.# {so_value} was cached without its version, so an offline edit "
+                                          "could overwrite newer changes. Connect to the server to edit it.")
+            return None, 0, None
+        messagebox.showerror("Error", f"Could not connect to server: {e}")
+        return None, 0, None
     except Exception as e:
         messagebox.showerror("Error", f"Could not connect to server: {e}")
-        return []
+        return None, 0, None
+
 
+# A field value as the editor shows it, for comparing edits with the loaded row
+def field_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
 
-# Update data on the Flask server
-def update_data(so_value, updated_data):
+
+# Send only the changed fields; returns the host's answer ({"row", "version"}) or None.
+# version is the row version the edits were made on: if someone else saved the
+# row since, the host refuses with 412 and sends the current row instead.
+def patch_row(so_value, changes, version=None):
     try:
-        response = requests.post(f"{FLASK_SERVER}/update_data/{so_value}", json=updated_data)
-        if response.status_code == 200:
-            messagebox.showinfo("Success", response.json().get("message"))
+        headers = {"If-Match": version} if version else None
+        response = client_cache.send_or_queue(FLASK_SERVER, "PATCH", f"/rows/{quote(str(so_value), safe='')}",
+                                             changes, headers)
+        if response is None:
+            messagebox.showinfo("Saved Offline", "The server is unreachable or busy. The changes were saved and will be sent automatically.")
+        elif response.status_code == 200:
+            result = response.json()
+            messagebox.showinfo("Success", f"S.O.# {so_value} updated: {', '.join(result['changed']) or 'no changes'}.")
+            return result
+        elif response.status_code == 412:
+            result = response.json()
+            messagebox.showwarning("Changed by Someone Else",
+                                   f"{result.get('message')}\n\nThe current values are now shown; your edits were kept. Save again to apply them.")
+            return result
         else:
             messagebox.showerror("Error", f"Failed to update data: {response.json().get('message')}")
     except Exception as e:
         messagebox.showerror("Error", f"Could not connect to server: {e}")
+    return None
 
 
-# Load combobox and checkbox states from file
+# Load combobox and checkbox states from the local cache
 def load_states():
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "r") as file:
-            return json.load(file)
-    return {}
+    return client_cache.get_setting("useredit_states", {})
 
 
-# Save combobox and checkbox states to file
+# Save combobox and checkbox states to the local cache
 def save_states(new_states):
     existing_states = load_states()
     merged_states = {**existing_states, **new_states}  # Merge new states with existing ones
-    with open(STATE_FILE, "w") as file:
-        json.dump(merged_states, file, indent=4)
+    client_cache.set_setting("useredit_states", merged_states)
 
 
 # Toggle Admin Mode
@@ -122,61 +134,94 @@ def toggle_admin():
     tk.Button(toggle_window, text="Submit", command=check_password, font=("Arial", 12)).pack(pady=10)
 
 
-# First Window: Select S.O.# and Load
-def open_main_window():
-    data = fetch_data()
-    if not data:
-        return
+# First Window: Select S.O.# and Load (a Toplevel of master when run from the main menu)
+def open_main_window(master=None):
+    started = time.perf_counter()
 
-    def load_entry():
-        selected_so = so_combobox.get()
+    # Only the S.O.# values matching what is typed are fetched, and the picked
+    # row on LOAD, instead of the whole table; the offline copy is refreshed
+    # in the background
+    client_context.start_rows_refresh()
+    def load_entry(event=None):
+        selected_so = so_combobox.get().strip()
         if not selected_so:
             messagebox.showerror("Error", "Please select an S.O.#.")
             return
-        matching_row = next((row for row in data if str(row["S.O.#"]) == selected_so), None)
-        if matching_row:
+        load_started = time.perf_counter()
+        row, seq, version = fetch_row(selected_so)
+        if row:
             root.destroy()
-            open_edit_window(matching_row)
-        else:
-            messagebox.showerror("Error", f"No matching data found for S.O.#: {selected_so}")
+            open_edit_window(row, seq, master, version, load_started)
 
-    root = tk.Tk()
+    root = tk.Toplevel(master) if master else tk.Tk()
     root.title("S.O.# Selection")
     root.geometry("400x200")
     root.resizable(False, False)
 
-    tk.Label(root, text="Select S.O.#:", font=("Arial", 14, "bold")).pack(pady=20)
-    so_combobox = ttk.Combobox(root, values=[str(row["S.O.#"]) for row in data], font=("Arial", 12), width=30)
+    tk.Label(root, text="Type or select an S.O.#:", font=("Arial", 14, "bold")).pack(pady=20)
+    so_combobox = ttk.Combobox(root, values=search_so_numbers(""), font=("Arial", 12), width=30)
     so_combobox.pack(pady=10)
+    so_combobox.focus_set()
 
-    tk.Button(root, text="LOAD", command=load_entry, font=("Arial", 14), bg="#4CAF50", fg="white", width=15).pack(pady=20)
-    root.mainloop()
+    # Search as the user types, once typing pauses
+    pending = {"job": None}
 
+    def refresh_choices():
+        pending["job"] = None
+        so_combobox["values"] = search_so_numbers(so_combobox.get())
 
-# Directory to store the files
-DB_REFINED_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "DB", "Refined")
+    def on_key(event):
+        if event.keysym in ("Return", "Up", "Down", "Escape"):
+            return
+        if pending["job"] is not None:
+            root.after_cancel(pending["job"])
+        pending["job"] = root.after(PICKER_DELAY_MS, refresh_choices)
+
+    so_combobox.bind("<KeyRelease>", on_key)
+    so_combobox.bind("<Return>", load_entry)
+
+    tk.Button(root, text="LOAD", command=load_entry, font=("Arial", 14), bg="#4CAF50", fg="white", width=15).pack(pady=20)
+    telemetry.window_shown(root, "USEREDIT.first_window", started)
+    if master is None:
+        root.mainloop()
 
-# Ensure that the folder exists
-os.makedirs(DB_REFINED_DIR, exist_ok=True)
 
-def open_edit_window(row_data):
+def open_edit_window(row_data, since_seq=0, master=None, version=None, started=None):
     global checkboxes  # Ensure the global checkboxes is accessible
     states = load_states()
+    client_context.refined_seq()  # Download the refined values once per process for the dropdowns
+    # row_data follows the host (the change feed updates it); the edits are made
+    # on loaded["version"], which only moves on a save or a 412 reload, so a
+    # save made on values since changed by someone else is refused by the host
+    loaded = {"version": version}
+    filled = {}  # Text field -> text its box was filled with, to tell the user's edits apart
 
     def save_changes():
-        updated_data = {}
+        changes = {}
         current_states = {}
         for header, widgets in entry_widgets.items():
-            combo, checkbox_var = widgets
+            widget, checkbox_var = widgets
             current_states[header] = {
-                "locked": combo["state"] == "disabled",
+                "locked": widget["state"] == "disabled",
                 "checked": checkbox_var.get()
             }
-            if header == "NOTES" or header == "Description" or (combo.get() != ""):  # Update NOTES and Description even when empty; update others only if a new value is selected
-                if not checkbox_var.get():  # If not locked
-                    updated_data[header] = combo.get() if header != "NOTES" and header != "Description" else description_text.get("1.0", "end-1c").strip()
+            if header in TEXT_FIELDS:
+                new_value = widget.get("1.0", "end-1c").strip()  # Each text box is read from its own widget
+                if new_value != filled[header]:
+                    changes[header] = new_value  # Only boxes the user edited are sent
+                continue
+            new_value = widget.get().strip()
+            if new_value == "" or checkbox_var.get():  # Empty means no new value was picked; locked fields are kept
+                continue
+            if new_value != field_text(row_data.get(header)):
+                changes[header] = new_value  # Only picks that differ from the row on the host are sent
         save_states(current_states)  # Save the current states of checkboxes and locks
-        update_data(row_data["S.O.#"], updated_data)
+        if not changes:
+            messagebox.showinfo("No Changes", "Nothing was changed.")
+            return
+        result = patch_row(row_data["S.O.#"], changes, loaded["version"])
+        if result and "row" in result:
+            reload_row(result["row"], result.get("version"))
 
     def toggle_lock(header):
         combo, checkbox_var = entry_widgets[header]
@@ -191,7 +236,7 @@ def open_edit_window(row_data):
         }
         save_states(new_states)
 
-    edit_window = tk.Tk()
+    edit_window = tk.Toplevel(master) if master else tk.Tk()
     edit_window.title("Edit Data")
     edit_window.geometry("900x600")
     edit_window.resizable(True, True)
@@ -210,37 +255,29 @@ def open_edit_window(row_data):
     notes_button_frame.pack(side="bottom", anchor="se", padx=10, pady=10)
 
     entry_widgets = {}
+    current_labels = {}  # Header -> label showing the value currently saved on the server
     row_idx = 0  # Row index for Notes and Description placement
     for idx, (header, value) in enumerate(row_data.items()):
         if header == "S.O.#":  # Skip editing the primary key
             continue
 
-        # Sanitize the header for use as a file name
-        sanitized_header = header.replace(" ", "_").replace("/", "_").replace("\\", "_").replace(":", "_").replace(".", "_")
-        file_path = os.path.join(DB_REFINED_DIR, f"{sanitized_header}.txt")
-
-        # Ensure the .txt file exists and create it if necessary
-        if not os.path.exists(file_path):
-            with open(file_path, 'w') as file:
-                # Write some default content (can be adjusted based on your needs)
-                file.write("")  # Empty content to initialize the file
-            print(f"Created file: {file_path}")
-
-        # Read values from the .txt file to populate the combobox
-        with open(file_path, 'r') as file:
-            combobox_values = [line.strip() for line in file.readlines() if line.strip()]
+        # Refined values of this column from the local cache, most used first
+        combobox_values = client_cache.get_refined(client_context.refined_file_name(header))
 
-        if header == "NOTES" or header == "Description":  # Special handling for NOTES and Description
+        if header in TEXT_FIELDS:  # Special handling for NOTES and Description
             tk.Label(right_frame, text=header, font=("Arial", 12, "bold"), bg="#f9f9f9").grid(row=row_idx, column=0, sticky="w", pady=5)
-            description_text = tk.Text(right_frame, height=15, width=40, font=("Arial", 12))
-            description_text.insert("1.0", value)
-            description_text.grid(row=row_idx + 1, column=0, pady=10)
-            entry_widgets[header] = (description_text, tk.BooleanVar(value=False))  # NOTES and Description don't use checkboxes
+            text_box = tk.Text(right_frame, height=15, width=40, font=("Arial", 12))
+            text_box.insert("1.0", field_text(value))
+            filled[header] = field_text(value)
+            text_box.grid(row=row_idx + 1, column=0, pady=10)
+            entry_widgets[header] = (text_box, tk.BooleanVar(value=False))  # NOTES and Description don't use checkboxes
             row_idx += 2  # Skip the next row for the next field
             continue
 
         # Current value, Combobox, and Checkbox for other fields
-        tk.Label(left_frame, text=value, font=("Arial", 12), fg="red", bg="#f9f9f9").grid(row=idx, column=0, sticky="w", pady=5, padx=10)  # Current value in red
+        current_label = tk.Label(left_frame, text=value, font=("Arial", 12), fg="red", bg="#f9f9f9")
+        current_label.grid(row=idx, column=0, sticky="w", pady=5, padx=10)  # Current value in red
+        current_labels[header] = current_label
         tk.Label(left_frame, text=f"{header}:", font=("Arial", 12, "bold"), bg="#f9f9f9").grid(row=idx, column=1, sticky="w", pady=5, padx=20)  # Header name with spacing
         combo = ttk.Combobox(left_frame, values=combobox_values, font=("Arial", 12), width=25)
         combo.grid(row=idx, column=2, padx=10, pady=5)
@@ -267,8 +304,45 @@ def open_edit_window(row_data):
     # Save button
     tk.Button(notes_button_frame, text="SAVE", command=save_changes, font=("Arial", 14), bg="#4CAF50", fg="white", width=15).pack(side="right", padx=10, pady=5)
 
-    edit_window.mainloop()
+    # Show row as saved on the host; text boxes the user has not edited follow it
+    def show_row(row):
+        row_data.update(row)
+        for header, label in current_labels.items():
+            value = row.get(header)
+            label.config(text="" if value is None else value)
+        for header in filled:
+            text_box, new_text = entry_widgets[header][0], field_text(row.get(header))
+            text = text_box.get("1.0", "end-1c").strip()
+            if text == filled[header]:
+                text_box.delete("1.0", "end")
+                text_box.insert("1.0", new_text)
+                filled[header] = new_text
+            elif text == new_text:
+                filled[header] = new_text  # The user's edit is what the host has now
+
+    # The row after a save, or the current row from a 412: edits are now made on its version
+    def reload_row(row, version):
+        show_row(row)
+        loaded["version"] = f'"{version}"' if version else None
+
+    # Show edits saved by others (or by this window) to this S.O.# as they happen
+    def apply_change(event):
+        client_cache.apply_event(event, "rows")
+        if event["type"] == "update" and str(event["so"]) == str(row_data["S.O.#"]):
+            show_row(event["row"])
+
+    start_change_feed(edit_window, FLASK_SERVER, since_seq, apply_change)
+    if started is not None:
+        telemetry.window_shown(edit_window, "USEREDIT.edit_window", started)  # From LOAD to the row on screen
+
+    if master is None:
+        edit_window.mainloop()
+
+
+def main(master=None):
+    open_main_window(master)
 
 
 # Run the program
-open_main_window()
+if __name__ == "__main__":
+    main()
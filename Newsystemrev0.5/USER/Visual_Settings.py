@@ -1,41 +1,20 @@
 import tkinter as tk
 from tkinter import ttk, font, messagebox
-import json
-import os
 import subprocess
+import client_context
 
-# Define the configuration file path
-CONFIG_FILE = "visual_settings.json"
-
-# Default visual settings
-default_settings = {
-    "font_family": "Arial",
-    "font_size": 12,
-    "bg_color": "#ffffff",
-    "fg_color": "#000000",
-    "button_bg_color": "#f0f0f0",
-    "button_fg_color": "#000000"
-}
-
-# Load settings from the configuration file
+# Load settings (merged with the defaults) from the shared client context
 def load_settings():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, "r") as file:
-                loaded_settings = json.load(file)
-            # Merge loaded settings with defaults to fill missing keys
-            for key, value in default_settings.items():
-                loaded_settings.setdefault(key, value)
-            return loaded_settings
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load settings: {e}")
-    return default_settings
-
-# Save settings to the configuration file
+    try:
+        return client_context.visual_settings()
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to load settings: {e}")
+    return dict(client_context.DEFAULT_VISUAL_SETTINGS)
+
+# Save settings to the local cache
 def save_settings(settings):
     try:
-        with open(CONFIG_FILE, "w") as file:
-            json.dump(settings, file, indent=4)
+        client_context.save_visual_settings(settings)
     except Exception as e:
         messagebox.showerror("Error", f"Failed to save settings: {e}")
 
@@ -48,10 +27,17 @@ def open_mainui():
     finally:
         root.destroy()
 
-# Main settings editor GUI
-def settings_editor():
+# Main settings editor GUI. From the main menu it opens as a Toplevel of master
+# and on_save(settings) restyles the menu instead of relaunching mainui.py
+def settings_editor(master=None, on_save=None):
     current_settings = load_settings()
 
+    def close():
+        if master is None:
+            open_mainui()  # Close and open mainui
+        else:
+            root.destroy()
+
     def apply_changes():
         # Save the settings based on user input
         current_settings["font_family"] = font_family_var.get()
@@ -63,11 +49,13 @@ def settings_editor():
 
         save_settings(current_settings)
         messagebox.showinfo("Settings", "Settings saved successfully!")
-        open_mainui()  # Close and open mainui
+        if on_save:
+            on_save(current_settings)
+        close()
 
     # Initialize the settings editor window
     global root
-    root = tk.Tk()
+    root = tk.Toplevel(master) if master else tk.Tk()
     root.title("Visual Settings Editor")
     root.geometry("400x450")  # Increased height to fit the Apply button
 
@@ -113,9 +101,10 @@ def settings_editor():
     tk.Button(root, text="Apply and Save", command=apply_changes).pack(pady=20)
 
     # Override the close button (X) to open mainui
-    root.protocol("WM_DELETE_WINDOW", open_mainui)
+    root.protocol("WM_DELETE_WINDOW", close)
 
-    root.mainloop()
+    if master is None:
+        root.mainloop()
 
 if __name__ == "__main__":
     settings_editor()
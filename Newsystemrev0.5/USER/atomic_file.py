@@ -0,0 +1,112 @@
+# atomic_file.py
+"""Crash-safe file writes and a cross-process file lock.
+
+Files the client tools write (exports) go through atomic_write or
+atomic_path: the data goes to a temporary file next to the target, is
+flushed to disk, and then replaces the target with os.replace, so a crash
+never leaves half a file. This is the same module as HOST/atomic_file.py.
+
+file_lock() holds an advisory lock on "<path>.lock" so two tool processes
+(mainui started twice) do not do the same work at once, e.g. both sending
+the queued writes of the outbox. Processes that do not ask for the lock are
+not stopped by it.
+"""
+import contextlib
+import os
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+class LockTimeout(TimeoutError):
+    """Another process held the lock for longer than we were willing to wait."""
+
+def _temp_path(path):
+    # Keeps the extension, since pandas picks the writer from it ("data.xlsx" -> "data.1234.tmp.xlsx")
+    root, extension = os.path.splitext(path)
+    return f"{root}.{os.getpid()}.tmp{extension}"
+
+def _fsync_directory(directory):
+    """Make the rename itself durable (not possible, nor needed, on Windows)."""
+    if os.name == "nt":
+        return
+    descriptor = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def _replace(temp_path, path):
+    with open(temp_path, "rb+") as file:
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(os.path.dirname(path))
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Yield a temporary path to write path's new contents to; it replaces path if the block succeeds.
+
+        with atomic_path(EXCEL_FILE_PATH) as temp_path:
+            df.to_excel(temp_path, index=False)
+    """
+    temp_path = _temp_path(path)
+    try:
+        yield temp_path
+        _replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """open() replacement for writing a whole file: the new contents replace path only once complete."""
+    with atomic_path(path) as temp_path:
+        with open(temp_path, mode, **kwargs) as file:
+            yield file
+            file.flush()
+
+@contextlib.contextmanager
+def file_lock(path, timeout=None, poll=0.1):
+    """Hold an exclusive advisory lock on "<path>.lock" for the duration of the block.
+
+    Waits up to timeout seconds (forever if None); raises LockTimeout.
+    """
+    lock_file = open(f"{path}.lock", "a+b")
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                if os.name == "nt":
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise LockTimeout(f"{path} is locked by another process")
+                time.sleep(poll)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+_held = []  # Locks kept for the life of the process
+
+def hold_lock(path):
+    """Take the lock on path until this process exits. Returns False if another process holds it."""
+    lock = file_lock(path, timeout=0)
+    try:
+        lock.__enter__()
+    except LockTimeout:
+        return False
+    _held.append(lock)
+    return True
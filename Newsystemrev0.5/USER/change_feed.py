@@ -0,0 +1,86 @@
+import json
+import queue
+import threading
+import time
+import requests
+
+# Follow the host's change feed (GET /changes/stream) so open windows can apply
+# new and edited rows live instead of re-downloading everything.
+#
+# The stream is read on a background thread; events are handed to the Tk thread
+# through a queue that is drained with root.after, because Tk widgets must only
+# be touched from the thread that runs mainloop.
+
+RECONNECT_DELAY = 5  # Seconds to wait before reconnecting after an error
+
+def _read_stream(server_url, state, events):
+    """Background thread: read Server-Sent Events and queue them for the Tk thread."""
+    while not state["stopped"]:
+        try:
+            response = requests.get(
+                f"{server_url}/changes/stream",
+                params={"since": state["seq"]},
+                stream=True,
+                timeout=(5, 60),  # The host sends a keep-alive at least every 15 seconds
+            )
+            event_type, data = "message", []
+            for line in response.iter_lines(decode_unicode=True):
+                if state["stopped"]:
+                    return
+                if line is None or line.startswith(":"):
+                    continue
+                if line == "":
+                    # A blank line ends one event
+                    if data:
+                        events.put((event_type, json.loads("\n".join(data))))
+                    event_type, data = "message", []
+                elif line.startswith("event:"):
+                    event_type = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].strip())
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Change feed disconnected: {e}")
+        time.sleep(RECONNECT_DELAY)
+
+def start_change_feed(root, server_url, since, on_change, on_resync=None):
+    """Apply changes after sequence `since` by calling on_change(event) on the Tk thread.
+
+    on_resync() is called when the host can no longer replay the missed
+    changes (or the workbook was replaced); the window should reload its data
+    and call the returned `resume(seq)` with the new X-Change-Seq.
+    Returns a dict with "stop", "resume" and "seq" (last applied sequence) functions.
+    """
+    state = {"seq": int(since or 0), "stopped": False}
+    events = queue.Queue()
+
+    def pump():
+        if state["stopped"]:
+            return
+        try:
+            while True:
+                event_type, event = events.get_nowait()
+                if event_type == "resync" or event.get("type") in ("reload", "refined_sync"):
+                    state["seq"] = int(event.get("seq", state["seq"]))
+                    if on_resync:
+                        on_resync()
+                    continue
+                if event.get("seq", 0) <= state["seq"]:
+                    continue  # Already applied (e.g. replayed after a reconnect)
+                state["seq"] = event["seq"]
+                on_change(event)
+        except queue.Empty:
+            pass
+        try:
+            root.after(250, pump)
+        except Exception:
+            state["stopped"] = True  # The window was closed
+
+    def stop():
+        state["stopped"] = True
+
+    def resume(seq):
+        state["seq"] = int(seq or 0)
+
+    threading.Thread(target=_read_stream, args=(server_url, state, events), daemon=True).start()
+    root.after(250, pump)
+    return {"stop": stop, "resume": resume, "seq": lambda: state["seq"]}
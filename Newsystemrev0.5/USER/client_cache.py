@@ -0,0 +1,288 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import requests
+import telemetry
+from atomic_file import LockTimeout, file_lock
+
+# Local cache shared by all USER tools (DB/client_cache.sqlite3 next to this file).
+#
+# It replaces the per-tool state that used to live in DB/Refined/*.txt,
+# Db/refined/*.txt, combobox_states*.json and visual_settings.json:
+#   rows     - job rows by S.O.#, with the change-feed sequence they were seen at
+#              and their version on the host (the ETag of GET /rows/<so>)
+#   refined  - refined vocabularies (one row per file/value)
+#   settings - visual settings and lock/checkbox states, with an update time
+#   outbox   - writes made while the host was unreachable, sent in order later
+#              (with their If-Match, so an edit of a row changed since is refused)
+#   meta     - change-feed sequences ("rows_seq", "refined_seq") the cache is current to
+#
+# Tools read from here first so they open instantly, then catch up from the
+# host's change feed in the background.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.path.join(BASE_DIR, "DB", "client_cache.sqlite3")
+
+# State files the tools used before the cache existed; imported once on first use
+LEGACY_SETTINGS_FILES = {
+    "visual_settings": [os.path.join(BASE_DIR, "visual_settings.json"), "visual_settings.json"],
+    "useredit_states": [os.path.join(BASE_DIR, "combobox_states.json"), "combobox_states.json"],
+    "useradd_field_states": [os.path.join(BASE_DIR, "DB", "settings", "combobox_states2.json")],
+}
+
+OUTBOX_RETRY_SECONDS = 15  # How often queued writes are retried
+
+# Who this PC is to the host, in its logs and telemetry
+CLIENT_HEADERS = {"X-Client-Id": f"{socket.gethostname()}/{os.environ.get('USERNAME') or os.environ.get('USER', '')}"}
+
+_lock = threading.RLock()
+_connection = None
+
+def _connect():
+    """Open (and if needed create) the cache database. One connection per process."""
+    global _connection
+    with _lock:
+        if _connection is None:
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+            _connection = sqlite3.connect(CACHE_PATH, timeout=10, check_same_thread=False)
+            _connection.execute("PRAGMA journal_mode=WAL")  # Several tools may have it open
+            _connection.executescript("""
+                CREATE TABLE IF NOT EXISTS rows (so TEXT PRIMARY KEY, data TEXT NOT NULL, seq INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS refined (file TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (file, value));
+                CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, method TEXT NOT NULL,
+                                                   path TEXT NOT NULL, body TEXT, created REAL NOT NULL,
+                                                   status TEXT NOT NULL DEFAULT 'pending', error TEXT);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+            # Columns added since the cache was first created
+            for table, column in (("rows", "version"), ("outbox", "headers")):
+                if column not in [info[1] for info in _connection.execute(f"PRAGMA table_info({table})")]:
+                    _connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+        return _connection
+
+def _get_meta(db, key, default=None):
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def _set_meta(db, key, value):
+    db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+def get_seq(key):
+    """Change-feed sequence the cache is current to for "rows" or "refined" (None if never loaded)."""
+    with _lock:
+        value = _get_meta(_connect(), f"{key}_seq")
+        return int(value) if value is not None else None
+
+# Rows
+
+def get_rows():
+    """All cached rows, in the order they were first cached."""
+    with _lock:
+        return [json.loads(data) for (data,) in _connect().execute("SELECT data FROM rows ORDER BY rowid")]
+
+def get_row(so):
+    with _lock:
+        row = _connect().execute("SELECT data FROM rows WHERE so = ?", (str(so),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+def get_row_version(so):
+    """Version of the cached row on the host when it was cached (None if unknown)."""
+    with _lock:
+        row = _connect().execute("SELECT version FROM rows WHERE so = ?", (str(so),)).fetchone()
+        return row[0] if row else None
+
+def save_row(row, seq, version):
+    """Cache one row read from the host (GET /rows/<so>) with its version, so it can be edited offline."""
+    with _lock:
+        db = _connect()
+        with db:
+            db.execute("INSERT OR REPLACE INTO rows (so, data, seq, version) VALUES (?, ?, ?, ?)",
+                       (str(row.get("S.O.#")), json.dumps(row), int(seq or 0), version))
+
+def save_rows(rows, seq):
+    """Replace the cached rows with a full download taken at change-feed sequence seq.
+
+    /get_data sends no row versions, so each row keeps the one last cached for
+    it: an offline edit sent with an older version is refused, never applied.
+    """
+    with _lock:
+        db = _connect()
+        with db:
+            versions = dict(db.execute("SELECT so, version FROM rows WHERE version IS NOT NULL"))
+            db.execute("DELETE FROM rows")
+            db.executemany("INSERT OR REPLACE INTO rows (so, data, seq, version) VALUES (?, ?, ?, ?)",
+                           [(str(row.get("S.O.#")), json.dumps(row), int(seq or 0), versions.get(str(row.get("S.O.#"))))
+                            for row in rows])
+            _set_meta(db, "rows_seq", int(seq or 0))
+
+# Refined vocabularies
+
+def get_refined(file_name):
+    """Values of one refined file, e.g. get_refined("Customer.txt")."""
+    with _lock:
+        return [value for (value,) in _connect().execute(
+            "SELECT value FROM refined WHERE file = ? ORDER BY rowid", (file_name,))]
+
+def get_refined_files():
+    with _lock:
+        files = {}
+        for file_name, value in _connect().execute("SELECT file, value FROM refined ORDER BY rowid"):
+            files.setdefault(file_name, []).append(value)
+        return files
+
+def save_refined_files(files, seq):
+    """Replace the cached vocabularies with a /list_refined download taken at sequence seq."""
+    with _lock:
+        db = _connect()
+        with db:
+            db.execute("DELETE FROM refined")
+            db.executemany("INSERT OR IGNORE INTO refined (file, value) VALUES (?, ?)",
+                           [(file_name, str(value)) for file_name, values in files.items() for value in values])
+            _set_meta(db, "refined_seq", int(seq or 0))
+
+def add_refined_files(files):
+    """Add {file name: values} to the cached vocabularies in one transaction."""
+    with _lock:
+        db = _connect()
+        with db:
+            db.executemany("INSERT OR IGNORE INTO refined (file, value) VALUES (?, ?)",
+                           [(file_name, str(value)) for file_name, values in files.items() for value in values])
+
+def apply_event(event, seq_key):
+    """Apply one change-feed event and record that the cache is current to it.
+
+    seq_key is "rows" or "refined": the tool applying the event says which
+    download it keeps current.
+    """
+    with _lock:
+        db = _connect()
+        with db:
+            if event["type"] in ("insert", "update"):
+                db.execute("INSERT OR REPLACE INTO rows (so, data, seq, version) VALUES (?, ?, ?, ?)",
+                           (str(event["so"]), json.dumps(event["row"]), event["seq"], event.get("version")))
+            elif event["type"] == "refined":
+                db.executemany("INSERT OR IGNORE INTO refined (file, value) VALUES (?, ?)",
+                               [(event["file"], str(value)) for value in event["values"]])
+            current = _get_meta(db, f"{seq_key}_seq")
+            if current is not None and event["seq"] > int(current):
+                _set_meta(db, f"{seq_key}_seq", event["seq"])
+
+# Settings
+
+def get_setting(name, default=None):
+    """Return a stored setting; legacy JSON state files are imported the first time."""
+    with _lock:
+        db = _connect()
+        row = db.execute("SELECT data FROM settings WHERE name = ?", (name,)).fetchone()
+        if row:
+            return json.loads(row[0])
+        for path in LEGACY_SETTINGS_FILES.get(name, []):
+            if os.path.exists(path):
+                try:
+                    with open(path, "r") as file:
+                        value = json.load(file)
+                except (OSError, ValueError):
+                    continue
+                set_setting(name, value)
+                return value
+        return default
+
+def set_setting(name, value):
+    with _lock:
+        db = _connect()
+        with db:
+            db.execute("INSERT OR REPLACE INTO settings (name, data, updated) VALUES (?, ?, ?)",
+                       (name, json.dumps(value), time.time()))
+
+# Writes and the outbox
+
+def queue_write(method, path, body, headers=None):
+    """Store a write (and headers such as If-Match) to send once the host is reachable again."""
+    with _lock:
+        db = _connect()
+        with db:
+            db.execute("INSERT INTO outbox (method, path, body, headers, created) VALUES (?, ?, ?, ?, ?)",
+                       (method, path, json.dumps(body), json.dumps(headers) if headers else None, time.time()))
+
+def pending_writes():
+    """Number of writes still waiting to be sent."""
+    with _lock:
+        return _connect().execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+def send_or_queue(server_url, method, path, body, headers=None):
+    """Send a write now; if the host cannot be reached or does not answer in time, queue it and return None.
+
+    Earlier queued writes go first so the host sees writes in the order they
+    were made. Extra headers (e.g. If-Match) are queued with the write, so an
+    edit replayed after the row changed on the host is refused, not applied.
+    """
+    if pending_writes():
+        flush_outbox(server_url)
+    if pending_writes():
+        queue_write(method, path, body, headers)
+        return None
+    started = time.perf_counter()
+    try:
+        response = requests.request(method, f"{server_url}{path}", json=body, headers={**CLIENT_HEADERS, **(headers or {})},
+                                    timeout=10)
+    except requests.exceptions.RequestException:
+        # A write that timed out may still have been applied; sent again, it is
+        # refused (409 for an S.O.# that exists, 412 for an If-Match), not doubled
+        queue_write(method, path, body, headers)
+        return None
+    telemetry.record(telemetry.request_name(method, path), time.perf_counter() - started, status=response.status_code)
+    if response.status_code == 429:
+        queue_write(method, path, body, headers)  # Host is over this PC's limit; the outbox retries after Retry-After
+        return None
+    return response
+
+def flush_outbox(server_url):
+    """Send queued writes in order; stops at the first one the host cannot take yet.
+
+    Only one process sends at a time (a second mainui would otherwise send
+    the same writes again); the others leave it to that one.
+    """
+    try:
+        with file_lock(CACHE_PATH, timeout=0):
+            _send_outbox(server_url)
+    except LockTimeout:
+        return
+
+def _send_outbox(server_url):
+    with _lock:
+        queued = _connect().execute(
+            "SELECT id, method, path, body, headers FROM outbox WHERE status = 'pending' ORDER BY id").fetchall()
+    for write_id, method, path, body, headers in queued:
+        try:
+            response = requests.request(method, f"{server_url}{path}", json=json.loads(body),
+                                        headers={**CLIENT_HEADERS, **json.loads(headers or "{}")}, timeout=10)
+        except requests.exceptions.RequestException:
+            return  # Still offline; keep the rest queued in order
+        with _lock:
+            db = _connect()
+            with db:
+                if response.status_code < 400:
+                    db.execute("DELETE FROM outbox WHERE id = ?", (write_id,))
+                elif response.status_code >= 500 or response.status_code == 429:
+                    return  # Host trouble; retry later
+                else:
+                    # The host refused it (e.g. duplicate S.O.#, or 412: the row was changed on the host
+                    # since it was edited offline); keep it for review instead of retrying forever
+                    error = response.text[:500]
+                    if response.status_code == 412:
+                        error = "The row was changed on the host after this offline edit; review it before saving again"
+                    db.execute("UPDATE outbox SET status = 'rejected', error = ? WHERE id = ?", (error, write_id))
+                    print(f"Queued write {method} {path} was rejected: {error}")
+
+def start_outbox_flusher(server_url):
+    """Retry queued writes in the background every OUTBOX_RETRY_SECONDS."""
+    def loop():
+        while True:
+            if pending_writes():
+                flush_outbox(server_url)
+            time.sleep(OUTBOX_RETRY_SECONDS)
+    threading.Thread(target=loop, daemon=True).start()
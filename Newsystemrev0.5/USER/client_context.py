@@ -0,0 +1,218 @@
+import importlib.util
+import json
+import re
+import threading
+import time
+import requests
+import client_cache
+import telemetry
+
+# State shared by every USER tool opened from the main menu.
+#
+# mainui.py runs the tools as windows in its own process, so the first tool
+# to need something (headers, refined values, settings) loads it here and
+# every tool opened after that reuses it instead of asking the server again.
+# Each tool still works on its own: run as a script, it loads the same
+# state the first time it asks.
+
+FLASK_SERVER = "http://localhost:5000"
+
+# When the host answers 429 (over this PC's rate limit), wait as long as its
+# Retry-After says and send again, for at most this many seconds in total
+MAX_RATE_LIMIT_WAIT = 60
+
+# Header that puts a request in the host's bulk class (exports, batch searches)
+BULK_REQUEST = {"X-Request-Class": "bulk"}
+
+# Compact table formats for bulk reads (/get_data, /query); see the host's wire_format.py.
+# Arrow is asked for only when pyarrow is installed here (imported when first used).
+ARROW = "application/vnd.apache.arrow.stream"
+SPLIT_JSON = "application/vnd.table.split+json"
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+# Default visual settings
+DEFAULT_VISUAL_SETTINGS = {
+    "font_family": "Arial",
+    "font_size": 12,
+    "bg_color": "#ffffff",
+    "fg_color": "#000000",
+    "button_bg_color": "#f0f0f0",
+    "button_fg_color": "#000000"
+}
+
+_lock = threading.Lock()
+_session = None
+_headers = None
+_refined_seq = None
+_visual_settings = None
+_flusher_started = False
+_rows_refresh_started = False
+
+class HostSession(requests.Session):
+    """requests.Session that identifies this PC, waits out the host's rate limit and times each request."""
+
+    def __init__(self):
+        super().__init__()
+        self.headers.update(client_cache.CLIENT_HEADERS)
+
+    def request(self, method, url, *args, **kwargs):
+        with telemetry.span(telemetry.request_name(method, url)) as attrs:  # Rate-limit waits included
+            response = self._send_waiting(method, url, *args, **kwargs)
+            attrs["status"] = response.status_code
+            return response
+
+    def _send_waiting(self, method, url, *args, **kwargs):
+        waited = 0
+        while True:
+            response = super().request(method, url, *args, **kwargs)
+            if response.status_code != 429 or waited >= MAX_RATE_LIMIT_WAIT:
+                return response
+            try:
+                delay = float(response.headers.get("Retry-After", 1))
+            except ValueError:
+                delay = 1
+            delay = min(max(delay, 0.1), MAX_RATE_LIMIT_WAIT - waited)
+            time.sleep(delay)
+            waited += delay
+
+def session():
+    """One HTTP session (kept-alive connection to the host) for all tools."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = HostSession()
+            start_telemetry()
+        return _session
+
+def get_headers(refresh=False):
+    """Column headers of the job table; the cached copy is used when offline."""
+    global _headers
+    if _headers is None or refresh:
+        try:
+            response = session().get(f"{FLASK_SERVER}/list_headers", timeout=10)
+            response.raise_for_status()
+            _headers = response.json().get("headers", [])
+            client_cache.set_setting("headers", _headers)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Could not fetch headers ({e}); using cached headers.")
+            _headers = client_cache.get_setting("headers", [])
+    return list(_headers)
+
+def refresh_refined():
+    """Download every refined file into the local cache. Returns its change-feed sequence."""
+    global _refined_seq
+    try:
+        response = session().get(f"{FLASK_SERVER}/list_refined", timeout=30)
+        response.raise_for_status()
+        _refined_seq = int(response.headers.get("X-Change-Seq", 0))
+        client_cache.save_refined_files(response.json().get("files", {}), _refined_seq)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Could not fetch refined files ({e}); using cached refined values.")
+        _refined_seq = client_cache.get_seq("refined") or 0
+    return _refined_seq
+
+def refined_seq():
+    """Sequence the cached refined values are current to, downloading them once per process."""
+    if _refined_seq is None:
+        return refresh_refined()
+    return max(_refined_seq, client_cache.get_seq("refined") or 0)
+
+def refresh_rows():
+    """Bring the local rows cache (the tools' offline copy) up to date with the host.
+
+    The changes since the cached sequence are applied (GET /changes); with
+    nothing cached, or when the host can no longer replay them, every row is
+    downloaded (GET /get_data). Returns the sequence the cache is current to.
+    """
+    seq = client_cache.get_seq("rows")
+    try:
+        if seq:  # 0: nothing was ever cached
+            response = session().get(f"{FLASK_SERVER}/changes", params={"since": seq}, timeout=30)
+            events = response.json().get("events", []) if response.status_code == 200 else None
+            if events is not None and not any(event["type"] in ("reload", "refined_sync") for event in events):
+                for event in events:
+                    client_cache.apply_event(event, "rows")
+                return client_cache.get_seq("rows")
+        response = session().get(f"{FLASK_SERVER}/get_data", headers=table_accept(), timeout=300)
+        response.raise_for_status()
+        columns, data = read_table(response)
+        seq = int(response.headers.get("X-Change-Seq", 0))
+        client_cache.save_rows([dict(zip(columns, values)) for values in data], seq)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(f"Could not refresh cached rows ({e}); using cached rows.")
+    return client_cache.get_seq("rows")
+
+def start_rows_refresh():
+    """Refresh the rows cache on a background thread (once per process), so offline reads have every row."""
+    global _rows_refresh_started
+    with _lock:
+        if _rows_refresh_started:
+            return
+        _rows_refresh_started = True
+    threading.Thread(target=refresh_rows, daemon=True).start()
+
+def table_accept(frame=False):
+    """Accept header for a bulk read; Arrow is only worth it when the caller wants a DataFrame."""
+    formats = [ARROW, f"{SPLIT_JSON};q=0.9"] if frame and HAVE_PYARROW else [SPLIT_JSON]
+    return {"Accept": ", ".join(formats + ["application/json;q=0.5"])}
+
+def read_table(response):
+    """Rows of a bulk response as (columns, list of value lists), whatever format the host chose."""
+    media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+    if media_type == SPLIT_JSON:
+        table = json.loads(response.content)
+        return table["columns"], table["data"]
+    if media_type == ARROW:
+        frame = read_frame(response)
+        return list(frame.columns), frame.astype(object).where(frame.notna(), None).values.tolist()
+    records = response.json()  # An older host: JSON records
+    columns = list(records[0]) if records else []
+    return columns, [[record.get(column) for column in columns] for record in records]
+
+def read_frame(response):
+    """A bulk response as a pandas DataFrame (pandas is imported on first use; it is slow to import)."""
+    import pandas as pd
+    media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+    if media_type == ARROW:
+        import pyarrow
+        return pyarrow.ipc.open_stream(response.content).read_pandas()
+    columns, rows = read_table(response)
+    return pd.DataFrame(rows, columns=columns)
+
+def column_key(header):
+    """Canonical key of a column header; the same as schema.column_key on the host."""
+    return re.sub(r"[^0-9A-Za-z#$&]+", "_", str(header)).strip("_")
+
+def refined_file_name(header):
+    """Name the host serves a column's refined values under ("Tube C.L.R." -> "Tube_C_L_R.txt")."""
+    return f"{column_key(header)}.txt"
+
+def vocabulary_key(value):
+    """How the host compares refined values: case and runs of whitespace are ignored."""
+    return " ".join(str(value).split()).casefold()
+
+def visual_settings():
+    """Visual settings merged with the defaults (loaded once per process)."""
+    global _visual_settings
+    if _visual_settings is None:
+        _visual_settings = dict(DEFAULT_VISUAL_SETTINGS)
+        _visual_settings.update(client_cache.get_setting("visual_settings") or {})
+    return dict(_visual_settings)
+
+def save_visual_settings(settings):
+    global _visual_settings
+    client_cache.set_setting("visual_settings", settings)
+    _visual_settings = dict(settings)
+
+def start_telemetry():
+    """Start sending the tools' timings to the host (once per process; see telemetry.py)."""
+    telemetry.start(FLASK_SERVER, client_cache.CLIENT_HEADERS)
+
+def start_outbox_flusher():
+    """Start the background sender for offline writes (once per process)."""
+    global _flusher_started
+    with _lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+    client_cache.start_outbox_flusher(FLASK_SERVER)
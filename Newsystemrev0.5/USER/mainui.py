@@ -1,108 +1,120 @@
 import tkinter as tk
-import subprocess
+import importlib
+import time
 from tkinter import messagebox
-import os
-import json
+import client_context
+import telemetry
 
-# Determine the directory containing this script and use it as the base for relative paths
-base_directory = os.path.dirname(os.path.abspath(__file__))
+# The tools run as windows inside this process instead of a new Python
+# interpreter per button: the HTTP session, headers, refined values and
+# settings they load are kept in client_context and shared, and each tool's
+# module (with pandas, tkcalendar, ...) is only imported the first time its
+# button is clicked.
 
-# Configuration file for visual settings
-CONFIG_FILE = os.path.join(base_directory, "visual_settings.json")
-
-# Default visual settings
-default_settings = {
-    "font_family": "Arial",
-    "font_size": 12,
-    "bg_color": "#ffffff",
-    "fg_color": "#000000",
-    "button_bg_color": "#f0f0f0",
-    "button_fg_color": "#000000"
-}
+root = None  # Main menu window
+menu_buttons = []  # Buttons restyled when the visual settings change
 
 # Load visual settings
 def load_settings():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, "r") as file:
-                loaded_settings = json.load(file)
-            for key, value in default_settings.items():
-                loaded_settings.setdefault(key, value)
-            return loaded_settings
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load settings: {e}")
-    return default_settings
-
-settings = load_settings()
-
-# Define functions for specific scripts
-def run_script(script_name):
-    """Run a specific script without showing the command prompt."""
-    subprocess.Popen(
-        ["python", os.path.join(base_directory, script_name)],
-        creationflags=subprocess.CREATE_NO_WINDOW
-    )
+    try:
+        return client_context.visual_settings()
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to load settings: {e}")
+    return dict(client_context.DEFAULT_VISUAL_SETTINGS)
+
+# Define functions for specific tools
+def open_tool(module_name, function_name="main"):
+    """Open a tool as a window of the main menu, importing its module on first use."""
+    try:
+        module = importlib.import_module(module_name)
+        getattr(module, function_name)(root)
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to open {module_name}: {e}")
+
+def run_file_explorer():
+    import open_file_explorer
+    open_file_explorer.open_file_explorer(open_file_explorer.path_to_open)
+
+def apply_settings(settings):
+    """Restyle the main menu after the visual settings were saved."""
+    root.configure(bg=settings["bg_color"])
+    for button in menu_buttons:
+        button.config(font=(settings["font_family"], settings["font_size"]),
+                      bg=settings["button_bg_color"], fg=settings["button_fg_color"])
 
 def run_visual_settings():
-    """Run the Visual Settings script and close the main UI."""
-    root.destroy()  # Close the current main UI window
-    subprocess.Popen(["python", os.path.join(base_directory, "Visual_Settings.py")])
-
-# Initialize Tkinter Window
-root = tk.Tk()
-root.title("User Main Menu")
-root.geometry("520x300")  # Adjusted window size for more buttons
-root.configure(bg=settings["bg_color"])
-
-# Explicitly define button labels and their associated scripts
-# Explicitly define button labels and their associated scripts
-buttons = [
-    ("Add Data", lambda: run_script("USERADD.py")),
-    ("Edit Data", lambda: run_script("USEREDIT.py")),
-    ("Show Data", lambda: run_script("ShowData.py")),
-    ("File Explorer (J:)", lambda: run_script("open_file_explorer.py")),
-    ("Visual Settings", run_visual_settings),  # Add Visual Settings button that closes main UI
-    ("P.O.# Finder", lambda: run_script("testpobatching.py")),  # Add P.O.# Finder button
-    ("Coming Soon", None)
-]
-
-
-# Standard button size
-button_width = 20
-button_height = 2
-
-# Create and place buttons in the window
-for index, (label, command) in enumerate(buttons):
-    row = index // 3
-    col = index % 3
-    if command:
-        button = tk.Button(
-            root,
-            text=label,
-            command=command,
-            width=button_width,
-            height=button_height,
-            font=(settings["font_family"], settings["font_size"]),
-            bg=settings["button_bg_color"],
-            fg=settings["button_fg_color"]
-        )
-    else:
-        button = tk.Button(
-            root,
-            text=label,
-            state="disabled",
-            width=button_width,
-            height=button_height,
-            font=(settings["font_family"], settings["font_size"]),
-            bg=settings["button_bg_color"],
-            fg=settings["button_fg_color"]
-        )
-    button.grid(row=row, column=col, padx=10, pady=5)
-
-# Configure grid rows and columns to distribute the available space
-for i in range((len(buttons) // 3) + 1):  # Adjust rows dynamically
-    root.grid_rowconfigure(i, weight=1)
-for i in range(3):  # Three columns
-    root.grid_columnconfigure(i, weight=1)
-
-root.mainloop()
+    """Open the Visual Settings editor; saving restyles the main menu."""
+    try:
+        import Visual_Settings
+        Visual_Settings.settings_editor(root, on_save=apply_settings)
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to open Visual_Settings: {e}")
+
+def main():
+    global root
+    started = time.perf_counter()
+    settings = load_settings()
+
+    # Initialize Tkinter Window
+    root = tk.Tk()
+    root.title("User Main Menu")
+    root.geometry("520x300")  # Adjusted window size for more buttons
+    root.configure(bg=settings["bg_color"])
+
+    # Explicitly define button labels and their associated tools
+    buttons = [
+        ("Add Data", lambda: open_tool("USERADD")),
+        ("Edit Data", lambda: open_tool("USEREDIT")),
+        ("Show Data", lambda: open_tool("ShowData")),
+        ("File Explorer (J:)", run_file_explorer),
+        ("Visual Settings", run_visual_settings),  # Visual Settings restyles the main UI when saved
+        ("P.O.# Finder", lambda: open_tool("testpobatching")),  # Add P.O.# Finder button
+        ("Coming Soon", None)
+    ]
+
+
+    # Standard button size
+    button_width = 20
+    button_height = 2
+
+    # Create and place buttons in the window
+    for index, (label, command) in enumerate(buttons):
+        row = index // 3
+        col = index % 3
+        if command:
+            button = tk.Button(
+                root,
+                text=label,
+                command=command,
+                width=button_width,
+                height=button_height,
+                font=(settings["font_family"], settings["font_size"]),
+                bg=settings["button_bg_color"],
+                fg=settings["button_fg_color"]
+            )
+        else:
+            button = tk.Button(
+                root,
+                text=label,
+                state="disabled",
+                width=button_width,
+                height=button_height,
+                font=(settings["font_family"], settings["font_size"]),
+                bg=settings["button_bg_color"],
+                fg=settings["button_fg_color"]
+            )
+        button.grid(row=row, column=col, padx=10, pady=5)
+        menu_buttons.append(button)
+
+    # Configure grid rows and columns to distribute the available space
+    for i in range((len(buttons) // 3) + 1):  # Adjust rows dynamically
+        root.grid_rowconfigure(i, weight=1)
+    for i in range(3):  # Three columns
+        root.grid_columnconfigure(i, weight=1)
+
+    telemetry.window_shown(root, "mainui.first_window", started)
+    client_context.start_telemetry()
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -13,4 +13,5 @@ def open_file_explorer(path):
 path_to_open = r"J:"  # Change this to the path you want
 
 # Open the file explorer at the specified path
-open_file_explorer(path_to_open)
+if __name__ == "__main__":
+    open_file_explorer(path_to_open)
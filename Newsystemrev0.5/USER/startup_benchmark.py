@@ -0,0 +1,118 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Startup-time benchmark for the USER tools.
+#
+# Each tool is started in a fresh Python process (a cold start, as on the shop
+# PCs) and two times are measured from process start:
+#   import        - until the tool's module is imported (must do no I/O)
+#   first window  - until the tool's first window has been drawn
+# The first-window time needs a display and, for the tools that talk to it,
+# a running host; without a display only the import time is measured.
+#
+#   python startup_benchmark.py                    # every tool, 3 runs each
+#   python startup_benchmark.py --tools ShowData --repeat 5
+#   python startup_benchmark.py --max-import 0.5 --max-window 3
+#
+# With --max-import/--max-window the exit status is 1 when a tool's median is
+# over the budget, so the benchmark can be run before a release to catch
+# startup regressions.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Tool module -> function that opens its first window given a master window
+TOOLS = {
+    "mainui": None,  # The main menu builds its own root; only its import is timed
+    "USERADD": "main",
+    "USEREDIT": "main",
+    "ShowData": "main",
+    "testpobatching": "main",
+    "Visual_Settings": "settings_editor",
+}
+
+# Runs in the child process. Prints "import <s>" and "window <s>" (or "window -").
+CHILD = r"""
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {base_dir!r})
+import importlib
+module = importlib.import_module({module!r})
+print(f"import {{time.perf_counter() - start:.4f}}", flush=True)
+if {function!r} is None:
+    print("window -", flush=True)
+    sys.exit(0)
+import tkinter as tk
+try:
+    master = tk.Tk()
+except tk.TclError:
+    print("window -", flush=True)  # No display
+    sys.exit(0)
+master.withdraw()
+getattr(module, {function!r})(master)
+windows = [w for w in master.winfo_children() if isinstance(w, tk.Toplevel)]
+if windows:
+    windows[0].update()
+    print(f"window {{time.perf_counter() - start:.4f}}", flush=True)
+else:
+    print("window -", flush=True)  # The tool could not open (e.g. host unreachable)
+master.destroy()
+"""
+
+def run_once(module, function, timeout):
+    """Start the tool in a new interpreter; return (import seconds, first-window seconds or None)."""
+    code = CHILD.format(base_dir=BASE_DIR, module=module, function=function)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            timeout=timeout, cwd=BASE_DIR)
+    times = {}
+    for line in result.stdout.splitlines():
+        name, _, value = line.partition(" ")
+        if name in ("import", "window"):
+            times[name] = None if value == "-" else float(value)
+    if "import" not in times:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "no output")
+    return times["import"], times.get("window")
+
+def median_or_none(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the USER tools.")
+    parser.add_argument("--tools", nargs="+", default=list(TOOLS), choices=list(TOOLS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per tool (the median is reported)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a run is abandoned")
+    parser.add_argument("--max-import", type=float, help="fail if a median import time is over this")
+    parser.add_argument("--max-window", type=float, help="fail if a median first-window time is over this")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'tool':<18}{'import (s)':>12}{'first window (s)':>18}")
+    for module in args.tools:
+        imports, windows = [], []
+        try:
+            for _ in range(args.repeat):
+                import_time, window_time = run_once(module, TOOLS[module], args.timeout)
+                imports.append(import_time)
+                windows.append(window_time)
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"{module:<18}{'error':>12}  {e}")
+            failed = True
+            continue
+
+        import_time, window_time = median_or_none(imports), median_or_none(windows)
+        window_text = f"{window_time:.3f}" if window_time is not None else "n/a"
+        print(f"{module:<18}{import_time:>12.3f}{window_text:>18}")
+        if args.max_import is not None and import_time > args.max_import:
+            print(f"  {module}: import time over the {args.max_import}s budget")
+            failed = True
+        if args.max_window is not None and window_time is not None and window_time > args.max_window:
+            print(f"  {module}: first-window time over the {args.max_window}s budget")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
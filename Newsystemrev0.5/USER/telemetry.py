@@ -0,0 +1,108 @@
+import atexit
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import requests
+
+# Timings of what the user waits for in the USER tools, reported to the host.
+#
+# Tools record spans - how long opening a window, a request to the host,
+# filling a table or an export took - and a background thread sends them to
+# the host's POST /telemetry every FLUSH_SECONDS; GET /telemetry/summary on
+# the host ranks them across all PCs. Span names say what was timed:
+#   "<tool>.first_window"      - from opening a tool until its window is drawn
+#   "request <METHOD> <path>"  - one request to the host (client_context, client_cache)
+#   "<tool>.<step>"            - a step inside a tool, e.g. "ShowData.populate_table"
+#
+# Recording only appends to a list; nothing waits on the host. Spans are kept
+# in memory only: when the host cannot be reached they are held (up to
+# MAX_BUFFERED, oldest dropped first) and sent later, and lost if the tool closes.
+
+ENABLED = True  # False keeps timings off the network entirely
+FLUSH_SECONDS = 30  # How often buffered spans are sent
+MAX_BUFFERED = 5000  # Spans held while the host is unreachable
+MAX_BATCH = 1000  # Spans per POST (the host's limit)
+
+_lock = threading.Lock()
+_spans = deque(maxlen=MAX_BUFFERED)
+_server_url = None
+_headers = {}
+_started = False
+
+def record(name, seconds, **attrs):
+    """Add one finished span; attrs are small extra facts (rows shown, status code...)."""
+    if not ENABLED:
+        return
+    span = {"name": name, "seconds": round(seconds, 4), "at": time.time()}
+    if attrs:
+        span["attrs"] = attrs
+    with _lock:
+        _spans.append(span)
+
+@contextmanager
+def span(name, **attrs):
+    """Time the with block as a span; yields attrs so the block can add to them."""
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        record(name, time.perf_counter() - started, **attrs)
+
+def window_shown(window, name, started):
+    """Record span name once the window has been drawn; started is the time.perf_counter() it was asked for at."""
+    window.after_idle(lambda: record(name, time.perf_counter() - started))
+
+def request_name(method, url):
+    """Span name of a request: path segments with digits (S.O.#s, job ids) become "*" so they group."""
+    path = re.sub(r"^[a-z]+://[^/]+", "", url).split("?")[0]
+    return f"request {method.upper()} " + "/".join("*" if re.search(r"\d", part) else part for part in path.split("/"))
+
+def flush(timeout=10):
+    """Send the buffered spans now. Returns False when the host could not take them."""
+    if _server_url is None:
+        return False  # Not started yet; start() sends what was recorded before it
+    while True:
+        with _lock:
+            batch = [_spans.popleft() for _ in range(min(MAX_BATCH, len(_spans)))]
+        if not batch:
+            return True
+        try:
+            response = requests.post(f"{_server_url}/telemetry", json={"spans": batch}, headers=_headers, timeout=timeout)
+        except requests.exceptions.RequestException:
+            response = None
+        if response is not None and response.status_code == 404:
+            # An older host without /telemetry: stop collecting instead of growing the buffer
+            disable()
+            return False
+        if response is None or response.status_code >= 400:
+            with _lock:
+                _spans.extendleft(reversed(batch))  # Keep them in order for the next try
+            return False
+
+def disable():
+    global ENABLED
+    ENABLED = False
+    with _lock:
+        _spans.clear()
+
+def start(server_url, headers):
+    """Start sending spans to the host (once per process; client_context calls it with its session)."""
+    global _started, _server_url, _headers
+    with _lock:
+        if _started or not ENABLED:
+            return
+        _started = True
+        _server_url, _headers = server_url, dict(headers)
+
+    def loop():
+        while ENABLED:
+            time.sleep(FLUSH_SECONDS)
+            flush()
+
+    threading.Thread(target=loop, daemon=True).start()
+    atexit.register(flush, timeout=2)  # What the last FLUSH_SECONDS recorded